@@ -19,90 +19,216 @@ This module contains classes and functions related to building the arpa internal
 
 import os
 import json
+import gzip
+import hashlib
 import logging
 import sys
 import subprocess
 import re
-import tempfile
+import shlex
+import fnmatch
+import threading
+import collections
+import concurrent.futures
 import voluptuous
 import voluptuous.humanize
 import lib.arpa_helper as helper
+import lib.arpa_graph as arpa_graph
+import lib.arpa_snapshot as arpa_snapshot
+import lib.arpa_profile as arpa_profile
 
 class CompileCommands:
-    ''' Class that contains an internal representation of the input compile commands '''
+    ''' Class that contains an internal representation of the input compile commands.
+    Only the flags extracted from each command are kept '''
+
+    # flags whose value is either joined to them or the next argument.
+    # Arguments are matched by prefix, in this order, so a flag must come after
+    # any longer flag that it is a prefix of
+    separable_flags = (helper.CC_SYSTEM_INCLUDE, helper.CC_QUOTE_INCLUDE,
+                       helper.CC_FORCE_INCLUDE, helper.CC_INCLUDE, helper.CC_DEFINE,
+                       helper.CC_UNDEFINE)
 
     def __init__(self, cc_path):
         self.path = cc_path
         self.__validate()
-        self.file_2_command = {}
+        # file -> flag set, shared by identical command lines
+        self.file_2_flags = {}
+        self.command_2_flags = {}
+        self.path_2_abspath = {}
 
 
     def __validate(self):
-        if not os.path.exists(self.path):
+        if not helper.FS_CACHE.exists(self.path):
             logging.error("Specified path does not point to an existing file: %s", self.path)
             sys.exit(1)
 
 
-    def create_file_2_command_map(self):
-        ''' create a map between files in the code base and the correspoding compile command '''
+    def iter_entries(self, chunk_size=1 << 16):
+        ''' generate the entries of the compilation database one at a time,
+        reading the file in chunks instead of loading it all '''
+        decoder = json.JSONDecoder()
         with open(self.path, "r") as handle:
-            all_commands = json.load(handle)
+            buffer = handle.read(chunk_size)
+            pos = 0
+            at_end = not buffer
+            expected = "["
+            while True:
+                while pos < len(buffer) and (buffer[pos].isspace() or
+                                             (buffer[pos] == "," and expected != "[")):
+                    pos += 1
+                if pos == len(buffer):
+                    if at_end:
+                        break
+                    buffer = handle.read(chunk_size)
+                    pos = 0
+                    at_end = not buffer
+                    continue
+
+                if expected == "[":
+                    if buffer[pos] != "[":
+                        break
+                    expected = "{"
+                    pos += 1
+                    continue
+                if buffer[pos] == "]":
+                    return
+
+                try:
+                    entry, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    more = handle.read(chunk_size)
+                    if not more:
+                        break
+                    # the entry spans several chunks
+                    buffer = buffer[pos:] + more
+                    pos = 0
+                    continue
+                yield entry
+                pos = end
+                if pos > chunk_size:
+                    buffer = buffer[pos:]
+                    pos = 0
 
-        for compilation_command in all_commands:
-            cc_file = str(compilation_command['file'])
-            cc_command = compilation_command['command'].split()
-            self.file_2_command[cc_file] = cc_command
+        logging.error("Compile commands are not a valid JSON array: %s", self.path)
+        sys.exit(1)
+
+
+    def create_file_2_flags_map(self):
+        ''' map each file in the code base to the flags of its compile command '''
+        for compilation_command in self.iter_entries():
+            directory = compilation_command.get("directory", "")
+            raw_file = str(compilation_command["file"])
+            cc_file = raw_file
+            if not os.path.isabs(cc_file):
+                cc_file = os.path.abspath(os.path.join(directory, cc_file))
+            if "arguments" in compilation_command:
+                cc_command = compilation_command["arguments"]
+            else:
+                command = compilation_command["command"]
+                # str.split is equivalent to (and much faster than) shlex without quotes
+                if '"' in command or "'" in command or "\\" in command:
+                    cc_command = shlex.split(command)
+                else:
+                    cc_command = command.split()
+
+            # the flags of identical command lines are extracted once
+            key = (directory, self.__get_flag_arguments(cc_command, raw_file))
+            if key not in self.command_2_flags:
+                self.command_2_flags[key] = self.__extract_flags(key[1], directory)
+            self.file_2_flags[cc_file] = self.command_2_flags[key]
 
 
     @classmethod
-    def __get_flag_arg(cls, flag, arg, next_arg):
-        ''' if string corresponds to correct flag, return corresponding argument. '''
-        if arg.startswith(flag):
-            if len(arg) == len(flag):
-                return next_arg
-            if len(arg) > len(flag):
-                return arg[len(flag):]
-        else:
-            return None
+    def __get_flag_arguments(cls, cc_command, raw_file):
+        ''' drop the compiler, source file and output file from a command '''
+        flag_arguments = []
+        skip_next = False
+        for arg in cc_command[1:]:
+            if skip_next:
+                skip_next = False
+            elif arg == "-o":
+                skip_next = True
+            elif arg not in ("-c", raw_file):
+                flag_arguments.append(arg)
+        return tuple(flag_arguments)
+
+
+    def __extract_flags(self, flag_arguments, directory):
+        ''' find all supported flags in a single pass over the arguments.
+        Return a flag set of the included dirs, the defines and the other flags '''
+        includes = []
+        defines = []
+        other_flags = []
+        index = 0
+        while index < len(flag_arguments):
+            arg = flag_arguments[index]
+            index += 1
+            if arg.startswith(helper.CC_STD):
+                other_flags.append((helper.CC_STD, arg[len(helper.CC_STD):]))
+                continue
+            for flag in self.separable_flags:
+                if not arg.startswith(flag):
+                    continue
+                if len(arg) > len(flag):
+                    value = arg[len(flag):]
+                elif index < len(flag_arguments):
+                    value = flag_arguments[index]
+                    index += 1
+                else:
+                    break
+
+                if flag == helper.CC_INCLUDE:
+                    includes.append(self.__get_abspath(value, directory))
+                elif flag == helper.CC_DEFINE:
+                    defines.append(value)
+                elif flag == helper.CC_UNDEFINE:
+                    other_flags.append((flag, value))
+                else:
+                    other_flags.append((flag, self.__get_abspath(value, directory,
+                                                                 required=False)))
+                break
+        return arpa_graph.FlagSet(tuple(includes), tuple(defines), tuple(other_flags))
+
 
+    def __get_abspath(self, include, directory, required=True):
+        '''transform included path to an absolute path. Relative paths are relative to
+        the directory of the compile command, or else to the compile commands file.
+        Each (directory, path) pair is resolved once '''
+        key = (directory, include)
+        if key not in self.path_2_abspath:
+            self.path_2_abspath[key] = self.__find_abspath(include, directory, required)
+        return self.path_2_abspath[key]
 
-    def __get_abspath(self, include):
-        '''transform included path to an absolute path '''
-        if os.path.isabs(include) and os.path.exists(include):
+
+    def __find_abspath(self, include, directory, required):
+        if os.path.isabs(include) and helper.FS_CACHE.exists(include):
             return include
+        path = os.path.join(directory, include)
+        if directory and helper.FS_CACHE.exists(path):
+            return os.path.abspath(path)
+        if not required:
+            return os.path.abspath(path)
         path = os.path.join(os.path.dirname(self.path), include)
-        if os.path.exists(path):
+        if helper.FS_CACHE.exists(path):
             return os.path.abspath(path)
 
         logging.error("include path not found at %s", path)
         sys.exit(1)
 
 
-    def __get_flags(self, prefix, file):
-        command_split = self.file_2_command[file]
-        all_flags = []
-        for command_tuple in enumerate(command_split):
-            cmd_ind = command_tuple[0]
-            next_arg = "" if cmd_ind == len(command_split)-1 else command_split[cmd_ind+1]
-            flag = self.__get_flag_arg(prefix, command_split[cmd_ind], next_arg)
-            if flag:
-                all_flags.append(flag)
-
-        return all_flags
-
-
     def get_includes(self, file):
         ''' return included directories (from the compile command) for a given file '''
-        all_includes = self.__get_flags(helper.CC_INCLUDE, file)
-        all_includes_absolute = []
-        for include_path in all_includes:
-            all_includes_absolute.append(self.__get_abspath(include_path))
-        return all_includes_absolute
+        return list(self.file_2_flags[file].includes)
 
 
     def get_defines(self, file):
         ''' return cmd line defines (from the compile command) for a given file '''
-        return self.__get_flags(helper.CC_DEFINE, file)
+        return list(self.file_2_flags[file].defines)
+
+
+    def get_other_flags(self, file):
+        ''' return the (flag, value) pairs of the other supported flags for a given file '''
+        return list(self.file_2_flags[file].flags)
 
 
 class InternalRepresentation:
@@ -110,42 +236,100 @@ class InternalRepresentation:
     for a given code base '''
 
     def __init__(self, root_path):
-        self.representation = {helper.JSON_INFO: root_path,
-                               helper.JSON_FILE: {}, }
+        self.root_path = root_path
+        self.inputs = None
+        self.graph = arpa_graph.CallGraph()
+        # snapshot mapped by read_snapshot, which the graph reads from
+        self.snapshot = None
+
+
+    @property
+    def representation(self):
+        ''' json view of the internal representation, built on demand '''
+        return self.__create_representation(self.graph.to_json())
+
+
+    def __create_representation(self, files_json):
+        representation = {helper.JSON_INFO: self.root_path,
+                          helper.JSON_FLAG_SETS: self.graph.flag_sets_to_json(),
+                          helper.JSON_FILE: files_json, }
+        if self.inputs is not None:
+            representation[helper.JSON_INPUTS] = self.inputs
+        if self.graph.summaries is not None:
+            representation[helper.JSON_SUMMARIES] = self.graph.summaries.to_json()
+        if self.graph.reverse_index is not None:
+            representation[helper.JSON_REVERSE_INDEX] = self.graph.reverse_index.to_json()
+        return representation
+
 
+    def resolve_path(self, path):
+        ''' return the normalized absolute path of a file. Relative paths are relative
+        to the root of the project, as in <git diff> '''
+        return os.path.normpath(os.path.join(self.root_path, path))
 
-    def __add_element(self, file_path, key, value):
-        self.representation[helper.JSON_FILE][file_path][key] = value
+
+    def copy(self):
+        ''' return a copy of internal_rep that can be updated without changing it '''
+        internal_rep = InternalRepresentation(self.root_path)
+        internal_rep.inputs = self.inputs
+        internal_rep.graph = self.graph.copy()
+        return internal_rep
+
+
+    def has_summaries(self):
+        ''' check whether the function summaries are up to date with the call graph '''
+        return self.graph.has_summaries()
+
+
+    def add_summaries(self):
+        ''' precompute the transitive dependencies of every function '''
+        self.graph.summaries = arpa_graph.FunctionSummaries.compute(self.graph)
+
+
+    def has_reverse_index(self):
+        ''' check whether the reverse index is up to date with the call graph '''
+        return self.graph.has_reverse_index()
+
+
+    def add_reverse_index(self):
+        ''' precompute the harnesses that depend on every file and function '''
+        self.graph.get_reverse_index()
+
+
+    def has_file(self, file_path):
+        ''' check whether a file has an entry in internal_rep '''
+        return self.graph.has_file(file_path)
+
+
+    def get_includes(self, file_path):
+        ''' return the included dirs of a file in internal_rep '''
+        return self.graph.get_flag_set(file_path).includes
 
 
     def add_file_entry(self, file_path):
         ''' add file as key in internal_rep '''
-        file_name = os.path.basename(file_path)
-        if file_path in self.representation[helper.JSON_FILE]:
+        if self.graph.has_file(file_path):
             logging.warning("Clashing file name: %s", file_path)
         else:
             # TODO Use relative file path as key instead of absolute file path
-            self.representation[helper.JSON_FILE][file_path] = {}
-            self.__add_element(file_path, helper.JSON_NAME, file_name)
+            self.graph.add_file(file_path)
 
 
-    def add_defines(self, file_path, defines_list):
-        ''' add cmd line defines to internal_rep '''
-        self.__add_element(file_path, helper.JSON_DEF, defines_list)
+    def add_flag_set(self, file_path, flag_set):
+        ''' add the included dirs, cmd line defines and other flags of a file to
+        internal_rep. Files with identical flags share a single flag set '''
+        self.graph.set_flag_set(file_path, flag_set)
 
 
-    def add_includes(self, file_path, includes_list):
-        ''' add included dirs to internal_rep '''
-        self.__add_element(file_path, helper.JSON_INC, includes_list)
+    def clear_flags(self):
+        ''' remove the flag sets of all files in internal_rep '''
+        self.graph.clear_flag_sets()
 
 
     def add_dependencies(self, file_2_dependencies):
         ''' add fct=level dependencies to internal_rep '''
         for file in file_2_dependencies:
-            if file in self.representation[helper.JSON_FILE]:
-                self.representation[helper.JSON_FILE][file][helper.JSON_FCT] = \
-                    file_2_dependencies[file]
-            else:
+            if not self.graph.has_file(file):
                 if file.endswith(".c"):
                     logging.info("source file <%s> not found"
                                  " in internal representation. Adding.", file)
@@ -155,56 +339,102 @@ class InternalRepresentation:
                 else:
                     logging.error("<%s> not found in internal representation. Exiting.", file)
                     sys.exit(1)
-                self.representation[helper.JSON_FILE][file] = {
-                    helper.JSON_NAME: os.path.basename(file),
-                    helper.JSON_INC: [],
-                    helper.JSON_DEF: [],
-                    helper.JSON_FCT: file_2_dependencies[file],
-                }
+                self.graph.add_file(file)
+            self.graph.set_functions(file, file_2_dependencies[file])
+
+        # files with no dependencies within the internal representation
+        # keep the empty dependencies set created with their entry
+
+
+    def validate(self, level=helper.VALIDATE_FULL):
+        ''' validate the internal representation using voluptuous (full),
+        using an equivalent check of each distinct value (fast), or not at all (off) '''
+        if level == helper.VALIDATE_OFF:
+            return
+        if level == helper.VALIDATE_FAST:
+            violations = RepresentationValidator(self).find_violations()
+            for violation in violations:
+                logging.error("Invalid internal representation: %s", violation)
+            if violations:
+                sys.exit(1)
+            return
 
-        # create and empty dependencies set for files with
-        # no dependencies within the internal representation
-        for file in self.representation[helper.JSON_FILE]:
-            if file not in file_2_dependencies:
-                self.representation[helper.JSON_FILE][file][helper.JSON_FCT] = {}
-
-
-    def validate(self):
-        ''' validate the internal representation using voluptuous '''
         def h_c_file(value):
             if isinstance(value, str) and (value.endswith(".c") or value.endswith(".h")):
                 return value
             raise voluptuous.Invalid("Not an existing .c or .h file.")
 
         def existing_file(value):
-            if isinstance(value, str) and os.path.isfile(value):
+            if helper.FS_CACHE.isfile(value):
                 return value
             raise voluptuous.Invalid("Not an existing file.")
 
         def existing_directory(value):
-            if isinstance(value, str) and os.path.isdir(value):
+            if helper.FS_CACHE.isdir(value):
                 return value
             raise voluptuous.Invalid("Not an existing directory.")
 
         def compiler_define(value):
-            regex = re.compile(r"\w+(=.+)?")
-            if isinstance(value, str) and regex.match(value):
+            if isinstance(value, str) and RepresentationValidator.define_regex.match(value):
                 return value
             raise voluptuous.Invalid("Not a valid compiler define.")
 
+        def compiler_flag(value):
+            if isinstance(value, list) and len(value) == 2 and \
+                    value[0] in helper.CC_OTHER_FLAGS and isinstance(value[1], str):
+                return value
+            raise voluptuous.Invalid("Not a supported compiler flag.")
+
         def function_name(value):
-            regex = re.compile(r"\w+")
-            if isinstance(value, str) and regex.match(value):
+            if isinstance(value, str) and RepresentationValidator.function_regex.match(value):
                 return value
             raise voluptuous.Invalid("Not a valid function name.")
 
+        flag_set_id = voluptuous.All(int, voluptuous.Range(min=0,
+                                                            max=len(self.graph.flag_sets) - 1))
+
         schema = voluptuous.Schema({
             helper.JSON_INFO: existing_directory,
+            helper.JSON_INPUTS: {
+                helper.JSON_CC_PATH: existing_file,
+                helper.JSON_CC_MTIME: int,
+                helper.JSON_DIGEST: str,
+                helper.JSON_FPRINTS: {h_c_file: str},
+                helper.JSON_DISCOVERY: {
+                    helper.JSON_MODE: voluptuous.Any(helper.DISCOVER_TREE, helper.DISCOVER_CC),
+                    helper.JSON_EXTRA: [existing_directory],
+                },
+                helper.JSON_BACKEND: voluptuous.Any(helper.BACKEND_CFLOW,
+                                                    helper.BACKEND_INDEXER),
+            },
+            voluptuous.Optional(helper.JSON_SUMMARIES): {
+                helper.JSON_FILE: [str],
+                helper.JSON_FLAG_SETS: [{
+                    helper.JSON_INC: [str],
+                    helper.JSON_DEF: [str],
+                    helper.JSON_FLAGS: [compiler_flag],
+                }],
+                helper.JSON_MISSING: [[voluptuous.Any(int, function_name)]],
+                helper.JSON_FCT: {str: {function_name: {
+                    helper.JSON_DEPS: str,
+                    helper.JSON_FLAG_SETS: str,
+                    helper.JSON_MISSING: str,
+                }}},
+            },
+            voluptuous.Optional(helper.JSON_REVERSE_INDEX): {
+                helper.JSON_HARNESSES: [h_c_file],
+                helper.JSON_FILE: {h_c_file: str},
+                helper.JSON_FCT: {h_c_file: {function_name: str}},
+            },
+            helper.JSON_FLAG_SETS: [{
+                helper.JSON_INC: [existing_directory],
+                helper.JSON_DEF: [compiler_define],
+                helper.JSON_FLAGS: [compiler_flag],
+            }],
             helper.JSON_FILE: {
                 voluptuous.All(h_c_file, existing_file): {
                     helper.JSON_NAME: h_c_file,
-                    helper.JSON_INC: [existing_directory],
-                    helper.JSON_DEF: [compiler_define],
+                    helper.JSON_FLAG_SET: flag_set_id,
                     helper.JSON_FCT: {
                         function_name: {
                             function_name: voluptuous.Any(voluptuous.All(h_c_file, existing_file),
@@ -217,165 +447,920 @@ class InternalRepresentation:
         voluptuous.humanize.validate_with_humanized_errors(self.representation, schema)
 
 
+    def add_inputs(self, inputs):
+        ''' record the fingerprint of the inputs used to build the internal_rep '''
+        self.inputs = inputs
+
+
+    def is_up_to_date(self, inputs):
+        ''' check whether the internal_rep was built from the given inputs '''
+        return self.inputs == inputs
+
+
+    def find_changed_files(self, inputs):
+        ''' compare the recorded file fingerprints to the given inputs.
+        Return the files that were added or modified and the files that were removed '''
+        old_fingerprints = self.inputs[helper.JSON_FPRINTS]
+        new_fingerprints = inputs[helper.JSON_FPRINTS]
+        changed_files = [f for f in new_fingerprints
+                         if old_fingerprints.get(f) != new_fingerprints[f]]
+        removed_files = [f for f in old_fingerprints if f not in new_fingerprints]
+        return changed_files, removed_files
+
+
+    def update_dependencies(self, file_2_dependencies, changed_files, removed_files):
+        ''' splice the fct-level dependencies of changed files into internal_rep,
+        then resolve again the calls that may now point to a different file.
+        Calls are resolved with the rules of CallGraphBackend.resolve_unknown_calls,
+        which every backend applies after a full run, so the result does not depend
+        on the files they were resolved to before '''
+        graph = self.graph
+        # functions whose set of definitions may change
+        touched_fcts = set()
+        for file in changed_files + removed_files:
+            if graph.has_file(file):
+                touched_fcts.update(graph.get_entry(file).functions)
+        for file in removed_files:
+            graph.remove_file(file)
+        for file in changed_files:
+            if graph.has_file(file):
+                graph.get_entry(file).functions = {}
+
+        for file in file_2_dependencies:
+            if not graph.has_file(file):
+                graph.add_file(file)
+            graph.set_functions(file, file_2_dependencies[file])
+            touched_fcts.update(graph.get_entry(file).functions)
+
+        definitions = FunctionDefinitions(
+            {file_id: entry.functions for file_id, entry in graph.entries.items()},
+            sort_key=lambda file_id: graph.files[file_id])
+        touched_files = {graph.files.get_id(f) for f in changed_files + removed_files}
+        for file_id, entry in graph.entries.items():
+            for calls in entry.functions.values():
+                for i in range(0, len(calls), 2):
+                    if calls[i + 1] == arpa_graph.NO_FILE or calls[i + 1] in touched_files \
+                            or calls[i] in touched_fcts or definitions.is_ambiguous(calls[i]):
+                        resolved = definitions.resolve(calls[i], file_id)
+                        calls[i + 1] = arpa_graph.NO_FILE if resolved is None else resolved
+        graph.invalidate()
+
+
+    @classmethod
+    def __open_json(cls, path, mode):
+        ''' open a json file, compressed with gzip if its name ends with .gz '''
+        if path.endswith(".gz"):
+            return gzip.open(path, mode + "t")
+        return open(path, mode)
+
+
+    @classmethod
+    def __indent(cls, json_text, level):
+        ''' indent json text, whose strings never contain a newline, as a value nested
+        in level objects '''
+        return json_text.replace("\n", "\n" + "    " * level)
+
+
     def write_to_file(self, path):
-        ''' output a file continaing the json internal representation used in the tool '''
-        outjson = json.dumps(self.representation, indent=4)
-        with open(path, "w") as handle:
-            print(outjson, file=handle)
+        ''' output a file continaing the json internal representation used in the tool.
+        File entries are encoded and written one at a time, as json.dump would
+        with an indent of 4 '''
+        with self.__open_json(path, "w") as handle:
+            separator = "{\n"
+            for key, value in self.__create_representation(None).items():
+                handle.write("%s    %s: " % (separator, json.dumps(key)))
+                separator = ",\n"
+                if key == helper.JSON_FILE:
+                    self.__write_entries(handle)
+                else:
+                    handle.write(self.__indent(json.dumps(value, indent=4), 1))
+            handle.write("\n}\n")
+
+
+    def __write_entries(self, handle):
+        separator = "{\n"
+        for path, json_entry in self.graph.iter_json():
+            handle.write("%s        %s: %s" % (separator, json.dumps(path),
+                                               self.__indent(json.dumps(json_entry, indent=4), 2)))
+            separator = ",\n"
+        handle.write("{}" if separator == "{\n" else "\n    }")
+
+
+    def read_from_file(self, path):
+        ''' load a json internal representation saved by write_to_file.
+        File entries are decoded and added to the call graph one at a time '''
+        self.inputs = None
+        self.graph = arpa_graph.CallGraph()
+        flag_set_ids = None
+        # entries that refer to a flag set table found after them
+        deferred_entries = {}
+        section_2_json = {}
+        with self.__open_json(path, "r") as handle:
+            reader = JsonObjectReader(handle)
+            for key in reader.iter_keys():
+                if key == helper.JSON_FILE:
+                    for file_path in reader.iter_keys():
+                        json_entry = reader.decode()
+                        if flag_set_ids is None and helper.JSON_FLAG_SET in json_entry:
+                            deferred_entries[file_path] = json_entry
+                        else:
+                            self.graph.add_json_entry(file_path, json_entry, flag_set_ids)
+                elif key == helper.JSON_FLAG_SETS:
+                    flag_set_ids = self.graph.add_json_flag_sets(reader.decode())
+                else:
+                    section_2_json[key] = reader.decode()
+        for file_path, json_entry in deferred_entries.items():
+            self.graph.add_json_entry(file_path, json_entry, flag_set_ids)
+
+        self.root_path = section_2_json[helper.JSON_INFO]
+        self.inputs = section_2_json.get(helper.JSON_INPUTS)
+        # summaries saved before flag sets and missing call tables were introduced
+        # are dropped
+        summaries_json = section_2_json.get(helper.JSON_SUMMARIES, {})
+        if helper.JSON_FLAG_SETS in summaries_json and helper.JSON_MISSING in summaries_json:
+            self.graph.summaries = arpa_graph.FunctionSummaries.from_json(summaries_json)
+        if helper.JSON_REVERSE_INDEX in section_2_json:
+            self.graph.reverse_index = arpa_graph.ReverseIndex.from_json(
+                section_2_json[helper.JSON_REVERSE_INDEX])
+
+
+    def write_snapshot(self, path):
+        ''' output a binary snapshot of the internal representation '''
+        meta = {helper.JSON_INFO: self.root_path, helper.JSON_INPUTS: self.inputs}
+        arpa_snapshot.Snapshot.write(path, meta, self.graph)
+
+
+    def read_snapshot(self, path):
+        ''' map a binary snapshot saved by write_snapshot. File entries, summaries and
+        the reverse index are decoded when they are first accessed.
+        Return False if the snapshot cannot be used '''
+        snapshot = arpa_snapshot.Snapshot.load(path)
+        if snapshot is None:
+            return False
+        self.close()
+        self.snapshot = snapshot
+        self.root_path = snapshot.meta[helper.JSON_INFO]
+        self.inputs = snapshot.meta[helper.JSON_INPUTS]
+        self.graph = snapshot.create_graph()
+        return True
+
+
+    def close(self):
+        ''' unmap the snapshot internal_rep was read from, if any, once it is replaced '''
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+
+class RepresentationValidator:
+    ''' Class that checks the constraints of the voluptuous schema used by
+    InternalRepresentation.validate directly on the call graph. Each distinct path,
+    flag set and function name is checked once, and all violations are reported '''
+
+    define_regex = re.compile(r"\w+(=.+)?")
+    function_regex = re.compile(r"\w+")
+    input_keys = {helper.JSON_CC_PATH, helper.JSON_CC_MTIME, helper.JSON_DIGEST,
+                  helper.JSON_FPRINTS, helper.JSON_DISCOVERY, helper.JSON_BACKEND}
+
+    def __init__(self, internal_rep):
+        self.internal_rep = internal_rep
+        self.violations = []
+        self.fct_2_is_valid = {}
 
 
-class CflowInstance:
-    ''' Class that encapsulates all the info in a given Cflow call '''
+    @classmethod
+    def __is_h_c_file(cls, value):
+        return isinstance(value, str) and (value.endswith(".c") or value.endswith(".h"))
+
+
+    def __check(self, valid, location, message, value):
+        if not valid:
+            self.violations.append("%s: %s: %s" % (location, message, value))
+
+
+    def __check_inputs(self, inputs):
+        if inputs is None:
+            self.__check(False, helper.JSON_INPUTS, "required key not provided", None)
+            return
+        self.__check(set(inputs) == self.input_keys, helper.JSON_INPUTS,
+                     "unexpected keys", sorted(inputs))
+        self.__check(helper.FS_CACHE.isfile(inputs.get(helper.JSON_CC_PATH)), helper.JSON_CC_PATH,
+                     "not an existing file", inputs.get(helper.JSON_CC_PATH))
+        self.__check(isinstance(inputs.get(helper.JSON_CC_MTIME), int), helper.JSON_CC_MTIME,
+                     "not an integer", inputs.get(helper.JSON_CC_MTIME))
+        self.__check(isinstance(inputs.get(helper.JSON_DIGEST), str), helper.JSON_DIGEST,
+                     "not a string", inputs.get(helper.JSON_DIGEST))
+        for path, fingerprint in inputs.get(helper.JSON_FPRINTS, {}).items():
+            self.__check(self.__is_h_c_file(path) and isinstance(fingerprint, str),
+                         helper.JSON_FPRINTS, "not a .c or .h file fingerprint", path)
+
+        discovery = inputs.get(helper.JSON_DISCOVERY, {})
+        self.__check(discovery.get(helper.JSON_MODE) in (helper.DISCOVER_TREE,
+                                                         helper.DISCOVER_CC),
+                     helper.JSON_MODE, "not a discovery mode", discovery.get(helper.JSON_MODE))
+        for extra_dir in discovery.get(helper.JSON_EXTRA, []):
+            self.__check(helper.FS_CACHE.isdir(extra_dir), helper.JSON_EXTRA,
+                         "not an existing directory", extra_dir)
+        self.__check(inputs.get(helper.JSON_BACKEND) in (helper.BACKEND_CFLOW,
+                                                         helper.BACKEND_INDEXER),
+                     helper.JSON_BACKEND, "not a backend", inputs.get(helper.JSON_BACKEND))
+
+
+    def __check_function_name(self, fct_id, location):
+        if fct_id not in self.fct_2_is_valid:
+            fct = self.internal_rep.graph.functions[fct_id]
+            self.fct_2_is_valid[fct_id] = bool(self.function_regex.match(fct))
+            self.__check(self.fct_2_is_valid[fct_id], location,
+                         "not a valid function name", fct)
+
+
+    def __check_flag_set(self, flag_set_id, location):
+        flag_sets = self.internal_rep.graph.flag_sets
+        if not 0 <= flag_set_id < len(flag_sets):
+            self.__check(False, location, "not a valid flag set", flag_set_id)
+            return
+        flag_set = flag_sets[flag_set_id]
+        for include in flag_set.includes:
+            self.__check(helper.FS_CACHE.isdir(include), location,
+                         "not an existing directory", include)
+        for define in flag_set.defines:
+            self.__check(self.define_regex.match(define), location,
+                         "not a valid compiler define", define)
+        for flag in flag_set.flags:
+            self.__check(flag[0] in helper.CC_OTHER_FLAGS, location,
+                         "not a supported compiler flag", flag[0])
+
+
+    def find_violations(self):
+        ''' return a description of every violation found '''
+        internal_rep = self.internal_rep
+        graph = internal_rep.graph
+        self.__check(helper.FS_CACHE.isdir(internal_rep.root_path), helper.JSON_INFO,
+                     "not an existing directory", internal_rep.root_path)
+        self.__check_inputs(internal_rep.inputs)
+
+        checked_flag_sets = set()
+        called_file_2_is_valid = {arpa_graph.NO_FILE: True}
+        for file_id, entry in graph.entries.items():
+            path = graph.files[file_id]
+            self.__check(self.__is_h_c_file(path) and helper.FS_CACHE.isfile(path), path,
+                         "not an existing .c or .h file", path)
+            self.__check(self.__is_h_c_file(entry.name), path,
+                         "not a .c or .h file name", entry.name)
+
+            # each flag set is checked once, and reported at the first file using it
+            if entry.flag_set not in checked_flag_sets:
+                checked_flag_sets.add(entry.flag_set)
+                self.__check_flag_set(entry.flag_set, path)
+
+            for fct_id, calls in entry.functions.items():
+                self.__check_function_name(fct_id, path)
+                for i in range(0, len(calls), 2):
+                    self.__check_function_name(calls[i], path)
+                    called_file = calls[i + 1]
+                    if called_file not in called_file_2_is_valid:
+                        called_path = graph.files[called_file]
+                        called_file_2_is_valid[called_file] = \
+                            self.__is_h_c_file(called_path) and helper.FS_CACHE.isfile(called_path)
+                        self.__check(called_file_2_is_valid[called_file], path,
+                                     "not an existing .c or .h file", called_path)
+        return self.violations
+
+
+class JsonObjectReader:
+    ''' Class that reads a json object from a text file one member at a time, in chunks.
+    The value of a member is either decoded at once, or read as a nested object,
+    so that large objects never are in memory at once '''
+
+    whitespace = " \t\n\r"
+
+    def __init__(self, handle, chunk_size=1 << 16):
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+
+
+    def __read_more(self, size):
+        ''' drop the part of the buffer that was read, and append at least size
+        characters to it. Return False at the end of the file '''
+        chunk = self.handle.read(max(size, self.chunk_size))
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+
+    def __peek(self):
+        ''' skip whitespace. Return the next character, or "" at the end of the file '''
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.__read_more(self.chunk_size):
+                return self.buffer[self.pos:self.pos + 1]
+
+
+    def __expect(self, characters):
+        ''' read the next character, which must be one of the given ones. Return it '''
+        char = self.__peek()
+        if not char or char not in characters:
+            raise ValueError("Expected one of <%s> in json at: %r"
+                             % (characters, self.buffer[self.pos:self.pos + 40]))
+        self.pos += 1
+        return char
+
+
+    def decode(self):
+        ''' decode the json value at the current position '''
+        self.__peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # the value goes on in the next chunks. The buffer doubles in size,
+                # so that large values are decoded a logarithmic number of times
+                if not self.__read_more(len(self.buffer) - self.pos):
+                    raise
+                continue
+            # a number at the end of the buffer may go on in the next chunk
+            if end == len(self.buffer) and self.__read_more(self.chunk_size):
+                continue
+            self.pos = end
+            return value
+
+
+    def iter_keys(self):
+        ''' generate the keys of the json object at the current position. The value of
+        each key must be read, with decode or iter_keys, before the next key is generated '''
+        self.__expect("{")
+        if self.__peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            if not isinstance(key, str):
+                raise ValueError("Expected an object key in json: %r" % (key,))
+            self.__expect(":")
+            yield key
+            if self.__expect(",}") == "}":
+                return
+
+
+class FunctionDefinitions:
+    ''' Class that maps function names to the files in which they are defined '''
+
+    def __init__(self, file_2_dependencies, sort_key=None):
+        self.sort_key = sort_key
+        self.fct_2_files = {}
+        for file, functions in file_2_dependencies.items():
+            for fct in functions:
+                if fct in self.fct_2_files:
+                    self.fct_2_files[fct].append(file)
+                else:
+                    self.fct_2_files[fct] = [file]
 
-    def __init__(self):
-        self.command = ["cflow"]
-        self.file_2_dependencies = {}
-        temp_file = tempfile.NamedTemporaryFile(delete=False)
-        self.output_path = temp_file.name
-        temp_file.close()
 
+    def is_ambiguous(self, fct):
+        ''' check whether fct is defined in several files '''
+        return len(self.fct_2_files.get(fct, ())) > 1
+
+
+    def resolve(self, fct, calling_file):
+        ''' return the file defining fct, or None if fct is not defined anywhere.
+        The result only depends on the files defining fct '''
+        defining_files = self.fct_2_files.get(fct)
+        if not defining_files:
+            return None
+        if len(defining_files) == 1:
+            return defining_files[0]
+        # a function defined in several files is most likely static
+        if calling_file in defining_files:
+            return calling_file
+        logging.debug("Ambiguous definition of %s called from %s: %s",
+                      fct, calling_file, defining_files)
+        return min(defining_files, key=self.sort_key)
+
+
+class InputFingerprint:
+    ''' Class that summarizes the inputs from which an internal representation is built '''
+
+    def __init__(self, cc_path, discovery, backend=helper.BACKEND_CFLOW):
+        self.cc_path = os.path.abspath(cc_path)
+        self.discovery = discovery
+        self.backend = backend
 
-    def __add_to_command(self, item):
-        self.command.append(item)
+
+    def __file_fingerprints(self):
+        ''' map all sources under root to their size and modification time '''
+        file_2_fingerprint = {}
+        for f_path in self.discovery.walk():
+            f_stat = helper.FS_CACHE.stat(f_path)
+            if f_stat is None:
+                continue
+            file_2_fingerprint[f_path] = "%d:%d" % (f_stat.st_size, f_stat.st_mtime_ns)
+        return file_2_fingerprint
 
 
     @classmethod
-    def __find_h_and_c(cls, root_dir):
-        '''From the project root, return a list of all header and source files in the project'''
+    def __tree_digest(cls, file_2_fingerprint):
+        ''' hash the fingerprints of all sources under root '''
+        digest = hashlib.sha1()
+        for f_path in sorted(file_2_fingerprint):
+            digest.update(("%s:%s\n" % (f_path, file_2_fingerprint[f_path])).encode())
+        return digest.hexdigest()
+
+
+    def compute(self):
+        ''' return the current fingerprint as a json-serializable dict '''
+        file_2_fingerprint = self.__file_fingerprints()
+        return {helper.JSON_CC_PATH: self.cc_path,
+                helper.JSON_CC_MTIME: os.stat(self.cc_path).st_mtime_ns,
+                helper.JSON_DIGEST: self.__tree_digest(file_2_fingerprint),
+                helper.JSON_FPRINTS: file_2_fingerprint,
+                helper.JSON_DISCOVERY: self.discovery.describe(),
+                helper.JSON_BACKEND: self.backend}
+
+
+class SourceDiscovery:
+    ''' Class that finds the source and header files to analyze within a project '''
+
+    include_regex = re.compile(r'^\s*#\s*include\s*[<"]([^>"]+)[>"]', re.MULTILINE)
+
+    def __init__(self, root_path, mode=helper.DISCOVER_TREE, extra_dirs=(), excludes=()):
+        self.root_path = os.path.abspath(root_path)
+        self.mode = mode
+        self.extra_dirs = [os.path.abspath(d) for d in extra_dirs]
+        self.excludes = list(helper.DEFAULT_EXCLUDES) + list(excludes)
+        self.__read_ignore_file()
+
+        self.file_2_included = {}
+        self.header_cache = {}
+
+
+    def __read_ignore_file(self):
+        ''' add the glob patterns listed in the project ignore file to the excludes '''
+        ignore_path = os.path.join(self.root_path, helper.IGNORE_FILE_NAME)
+        if not helper.FS_CACHE.isfile(ignore_path):
+            return
+        with open(ignore_path, "r") as handle:
+            for line in handle:
+                pattern = line.strip()
+                if pattern and not pattern.startswith("#"):
+                    self.excludes.append(pattern.rstrip("/"))
+
+
+    def __matches_exclude(self, rel_path):
+        ''' patterns containing a slash match the path relative to root,
+        other patterns match the file or directory name '''
+        name = os.path.basename(rel_path)
+        for pattern in self.excludes:
+            if fnmatch.fnmatch(rel_path if "/" in pattern else name, pattern):
+                return True
+        return False
+
+
+    def is_excluded(self, path):
+        ''' check whether a path, or one of its parent directories, is excluded '''
+        rel_path = os.path.relpath(path, self.root_path)
+        if rel_path.startswith(os.pardir):
+            return False
+        parts = rel_path.split(os.sep)
+        return any(self.__matches_exclude("/".join(parts[:i + 1])) for i in range(len(parts)))
+
+
+    def describe(self):
+        ''' return the discovery settings as a json-serializable dict '''
+        return {helper.JSON_MODE: self.mode,
+                helper.JSON_EXTRA: self.extra_dirs}
+
+
+    def walk(self, top=None):
+        ''' return all header and source files under top (by default, the project root).
+        Excluded directories are pruned during the walk '''
+        top = os.path.abspath(top or self.root_path)
         all_h_and_c = []
-        exclude = ["aws-proof-build-assistant"]
-        for root, dirs, files in os.walk(root_dir):
-            dirs[:] = [d for d in dirs if d not in exclude]
-            for file in files:
-                if file.endswith(".h") or file.endswith(".c"):
-                    f_path = os.path.abspath(os.path.join(root, file))
-                    all_h_and_c.append(f_path)
+        # same order as a top-down os.walk, with directories listed through the cache
+        stack = [top]
+        while stack:
+            root = stack.pop()
+            entries = helper.FS_CACHE.list_dir(root)
+            if entries is None:
+                continue
+            rel_root = os.path.relpath(root, self.root_path)
+            rel_root = "" if rel_root == os.curdir else rel_root.replace(os.sep, "/") + "/"
+            dirs = []
+            for name, kind in entries.items():
+                path = os.path.join(root, name)
+                if kind is None:
+                    # like os.walk, do not descend into symlinks to directories
+                    if helper.FS_CACHE.isdir(path):
+                        continue
+                elif kind[0]:
+                    if not self.__matches_exclude(rel_root + name):
+                        dirs.append(path)
+                    continue
+                if (name.endswith(".h") or name.endswith(".c")) \
+                        and not self.__matches_exclude(rel_root + name):
+                    all_h_and_c.append(path)
+            stack.extend(reversed(dirs))
         return all_h_and_c
 
 
-    def create_command(self, root_path):
-        ''' initialize the cflow command'''
-        # TODO
-        # -- Currently, we look through the entire code base to find source
-        # and header files, then we run cflow on all the found files.
-        # -- Instead, we should only run cflow on the files included in the
-        # compilation commands found by cmake
-        h_and_c_files = self.__find_h_and_c(root_path)
+    def find_sources(self, file_2_includes):
+        ''' return the files to analyze, given the included directories of each
+        translation unit found in the compilation commands '''
+        if self.mode == helper.DISCOVER_TREE:
+            return self.walk()
+
+        all_includes = []
+        for includes in file_2_includes.values():
+            all_includes.extend(i for i in includes if i not in all_includes)
+
+        unit_2_includes = {os.path.abspath(f): includes
+                           for f, includes in file_2_includes.items()}
+        for extra_dir in self.extra_dirs:
+            for f_path in self.walk(extra_dir):
+                unit_2_includes.setdefault(f_path, all_includes)
+        return self.__find_reachable(unit_2_includes)
+
+
+    def __included_names(self, file):
+        if file not in self.file_2_included:
+            try:
+                with open(file, "r", errors="ignore") as handle:
+                    self.file_2_included[file] = self.include_regex.findall(handle.read())
+            except OSError:
+                self.file_2_included[file] = []
+        return self.file_2_included[file]
+
+
+    def __resolve_header(self, name, including_dir, include_dirs):
+        key = (name, including_dir, include_dirs)
+        if key not in self.header_cache:
+            self.header_cache[key] = None
+            for directory in (including_dir,) + include_dirs:
+                path = os.path.normpath(os.path.join(directory, name))
+                if helper.FS_CACHE.isfile(path):
+                    self.header_cache[key] = path
+                    break
+        return self.header_cache[key]
+
+
+    def __is_in_tree(self, path):
+        return (path == self.root_path or path.startswith(self.root_path + os.sep)) \
+            and not self.is_excluded(path)
+
+
+    def __find_reachable(self, unit_2_includes):
+        ''' return the translation units and all project headers they include,
+        directly or transitively '''
+        found = set()
+        visited = set()
+        for unit, includes in unit_2_includes.items():
+            if not self.__is_in_tree(unit) or not helper.FS_CACHE.isfile(unit):
+                continue
+            found.add(unit)
+            include_dirs = tuple(includes)
+            worklist = [unit]
+            while worklist:
+                current = worklist.pop()
+                for name in self.__included_names(current):
+                    header = self.__resolve_header(name, os.path.dirname(current), include_dirs)
+                    if header is None or (header, include_dirs) in visited:
+                        continue
+                    visited.add((header, include_dirs))
+                    if self.__is_in_tree(header):
+                        found.add(header)
+                        worklist.append(header)
+        return sorted(found)
+
+
+class CflowOutputError(ValueError):
+    ''' Error raised when the output of cflow does not describe a call tree '''
+
+
+class CallGraphBackend:
+    ''' Base class for the tools that find function-level dependencies in a code base.
+    After run_command, file_2_dependencies maps each file to the functions it defines,
+    and each of these functions to the functions it calls and the files defining them '''
+
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+        self.file_2_dependencies = {}
+
+
+    def create_command(self, root_path, h_and_c_files=None):
+        ''' set the files to analyze (by default, all files found under root_path) '''
+        raise NotImplementedError
+
+
+    def run_command(self):
+        ''' analyze the files and fill the file_2_dependencies field '''
+        raise NotImplementedError
+
+
+    def resolve_unknown_calls(self):
+        ''' resolve calls whose callee location is unknown using all function definitions.
+        Calls to functions defined in several files are resolved again, so that they
+        do not depend on which definition the backend saw '''
+        definitions = FunctionDefinitions(self.file_2_dependencies)
+        for file, functions in self.file_2_dependencies.items():
+            for called_functions in functions.values():
+                for called_fct, called_file in called_functions.items():
+                    if called_file is None or definitions.is_ambiguous(called_fct):
+                        called_functions[called_fct] = definitions.resolve(called_fct, file)
+
+
+class CflowInstance(CallGraphBackend):
+    ''' Class that encapsulates all the info in a given Cflow call '''
+
+    # START REGEX DESCRIPTION:
+    # A given line in the cflow output may contain up to 4 pieces
+    # of relevant information that will be matched by the regex below:
+    # 1. fct:
+    #    --the name of a function in the code base
+    # 2. file:
+    #    --the file in which this function is defined
+    #      (if cflow is able to find that file)
+    # 3. rec:
+    #    --whether this function is recursive or not (if the function
+    #      is recursive, a "(R)" is added to the output line)
+    # 4. ref:
+    #    --if this function has previously been described in the cflow output,
+    #      cflow references that first description by adding "[see ##]" to
+    #      the output line, where ## is the line number in the cflow output
+    #      where the function is first described
+
+    # cflow also outputs the function signature, but we do no parse that in arpa
+    # END REGEX DESCRIPTION
+
+    # START EXAMPLE:
+    # Here is an example of a line found in the cflow output
+    # that is parsed using the below regex:
+    #
+    # "    s2n_map_embiggen() <S2N_RESULT s2n_map_embiggen (struct s2n_map *map, uint32_t capacity) at /path/to/s2n_map.c:50> (R): [see 657]"
+    #
+    # The regex will match as follows:
+    # fct: "s2n_map_embiggen"
+    # file: "/path/to/s2n_map.c"
+    # rec: "(R)", which means that this function is recursive
+    # ref: "[see 657]", which means that this function has been previously
+    #                   described in line 657 of the cflow output
+
+    # Concretely, this line means that the "/path/to/s2n_map.c" file contains
+    # a recursive "s2n_map_embiggen" function that has already been described
+    # in the cflow output
+    # END EXAMPLE
+    line_regex = re.compile(r"(?P<fct>\w+)\(\)"
+                            r"( <.+ at (?P<file>.+):\d+>"
+                            r"( (?P<rec>\(R\)))?:)?"
+                            r"( \[see (?P<ref>\d+)\])?")
+    word_regex = re.compile(r"\w+$")
+    location_regex = re.compile(r"^[^:]*:\d+:\s*")
+
+    def __init__(self, jobs=1):
+        super().__init__(jobs)
+        self.command = ["cflow"]
+        self.stderr_counts = collections.Counter()
+        self.n_regex_misses = 0
+
+        # when running on several cores, each shard is a separate cflow call
+        self.shards = []
+        self.shard_results = []
+
+
+    def __add_to_command(self, item):
+        self.command.append(item)
+
+
+    def create_command(self, root_path, h_and_c_files=None):
+        ''' initialize the cflow command. Unless a list of files is given,
+        cflow runs on all source and header files found under the root path'''
+        # The list of files is given by a SourceDiscovery instance, which either
+        # looks through the entire code base, or only considers the files included
+        # in the compilation commands found by cmake and the headers they include
+        if h_and_c_files is None:
+            h_and_c_files = SourceDiscovery(root_path).walk()
+        if self.jobs > 1 and len(h_and_c_files) > 1:
+            for shard_files in self.__split_in_shards(h_and_c_files):
+                shard = CflowInstance()
+                shard.create_command(root_path, shard_files)
+                self.shards.append(shard)
+            return
         self.command.extend(h_and_c_files)
-        self.command.extend(["-A", "--no-main", "-o%s" %(self.output_path), "--brief"])
+        self.command.extend(["-A", "--no-main", "--brief"])
+
+
+    def __split_in_shards(self, h_and_c_files):
+        ''' split files in shards of similar total size, one per job '''
+        n_shards = min(self.jobs, len(h_and_c_files))
+        shards = [[] for _ in range(n_shards)]
+        shard_sizes = [0] * n_shards
+
+        def file_size(f_path):
+            try:
+                return os.path.getsize(f_path)
+            except OSError:
+                return 0
+
+        # assign the largest files first, each to the currently smallest shard
+        for f_path in sorted(h_and_c_files, key=file_size, reverse=True):
+            smallest = shard_sizes.index(min(shard_sizes))
+            shards[smallest].append(f_path)
+            shard_sizes[smallest] += file_size(f_path)
+        return shards
 
 
     def run_command(self):
-        ''' run the cflow command '''
+        ''' run the cflow command, parsing its output while it is produced '''
+        try:
+            self.__run_all()
+        except CflowOutputError as error:
+            logging.error("%s", error)
+            sys.exit(1)
+
+        for cflow_message, count in self.stderr_counts.most_common():
+            logging.warning("cflow stderr > %s (%d occurrences)", cflow_message, count)
+        arpa_profile.PROFILER.count("regex_misses", self.n_regex_misses)
+        arpa_profile.PROFILER.count("cflow_messages", sum(self.stderr_counts.values()))
+
+
+    def __run_all(self):
+        if self.shards:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.jobs, initializer=arpa_profile.start_worker,
+                    initargs=(arpa_profile.PROFILER.enabled,)) as executor:
+                for file_2_dependencies, stderr_counts, n_regex_misses, parse_stats in \
+                        executor.map(CflowInstance.run_shard, self.shards):
+                    self.shard_results.append(file_2_dependencies)
+                    self.stderr_counts.update(stderr_counts)
+                    self.n_regex_misses += n_regex_misses
+                    arpa_profile.PROFILER.merge_phase(arpa_profile.PHASE_PARSE_OUTPUT,
+                                                      parse_stats)
+            self.__merge_shards()
+        else:
+            self.__run_and_parse()
+            # as after merging shards, so that any number of jobs gives the same graph
+            self.resolve_unknown_calls()
+
+
+    def __run_and_parse(self):
         proc = subprocess.Popen(self.command, stdout=subprocess.PIPE,
                                 stderr=subprocess.PIPE, universal_newlines=True)
-        _, errors = proc.communicate()
-        for cflow_message in errors.split("\n"):
-            logging.warning("cflow stderr > %s", cflow_message)
+        # a daemon thread never keeps the interpreter from exiting
+        stderr_reader = threading.Thread(target=self.__count_errors, args=(proc.stderr,),
+                                         daemon=True)
+        stderr_reader.start()
+        try:
+            self.parse_output(proc.stdout)
+        except BaseException:
+            # cflow may still be writing, and would block forever on the full pipe
+            proc.kill()
+            raise
+        finally:
+            proc.stdout.close()
+            stderr_reader.join()
+            proc.wait()
+        if proc.returncode:
+            logging.warning("cflow exited with return code %d", proc.returncode)
+
+
+    def __count_errors(self, stream):
+        ''' aggregate cflow messages, ignoring the location they refer to '''
+        for cflow_message in stream:
+            cflow_message = cflow_message.strip()
+            if cflow_message:
+                self.stderr_counts[self.location_regex.sub("", cflow_message)] += 1
+        stream.close()
+
+
+    @classmethod
+    def run_shard(cls, shard):
+        ''' run and parse a single shard, in a worker process. Return its
+        file_2_dependencies, cflow messages, number of lines that could not be parsed
+        and the measurements of its parse_output phase '''
+        shard.__run_and_parse()
+        return shard.file_2_dependencies, shard.stderr_counts, shard.n_regex_misses, \
+            arpa_profile.PROFILER.pop_phase(arpa_profile.PHASE_PARSE_OUTPUT)
+
+
+    def __merge_shards(self):
+        ''' merge the shard outputs. A header may be analyzed by several shards, so
+        the calls of each function are merged. Calls into functions defined in another
+        shard are unknown to cflow, and are resolved using all function definitions '''
+        for shard_file_2_dependencies in self.shard_results:
+            for file, functions in shard_file_2_dependencies.items():
+                merged_functions = self.file_2_dependencies.setdefault(file, {})
+                for fct, called_functions in functions.items():
+                    merged_calls = merged_functions.setdefault(fct, {})
+                    for called_fct, called_file in called_functions.items():
+                        # a shard that knows the location of a called function wins
+                        if merged_calls.get(called_fct) is None:
+                            merged_calls[called_fct] = called_file
+        self.resolve_unknown_calls()
+
+
+    def __split_line(self, line):
+        ''' return the (fct, file, ref) parts of a stripped cflow output line,
+        or None if the line cannot be parsed '''
+        # fast path for the common line shapes, which are:
+        # "fct()", "fct() <... at file:N>:" and "fct() <... at file:N> (R):",
+        # optionally followed by " [see N]"
+        if line.endswith("()"):
+            if self.word_regex.match(line, 0, len(line) - 2):
+                return line[:-2], None, None
+        else:
+            fct, sep, rest = line.partition("() <")
+            ref = None
+            if rest.endswith("]"):
+                rest, sep_ref, ref = rest.rpartition(" [see ")
+                ref = ref[:-1] if sep_ref else None
+            if rest.endswith("> (R):"):
+                rest = rest[:-len("> (R):")]
+            elif rest.endswith(">:"):
+                rest = rest[:-len(">:")]
+            else:
+                sep = ""
+            location = rest.rpartition(" at ")[2]
+            file, _, line_number = location.rpartition(":")
+            if sep and file and line_number.isdigit() and self.word_regex.match(fct) and \
+                    (ref is None or ref.isdigit()):
+                return fct, file, ref
+
+        # slow path for all other lines
+        match = self.line_regex.match(line)
+        if not match:
+            return None
+        return match["fct"], match["file"], match["ref"]
+
 
+    def parse_output(self, cflow_out):
+        '''parse cflow output lines, integrate them into the file_2_dependencies field'''
+        # cflow output is parsed while it is produced, so this phase includes the time
+        # spent waiting for cflow
+        with arpa_profile.PROFILER.phase(arpa_profile.PHASE_PARSE_OUTPUT):
+            self.__parse_lines(cflow_out)
 
-    def parse_output(self):
-        '''parse cflow output file, integrate it into the file_2_dependencies field'''
+
+    def __parse_lines(self, cflow_out):
         # TODO Use the `--print-level` command line flag when calling cflow
         # to simplify parsing of the depth level of a function call
         # (the depth level will be explicitly indicated, and we will no longer
         # be required to count the number of leading whitespaces)
 
         current_at_level = []
-        with open(self.output_path, "r") as cflow_out:
-            cnt = 0
-            for cur_line in cflow_out:
-                # get depth of current line
-                leading_spaces = len(cur_line) - len(cur_line.lstrip(" "))
-                cur_depth = leading_spaces // 4
-                if leading_spaces % 4:
-                    logging.warning("Line has %d leading spaces: %s", leading_spaces, cur_line[:-1])
-
-                # START REGEX DESCRIPTION:
-                # A given line in the cflow output may contain up to 4 pieces
-                # of relevant information that will be matched by the regex below:
-                # 1. fct:
-                #    --the name of a function in the code base
-                # 2. file:
-                #    --the file in which this function is defined
-                #      (if cflow is able to find that file)
-                # 3. rec:
-                #    --whether this function is recursive or not (if the function
-                #      is recursive, a "(R)" is added to the output line)
-                # 4. ref:
-                #    --if this function has previously been described in the cflow output,
-                #      cflow references that first description by adding "[see ##]" to
-                #      the output line, where ## is the line number in the cflow output
-                #      where the function is first described
-
-                # cflow also outputs the function signature, but we do no parse that in arpa
-                # END REGEX DESCRIPTION
-
-                # START EXAMPLE:
-                # Here is an example of a line found in the cflow output
-                # that is parsed using the below regex:
-                #
-                # "    s2n_map_embiggen() <S2N_RESULT s2n_map_embiggen (struct s2n_map *map, uint32_t capacity) at /path/to/s2n_map.c:50> (R): [see 657]"
-                #
-                # The regex will match as follows:
-                # fct: "s2n_map_embiggen"
-                # file: "/path/to/s2n_map.c"
-                # rec: "(R)", which means that this function is recursive
-                # ref: "[see 657]", which means that this function has been previously
-                #                   described in line 657 of the cflow output
-
-                # Concretely, this line means that the "/path/to/s2n_map.c" file contains
-                # a recursive "s2n_map_embiggen" function that has already been described
-                # in the cflow output
-                # END EXAMPLE
-
-                #add function to internal rep
-                regex = (r"(?P<fct>\w+)\(\)"
-                         r"( <.+ at (?P<file>.+):\d+>"
-                         r"( (?P<rec>\(R\)))?:)?"
-                         r"( \[see (?P<ref>\d+)\])?")
-                match = re.match(regex, cur_line.strip())
-                if not match:
-                    logging.warning("Regex did not match for \"%s\"", cur_line[:-1])
-                    continue
-
-                cf_func = match["fct"]
-                cf_file = match["file"]
-                cf_ref = match["ref"]
-                if cf_file and not cf_ref:
-                    if cf_file in self.file_2_dependencies:
-                        if cf_func in self.file_2_dependencies[cf_file]:
-                            logging.warning("duplicate entry for %s in %s", cf_func,
-                                            cf_file)
-                        self.file_2_dependencies[cf_file][cf_func] = {}
-                    else:
-                        self.file_2_dependencies[cf_file] = {cf_func:{}}
-
-                #handle function callings
-                cur_node = (cf_func, cf_file)
-
-                if cur_depth < len(current_at_level) - 1:
-                    current_at_level = current_at_level[:cur_depth + 1]
-                    current_at_level[cur_depth] = cur_node
-                elif cur_depth == len(current_at_level) - 1:
-                    current_at_level[cur_depth] = cur_node
-                elif cur_depth == len(current_at_level):
-                    current_at_level.append(cur_node)
-                elif cur_depth > len(current_at_level):
-                    logging.error("jump in depth at line %d", cnt)
-                    sys.exit(1)
-
-                if cur_depth != 0:
-                    #add to 1 depth less
-                    parent_depth = cur_depth - 1
-                    parent_func = current_at_level[parent_depth][0]
-                    parent_file = current_at_level[parent_depth][1]
-
-                    if parent_file in self.file_2_dependencies:
-                        self.file_2_dependencies[parent_file][parent_func][cf_func] = cf_file
-                    else:
-                        logging.error("Parent file %s of calling function %s of "
-                                      "called function %s is not found in cflow output.",
-                                      parent_file, parent_func, cf_func)
-                        sys.exit(1)
-                cnt += 1
+        cnt = 0
+        for cur_line in cflow_out:
+            # get depth of current line
+            stripped_line = cur_line.strip()
+            leading_spaces = len(cur_line) - len(cur_line.lstrip(" "))
+            cur_depth = leading_spaces // 4
+            if leading_spaces % 4:
+                logging.warning("Line has %d leading spaces: %s", leading_spaces,
+                                cur_line.rstrip("\n"))
+
+            #add function to internal rep
+            parts = self.__split_line(stripped_line)
+            if not parts:
+                logging.warning("Regex did not match for \"%s\"", cur_line.rstrip("\n"))
+                self.n_regex_misses += 1
+                continue
+
+            cf_func, cf_file, cf_ref = parts
+            if cf_file and not cf_ref:
+                if cf_file in self.file_2_dependencies:
+                    if cf_func in self.file_2_dependencies[cf_file]:
+                        logging.warning("duplicate entry for %s in %s", cf_func,
+                                        cf_file)
+                    self.file_2_dependencies[cf_file][cf_func] = {}
+                else:
+                    self.file_2_dependencies[cf_file] = {cf_func:{}}
+
+            #handle function callings
+            cur_node = (cf_func, cf_file)
+
+            if cur_depth < len(current_at_level) - 1:
+                current_at_level = current_at_level[:cur_depth + 1]
+                current_at_level[cur_depth] = cur_node
+            elif cur_depth == len(current_at_level) - 1:
+                current_at_level[cur_depth] = cur_node
+            elif cur_depth == len(current_at_level):
+                current_at_level.append(cur_node)
+            elif cur_depth > len(current_at_level):
+                raise CflowOutputError("jump in depth at line %d" % cnt)
+
+            if cur_depth != 0:
+                #add to 1 depth less
+                parent_depth = cur_depth - 1
+                parent_func = current_at_level[parent_depth][0]
+                parent_file = current_at_level[parent_depth][1]
+
+                if parent_file in self.file_2_dependencies:
+                    self.file_2_dependencies[parent_file][parent_func][cf_func] = cf_file
+                else:
+                    raise CflowOutputError(
+                        "Parent file %s of calling function %s of called function %s "
+                        "is not found in cflow output." % (parent_file, parent_func, cf_func))
+            cnt += 1
@@ -0,0 +1,653 @@
+#!/usr/bin/env python3
+#   Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License").
+#   You may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+This module contains the compact graph that stores the arpa internal representation
+'''
+
+import os
+import array
+import collections
+import lib.arpa_helper as helper
+
+# file ID of called functions whose location is unknown
+NO_FILE = -1
+
+# included dirs, defines and (flag, value) pairs of other flags, shared by all files
+# compiled with the same flags
+FlagSet = collections.namedtuple("FlagSet", ("includes", "defines", "flags"))
+EMPTY_FLAG_SET = FlagSet((), (), ())
+# ID of EMPTY_FLAG_SET in the flag set table of every graph
+EMPTY_FLAG_SET_ID = 0
+
+HARNESS_SUFFIX = "_harness.c"
+
+
+def bit_indices(bits):
+    ''' return the indices of the bits set in an integer bitset '''
+    return [index for index, bit in enumerate(reversed(bin(bits)[2:])) if bit == "1"]
+
+
+def flag_set_to_json(flag_set):
+    ''' return the json view of a flag set '''
+    return {helper.JSON_INC: list(flag_set.includes),
+            helper.JSON_DEF: list(flag_set.defines),
+            helper.JSON_FLAGS: [list(flag) for flag in flag_set.flags]}
+
+
+def flag_set_from_json(flag_set_json):
+    ''' create a flag set from the json view returned by flag_set_to_json '''
+    return FlagSet(tuple(flag_set_json[helper.JSON_INC]), tuple(flag_set_json[helper.JSON_DEF]),
+                   tuple(tuple(flag) for flag in flag_set_json.get(helper.JSON_FLAGS, [])))
+
+
+class StringTable:
+    ''' Class that interns strings (or any hashable value) to consecutive integer IDs '''
+    __slots__ = ("ids", "strings")
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+
+    def intern(self, string):
+        ''' return the ID of a string, adding it to the table if required '''
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[string] = string_id
+            self.strings.append(string)
+        return string_id
+
+
+    def get_id(self, string):
+        ''' return the ID of a string, or None if it is not in the table '''
+        return self.ids.get(string)
+
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class FileEntry:
+    ''' Class that stores the build information of a single file.
+    Functions map a function ID to a flat array of (called function ID, called file ID).
+    The flag set is an ID in the flag set table of the graph '''
+    __slots__ = ("name", "flag_set", "functions")
+
+    def __init__(self, name, flag_set=EMPTY_FLAG_SET_ID):
+        self.name = name
+        self.flag_set = flag_set
+        self.functions = {}
+
+
+class CallGraph:
+    ''' Class that stores files and function calls using interned IDs '''
+
+    def __init__(self):
+        self.files = StringTable()
+        self.functions = StringTable()
+        self.flag_sets = self.__create_flag_sets()
+        self.entries = {}
+        self.reachability = None
+        self.summaries = None
+        self.reverse_index = None
+
+
+    @classmethod
+    def __create_flag_sets(cls):
+        flag_sets = StringTable()
+        flag_sets.intern(EMPTY_FLAG_SET)
+        return flag_sets
+
+
+    def copy(self):
+        ''' return an in-memory copy of the graph, with the same IDs, that can be
+        modified without changing this graph. Derived data is not copied '''
+        graph = CallGraph()
+        for string_id in range(len(self.files)):
+            graph.files.intern(self.files[string_id])
+        for string_id in range(len(self.functions)):
+            graph.functions.intern(self.functions[string_id])
+        graph.flag_sets = StringTable()
+        for flag_set in self.flag_sets.strings:
+            graph.flag_sets.intern(flag_set)
+        for file_id, entry in self.entries.items():
+            copied_entry = FileEntry(entry.name, entry.flag_set)
+            copied_entry.functions = {fct_id: array.array("i", calls)
+                                      for fct_id, calls in entry.functions.items()}
+            graph.entries[file_id] = copied_entry
+        return graph
+
+
+    def invalidate(self):
+        ''' drop the data derived from the graph, after it is modified '''
+        self.reachability = None
+        self.summaries = None
+        self.reverse_index = None
+
+
+    def has_summaries(self):
+        ''' check whether the graph has function summaries '''
+        return self.summaries is not None
+
+
+    def has_reverse_index(self):
+        ''' check whether the graph has a reverse index '''
+        return self.reverse_index is not None
+
+
+    def get_reachability(self):
+        ''' return the reachability engine of the graph, building it if required '''
+        if self.reachability is None:
+            self.reachability = ReachabilityEngine(self)
+        return self.reachability
+
+
+    def get_reverse_index(self):
+        ''' return the reverse index of the graph, building it if required '''
+        if self.reverse_index is None:
+            self.reverse_index = ReverseIndex.compute(self)
+        return self.reverse_index
+
+
+    def has_file(self, path):
+        ''' check whether a file has an entry in the graph '''
+        file_id = self.files.get_id(path)
+        return file_id is not None and file_id in self.entries
+
+
+    def get_entry(self, path):
+        ''' return the entry of a file, or None if it has none '''
+        file_id = self.files.get_id(path)
+        return None if file_id is None else self.entries.get(file_id)
+
+
+    def add_file(self, path):
+        ''' add an empty entry for a file. Return the entry '''
+        file_id = self.files.intern(path)
+        entry = FileEntry(os.path.basename(path))
+        self.entries[file_id] = entry
+        self.invalidate()
+        return entry
+
+
+    def get_flag_set(self, path):
+        ''' return the flag set of a file '''
+        return self.flag_sets[self.get_entry(path).flag_set]
+
+
+    def set_flag_set(self, path, flag_set):
+        ''' replace the flag set of a file, sharing it with the files that have the same '''
+        flag_set = FlagSet(tuple(flag_set.includes), tuple(flag_set.defines),
+                           tuple(tuple(flag) for flag in flag_set.flags))
+        self.get_entry(path).flag_set = self.flag_sets.intern(flag_set)
+        self.invalidate()
+
+
+    def clear_flag_sets(self):
+        ''' reset the flag sets of all files to the empty set '''
+        self.flag_sets = self.__create_flag_sets()
+        for entry in self.entries.values():
+            entry.flag_set = EMPTY_FLAG_SET_ID
+        self.invalidate()
+
+
+    def remove_file(self, path):
+        ''' remove the entry of a file, if any '''
+        file_id = self.files.get_id(path)
+        if file_id is not None:
+            self.entries.pop(file_id, None)
+        self.invalidate()
+
+
+    def encode_calls(self, called_functions):
+        ''' encode a {called function: called file} dict as a flat ID array '''
+        calls = array.array("i")
+        for called_fct, called_file in called_functions.items():
+            calls.append(self.functions.intern(called_fct))
+            calls.append(NO_FILE if called_file is None else self.files.intern(called_file))
+        return calls
+
+
+    def decode_calls(self, calls):
+        ''' decode a flat ID array as a {called function: called file} dict '''
+        return {self.functions[calls[i]]:
+                    None if calls[i + 1] == NO_FILE else self.files[calls[i + 1]]
+                for i in range(0, len(calls), 2)}
+
+
+    def set_functions(self, path, fct_2_called_functions):
+        ''' replace the functions defined in a file, given as
+        {function: {called function: called file}} '''
+        entry = self.get_entry(path)
+        entry.functions = {self.functions.intern(fct): self.encode_calls(called_functions)
+                           for fct, called_functions in fct_2_called_functions.items()}
+        self.invalidate()
+
+
+    def get_functions(self, path):
+        ''' return the names of the functions defined in a file '''
+        return [self.functions[fct_id] for fct_id in self.get_entry(path).functions]
+
+
+    def iter_json(self):
+        ''' generate the (path, file entry) items of the json view of the graph '''
+        for file_id, entry in self.entries.items():
+            yield self.files[file_id], {
+                helper.JSON_NAME: entry.name,
+                helper.JSON_FLAG_SET: entry.flag_set,
+                helper.JSON_FCT: {self.functions[fct_id]: self.decode_calls(calls)
+                                  for fct_id, calls in entry.functions.items()},
+            }
+
+
+    def flag_sets_to_json(self):
+        ''' return the json view of the flag set table '''
+        return [flag_set_to_json(flag_set) for flag_set in self.flag_sets.strings]
+
+
+    def to_json(self):
+        ''' return the {path: file entry} json view of the graph '''
+        return dict(self.iter_json())
+
+
+    def add_json(self, files_json, flag_sets_json=()):
+        ''' add the entries of a {path: file entry} json view and the flag set table
+        they refer to to the graph '''
+        flag_set_ids = self.add_json_flag_sets(flag_sets_json)
+        for path, json_entry in files_json.items():
+            self.add_json_entry(path, json_entry, flag_set_ids)
+
+
+    def add_json_flag_sets(self, flag_sets_json):
+        ''' add the flag sets of a json flag set table to the graph. Return their IDs '''
+        return [self.flag_sets.intern(flag_set_from_json(flag_set_json))
+                for flag_set_json in flag_sets_json]
+
+
+    def add_json_entry(self, path, json_entry, flag_set_ids=()):
+        ''' add a file entry of a json view, whose flag set is given by its index in
+        flag_set_ids. Entries may also list their flags, as in older views '''
+        entry = self.add_file(path)
+        entry.name = json_entry[helper.JSON_NAME]
+        if helper.JSON_FLAG_SET in json_entry:
+            entry.flag_set = flag_set_ids[json_entry[helper.JSON_FLAG_SET]]
+        else:
+            entry.flag_set = self.flag_sets.intern(flag_set_from_json(json_entry))
+        self.set_functions(path, json_entry[helper.JSON_FCT])
+
+
+class ReachabilityEngine:
+    ''' Class that finds the functions transitively called by a set of functions.
+    Nodes are the (file ID, function ID) pairs of defined functions, numbered when first
+    reached. Strongly connected components (SCCs) are computed once, and the closure of
+    each SCC is cached as a bitset over SCC indices, so it is shared by all queries '''
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.node_ids = {}
+        self.node_file = array.array("i")
+        self.node_fct = array.array("i")
+        self.successors = []
+
+        self.index = array.array("i")
+        self.low = array.array("i")
+        self.on_stack = bytearray()
+        self.counter = 0
+
+        self.scc_of = array.array("i")
+        self.scc_members = []
+        self.scc_successors = {}
+        self.scc_closure = {}
+
+
+    def get_node(self, file_id, fct_id):
+        ''' return the node of a function, or None if the function is not defined '''
+        node = self.node_ids.get((file_id, fct_id))
+        if node is None:
+            entry = self.graph.entries.get(file_id)
+            if entry is None or fct_id not in entry.functions:
+                return None
+            node = len(self.node_file)
+            self.node_ids[(file_id, fct_id)] = node
+            self.node_file.append(file_id)
+            self.node_fct.append(fct_id)
+            self.successors.append(None)
+            self.index.append(-1)
+            self.low.append(0)
+            self.on_stack.append(0)
+            self.scc_of.append(-1)
+        return node
+
+
+    def __get_successors(self, node):
+        if self.successors[node] is None:
+            calls = self.graph.entries[self.node_file[node]].functions[self.node_fct[node]]
+            node_successors = array.array("i")
+            for i in range(0, len(calls), 2):
+                if calls[i + 1] != NO_FILE:
+                    called_node = self.get_node(calls[i + 1], calls[i])
+                    if called_node is not None:
+                        node_successors.append(called_node)
+            self.successors[node] = node_successors
+        return self.successors[node]
+
+
+    def visit(self, start):
+        ''' find the SCCs of all nodes reachable from start, with an iterative Tarjan
+        algorithm. SCCs are numbered in reverse topological order, so the SCCs called by
+        a given SCC always have a lower index '''
+        if self.index[start] != -1:
+            return
+        index, low, on_stack = self.index, self.low, self.on_stack
+        stack = []
+        work = [(start, 0)]
+        while work:
+            node, next_successor = work[-1]
+            if next_successor == 0 and index[node] == -1:
+                index[node] = low[node] = self.counter
+                self.counter += 1
+                stack.append(node)
+                on_stack[node] = 1
+
+            node_successors = self.__get_successors(node)
+            if next_successor < len(node_successors):
+                work[-1] = (node, next_successor + 1)
+                called_node = node_successors[next_successor]
+                if index[called_node] == -1:
+                    work.append((called_node, 0))
+                elif on_stack[called_node]:
+                    low[node] = min(low[node], index[called_node])
+                continue
+
+            work.pop()
+            if work:
+                caller = work[-1][0]
+                low[caller] = min(low[caller], low[node])
+            if low[node] == index[node]:
+                scc = len(self.scc_members)
+                members = array.array("i")
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = 0
+                    self.scc_of[member] = scc
+                    members.append(member)
+                    if member == node:
+                        break
+                self.scc_members.append(members)
+
+
+    def visit_all(self):
+        ''' find the SCCs of all functions of the graph '''
+        for file_id, entry in self.graph.entries.items():
+            for fct_id in entry.functions:
+                self.visit(self.get_node(file_id, fct_id))
+
+
+    def get_scc_successors(self, scc):
+        ''' return the SCCs called by the functions of an SCC '''
+        if scc not in self.scc_successors:
+            called_sccs = set()
+            for member in self.scc_members[scc]:
+                for called_node in self.successors[member]:
+                    called_sccs.add(self.scc_of[called_node])
+            called_sccs.discard(scc)
+            self.scc_successors[scc] = called_sccs
+        return self.scc_successors[scc]
+
+
+    def get_closure(self, scc):
+        ''' return the bitset of all SCCs reachable from an SCC, including itself '''
+        stack = [scc]
+        while stack:
+            current = stack[-1]
+            if current in self.scc_closure:
+                stack.pop()
+                continue
+            pending = [s for s in self.get_scc_successors(current)
+                       if s not in self.scc_closure]
+            if pending:
+                stack.extend(pending)
+                continue
+            closure = 1 << current
+            for called_scc in self.get_scc_successors(current):
+                closure |= self.scc_closure[called_scc]
+            self.scc_closure[current] = closure
+            stack.pop()
+        return self.scc_closure[scc]
+
+
+    def reach(self, file_id, fct_ids):
+        ''' return the nodes transitively called by the given functions of a file,
+        including the nodes of these functions '''
+        closure = 0
+        for fct_id in fct_ids:
+            node = self.get_node(file_id, fct_id)
+            if node is not None:
+                self.visit(node)
+                closure |= self.get_closure(self.scc_of[node])
+
+        reached = []
+        for scc in bit_indices(closure):
+            reached.extend(self.scc_members[scc])
+        return reached
+
+
+class FunctionSummaries:
+    ''' Class that stores, for each function, the dependency files and flag sets
+    of all the functions it transitively calls, and their unresolved callees.
+    Sets are bitsets over the file, flag set and missing call tables of the summaries '''
+
+    def __init__(self):
+        self.files = StringTable()
+        self.flag_sets = StringTable()
+        # (caller file ID, caller, called function) of the calls whose callee is unknown
+        self.missing = StringTable()
+        # path -> {function: (dependencies, flag sets, missing)}
+        self.entries = {}
+
+
+    @classmethod
+    def compute(cls, graph):
+        ''' summarize all functions of a graph, one SCC at a time. SCCs are numbered
+        in reverse topological order, so called SCCs are always summarized first '''
+        summaries = cls()
+        file_2_bit = {}
+        def file_bit(file_id):
+            if file_id not in file_2_bit:
+                file_2_bit[file_id] = summaries.files.intern(graph.files[file_id])
+            return file_2_bit[file_id]
+
+        flag_set_2_bit = {}
+        def flag_set_bit(flag_set_id):
+            if flag_set_id not in flag_set_2_bit:
+                flag_set_2_bit[flag_set_id] = \
+                    1 << summaries.flag_sets.intern(graph.flag_sets[flag_set_id])
+            return flag_set_2_bit[flag_set_id]
+
+        reachability = graph.get_reachability()
+        reachability.visit_all()
+        scc_summaries = []
+        for scc, members in enumerate(reachability.scc_members):
+            dependencies = flag_sets = missing = 0
+            for member in members:
+                file_id = reachability.node_file[member]
+                fct_id = reachability.node_fct[member]
+                entry = graph.entries[file_id]
+                flag_sets |= flag_set_bit(entry.flag_set)
+                calls = entry.functions[fct_id]
+                for i in range(0, len(calls), 2):
+                    if calls[i + 1] != NO_FILE:
+                        dependencies |= 1 << file_bit(calls[i + 1])
+                    else:
+                        missing |= 1 << summaries.missing.intern(
+                            (file_bit(file_id), graph.functions[fct_id],
+                             graph.functions[calls[i]]))
+            for called_scc in reachability.get_scc_successors(scc):
+                called_summary = scc_summaries[called_scc]
+                dependencies |= called_summary[0]
+                flag_sets |= called_summary[1]
+                missing |= called_summary[2]
+            scc_summaries.append((dependencies, flag_sets, missing))
+
+        for node, scc in enumerate(reachability.scc_of):
+            path = graph.files[reachability.node_file[node]]
+            fct = graph.functions[reachability.node_fct[node]]
+            summaries.entries.setdefault(path, {})[fct] = scc_summaries[scc]
+        return summaries
+
+
+    def collect(self, path, fct_names):
+        ''' union the summaries of the given functions of a file. Return the
+        dependency files, distinct flag sets and (caller file, caller, called) triples '''
+        dependencies = flag_sets = missing = 0
+        fct_2_summary = self.entries.get(path, {})
+        for fct in fct_names:
+            if fct in fct_2_summary:
+                summary = fct_2_summary[fct]
+                dependencies |= summary[0]
+                flag_sets |= summary[1]
+                missing |= summary[2]
+        return ({self.files[i] for i in bit_indices(dependencies)},
+                [self.flag_sets[i] for i in bit_indices(flag_sets)],
+                {(self.files[file_id], caller, called)
+                 for file_id, caller, called in (self.missing[i] for i in bit_indices(missing))})
+
+
+    def to_json(self):
+        ''' return the json view of the summaries. Bitsets are hexadecimal strings '''
+        return {
+            helper.JSON_FILE: self.files.strings,
+            helper.JSON_FLAG_SETS: [flag_set_to_json(flag_set)
+                                    for flag_set in self.flag_sets.strings],
+            helper.JSON_MISSING: [list(triple) for triple in self.missing.strings],
+            helper.JSON_FCT: {path: {fct: {
+                helper.JSON_DEPS: format(summary[0], "x"),
+                helper.JSON_FLAG_SETS: format(summary[1], "x"),
+                helper.JSON_MISSING: format(summary[2], "x"),
+            } for fct, summary in fct_2_summary.items()}
+                              for path, fct_2_summary in self.entries.items()},
+        }
+
+
+    @classmethod
+    def from_json(cls, summaries_json):
+        ''' create summaries from the json view returned by to_json '''
+        summaries = cls()
+        for path in summaries_json[helper.JSON_FILE]:
+            summaries.files.intern(path)
+        for flag_set_json in summaries_json[helper.JSON_FLAG_SETS]:
+            summaries.flag_sets.intern(flag_set_from_json(flag_set_json))
+        for triple in summaries_json[helper.JSON_MISSING]:
+            summaries.missing.intern(tuple(triple))
+        for path, fct_2_summary in summaries_json[helper.JSON_FCT].items():
+            summaries.entries[path] = {fct: (
+                int(summary[helper.JSON_DEPS], 16),
+                int(summary[helper.JSON_FLAG_SETS], 16),
+                int(summary[helper.JSON_MISSING], 16),
+            ) for fct, summary in fct_2_summary.items()}
+        return summaries
+
+
+class ReverseIndex:
+    ''' Class that maps each file, and each function, to the harnesses whose call graph
+    reaches it. Harnesses are the files whose name ends with HARNESS_SUFFIX.
+    Sets of harnesses are bitsets over the harness table of the index '''
+
+    def __init__(self):
+        self.harnesses = StringTable()
+        # path -> harnesses
+        self.files = {}
+        # path -> {function: harnesses}
+        self.functions = {}
+
+
+    @classmethod
+    def compute(cls, graph):
+        ''' index all harnesses of a graph. SCCs are numbered in reverse topological
+        order, so the harnesses of all calling SCCs are known before those of an SCC
+        are passed on to the SCCs it calls '''
+        index = cls()
+        reachability = graph.get_reachability()
+        reachability.visit_all()
+        scc_harnesses = [0] * len(reachability.scc_members)
+        for file_id, entry in graph.entries.items():
+            if not entry.name.endswith(HARNESS_SUFFIX):
+                continue
+            path = graph.files[file_id]
+            harness = 1 << index.harnesses.intern(path)
+            index.files[path] = index.files.get(path, 0) | harness
+            for fct_id in entry.functions:
+                scc_harnesses[reachability.scc_of[reachability.get_node(file_id, fct_id)]] |= \
+                    harness
+
+        for scc in range(len(scc_harnesses) - 1, -1, -1):
+            if scc_harnesses[scc]:
+                for called_scc in reachability.get_scc_successors(scc):
+                    scc_harnesses[called_scc] |= scc_harnesses[scc]
+
+        for node, scc in enumerate(reachability.scc_of):
+            harnesses = scc_harnesses[scc]
+            if harnesses:
+                path = graph.files[reachability.node_file[node]]
+                fct = graph.functions[reachability.node_fct[node]]
+                index.functions.setdefault(path, {})[fct] = harnesses
+                index.files[path] = index.files.get(path, 0) | harnesses
+        return index
+
+
+    def find_affected(self, paths=(), fct_names=()):
+        ''' return the sorted paths of the harnesses that reach any of the given files,
+        or any definition of the given functions '''
+        harnesses = 0
+        for path in paths:
+            harnesses |= self.files.get(path, 0)
+        fct_names = set(fct_names)
+        if fct_names:
+            for fct_2_harnesses in self.functions.values():
+                for fct in fct_names.intersection(fct_2_harnesses):
+                    harnesses |= fct_2_harnesses[fct]
+        return sorted(self.harnesses[i] for i in bit_indices(harnesses))
+
+
+    def to_json(self):
+        ''' return the json view of the index. Bitsets are hexadecimal strings '''
+        return {
+            helper.JSON_HARNESSES: self.harnesses.strings,
+            helper.JSON_FILE: {path: format(harnesses, "x")
+                               for path, harnesses in self.files.items()},
+            helper.JSON_FCT: {path: {fct: format(harnesses, "x")
+                                     for fct, harnesses in fct_2_harnesses.items()}
+                              for path, fct_2_harnesses in self.functions.items()},
+        }
+
+
+    @classmethod
+    def from_json(cls, index_json):
+        ''' create an index from the json view returned by to_json '''
+        index = cls()
+        for path in index_json[helper.JSON_HARNESSES]:
+            index.harnesses.intern(path)
+        index.files = {path: int(harnesses, 16)
+                       for path, harnesses in index_json[helper.JSON_FILE].items()}
+        index.functions = {path: {fct: int(harnesses, 16)
+                                  for fct, harnesses in fct_2_harnesses.items()}
+                           for path, fct_2_harnesses in index_json[helper.JSON_FCT].items()}
+        return index
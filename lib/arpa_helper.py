@@ -19,6 +19,8 @@ This module contains helpful classes and functions used within Arpa
 
 import argparse
 import os
+import stat
+import lib.arpa_profile as arpa_profile
 
 TOOL_NAME = "arpa"
 
@@ -31,59 +33,125 @@ JSON_NAME = "name"
 JSON_INC = "includes"
 JSON_DEF = "defines"
 JSON_FCT = "functions"
+JSON_INPUTS = "inputs"
+JSON_CC_PATH = "compile_commands"
+JSON_CC_MTIME = "compile_commands_mtime"
+JSON_DIGEST = "tree_digest"
+JSON_FPRINTS = "file_fingerprints"
+JSON_DISCOVERY = "discovery"
+JSON_MODE = "mode"
+JSON_EXTRA = "extra_dirs"
+JSON_BACKEND = "backend"
+JSON_SUMMARIES = "summaries"
+JSON_DEPS = "dependencies"
+JSON_MISSING = "missing"
+JSON_FLAGS = "flags"
+JSON_FLAG_SET = "flag_set"
+JSON_FLAG_SETS = "flag_sets"
+JSON_REVERSE_INDEX = "reverse_index"
+JSON_HARNESSES = "harnesses"
 
 CC_INCLUDE = "-I"
 CC_DEFINE = "-D"
+CC_SYSTEM_INCLUDE = "-isystem"
+CC_QUOTE_INCLUDE = "-iquote"
+CC_FORCE_INCLUDE = "-include"
+CC_UNDEFINE = "-U"
+CC_STD = "-std="
+# flags stored in the internal representation besides included dirs and defines
+CC_OTHER_FLAGS = (CC_SYSTEM_INCLUDE, CC_QUOTE_INCLUDE, CC_FORCE_INCLUDE, CC_UNDEFINE, CC_STD)
+
+BACKEND_CFLOW = "cflow"
+BACKEND_INDEXER = "indexer"
+
+DISCOVER_TREE = "tree"
+DISCOVER_CC = "compile-commands"
+
+VALIDATE_FULL = "full"
+VALIDATE_FAST = "fast"
+VALIDATE_OFF = "off"
+IGNORE_FILE_NAME = "." + TOOL_NAME + "ignore"
+DEFAULT_EXCLUDES = ["aws-proof-build-assistant"]
 
 
 class FileSpecificInfo:
     ''' Class that finds and stores file-specific build info '''
 
-    def __init__(self, internal_rep):
-        self.internal_rep = internal_rep
+    def __init__(self, graph):
+        self.graph = graph
 
         self.includes = set()
         self.defines = set()
+        self.flags = set()
         self.dependencies = set()
         self.missing_dependencies = {}
         self.func_calls = {} # not currently used, but this may be useful going forward
 
 
-    def find_custom_info_recursively(self, current_path, relevant_functions):
-        ''' recursively look inside the internal representation to collect
-         harness-specific build information '''
-        # Recursion issues are supposed to be handled by cflow
-        current_json_entry = self.internal_rep[JSON_FILE][current_path]
-        self.includes.update(set(current_json_entry[JSON_INC]))
-        self.defines.update(set(current_json_entry[JSON_DEF]))
-
-        file_2_called_functions = {}
-        for fct in relevant_functions:
-            for called_fct, called_file in current_json_entry[JSON_FCT][fct].items():
-                if called_file:
-                    self.dependencies.add(called_file)
-
-                    # add called function to the list of recursive future calls
-                    if called_file in file_2_called_functions:
-                        file_2_called_functions[called_file].add(called_fct)
-                    else:
-                        file_2_called_functions[called_file] = {called_fct}
+    def find_custom_info(self, current_path, relevant_functions):
+        ''' look inside the internal representation to collect the
+        harness-specific build information of all transitively called functions '''
+        files = self.graph.files
+        functions = self.graph.functions
+        file_id = files.get_id(current_path)
+        with arpa_profile.PROFILER.phase(arpa_profile.PHASE_REACHABILITY):
+            reachability = self.graph.get_reachability()
+            reached = reachability.reach(file_id, [functions.get_id(fct)
+                                                   for fct in relevant_functions])
+
+        visited_files = {file_id}
+        for node in reached:
+            node_file = reachability.node_file[node]
+            node_fct = reachability.node_fct[node]
+            visited_files.add(node_file)
+
+            calls = self.graph.entries[node_file].functions[node_fct]
+            for i in range(0, len(calls), 2):
+                called_fct, called_file = calls[i], calls[i + 1]
+                if called_file >= 0:
+                    self.dependencies.add(files[called_file])
 
                     # map of which function calls which other function
-                    if called_file in self.func_calls:
-                        self.func_calls[called_file].append(called_fct)
+                    if files[called_file] in self.func_calls:
+                        self.func_calls[files[called_file]].append(functions[called_fct])
                     else:
-                        self.func_calls[called_file] = [called_fct]
+                        self.func_calls[files[called_file]] = [functions[called_fct]]
                 else:
                     #case where the location of a called fct is not known
-                    entry = (current_path, fct)
+                    entry = (files[node_file], functions[node_fct])
                     if entry in self.missing_dependencies:
-                        self.missing_dependencies[entry].add(called_fct)
+                        self.missing_dependencies[entry].add(functions[called_fct])
                     else:
-                        self.missing_dependencies[entry] = {called_fct}
-
-        for file_path, file_functions in file_2_called_functions.items():
-            self.find_custom_info_recursively(file_path, file_functions)
+                        self.missing_dependencies[entry] = {functions[called_fct]}
+
+        # each distinct flag set contributes its flags once
+        flag_set_ids = {self.graph.entries[visited_file].flag_set
+                        for visited_file in visited_files}
+        for flag_set_id in flag_set_ids:
+            self.__add_flag_set(self.graph.flag_sets[flag_set_id])
+
+
+    def find_summarized_info(self, current_path, relevant_functions):
+        ''' collect the same information as find_custom_info,
+        from the precomputed summaries of the relevant functions '''
+        with arpa_profile.PROFILER.phase(arpa_profile.PHASE_REACHABILITY):
+            dependencies, flag_sets, missing = \
+                self.graph.summaries.collect(current_path, relevant_functions)
+        self.dependencies.update(dependencies)
+        self.__add_flag_set(self.graph.get_flag_set(current_path))
+        for flag_set in flag_sets:
+            self.__add_flag_set(flag_set)
+        for file, fct, called_fct in missing:
+            if (file, fct) in self.missing_dependencies:
+                self.missing_dependencies[(file, fct)].add(called_fct)
+            else:
+                self.missing_dependencies[(file, fct)] = {called_fct}
+
+
+    def __add_flag_set(self, flag_set):
+        self.includes.update(flag_set.includes)
+        self.defines.update(flag_set.defines)
+        self.flags.update(flag_set.flags)
 
 
 class ParserInstance:
@@ -93,6 +161,7 @@ class ParserInstance:
         self.parent = parent
         self.subparser = None
         self.bare_minimum_parser = None
+        self.makefile_parser = None
 
     @classmethod
     def __create_bare_minimum_parser(cls):
@@ -100,6 +169,44 @@ class ParserInstance:
         parser.add_argument("-cc", "--compile-commands", required=True,
                             metavar="FILE",
                             help="path to compile_commands json file.")
+        parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                            help="number of cflow (or indexer) processes to run in parallel.")
+        parser.add_argument("--backend", default=BACKEND_CFLOW,
+                            choices=[BACKEND_CFLOW, BACKEND_INDEXER],
+                            help="tool used to find function-level dependencies: \
+            GNU cflow, or the indexer built into {}.".format(TOOL_NAME))
+        parser.add_argument("--index-cache", metavar="DIR",
+                            help="with --backend={}, directory where the results of \
+            indexing each file are cached.".format(BACKEND_INDEXER))
+        parser.add_argument("--validate", default=VALIDATE_FAST,
+                            choices=[VALIDATE_FULL, VALIDATE_FAST, VALIDATE_OFF],
+                            help="check the internal representation with voluptuous, \
+            with an equivalent check of each distinct path, flag set and function name, \
+            or not at all.")
+        parser.add_argument("--discovery", default=DISCOVER_TREE,
+                            choices=[DISCOVER_TREE, DISCOVER_CC],
+                            help="analyze all source files under the root directory, \
+            or only the compiled files and the headers they include.")
+        parser.add_argument("-ed", "--extra-dir", action="append", default=[],
+                            metavar="DIR",
+                            help="with --discovery={}, also analyze all source files \
+            under DIR (e.g. proof harnesses and stubs).".format(DISCOVER_CC))
+        parser.add_argument("-x", "--exclude", action="append", default=[],
+                            metavar="PATTERN",
+                            help="glob pattern for files and directories to exclude from \
+            the analysis, in addition to those listed in {}.".format(IGNORE_FILE_NAME))
+        parser.add_argument("--profile", metavar="REPORT",
+                            help="save to REPORT a json report of the wall time, CPU time \
+            and peak memory of each phase of the run, and of counters such as the number \
+            of files, functions and call edges.")
+        parser.add_argument("--profile-phase", action="append", default=[],
+                            dest="profile_phases", metavar="PHASE",
+                            help="with --profile, also run PHASE (or all phases, with \
+            <all>) under cProfile, and save its statistics next to the report. \
+            May be repeated.")
+        parser.add_argument("--trace-memory", action="store_true",
+                            help="with --profile, also report the peak memory allocated by \
+            Python in each phase, using tracemalloc. This slows down the run.")
         return parser
 
 
@@ -117,26 +224,31 @@ class ParserInstance:
                             metavar="FILE",
                             help="output location for a file containing a json internal \
             representation of the stored information.")
+        parser.add_argument("--incremental", action="store_true",
+                            help="update the internal representation found at the output \
+            location, re-running cflow only on files changed since it was built.")
+        parser.add_argument("-db", "--database", metavar="FILE",
+                            help="also save the internal representation to an SQLite \
+            database, which <{} run> and <{} query> can read.".format(TOOL_NAME, TOOL_NAME))
+        parser.add_argument("-sn", "--snapshot", metavar="FILE",
+                            help="also save the internal representation to a binary \
+            snapshot, which <{} run> loads without decoding it all.".format(TOOL_NAME))
+        parser.add_argument("--summaries", action="store_true",
+                            help="store in the internal representation the transitive \
+            dependencies of every function, so that Makefiles are generated without \
+            traversing the call graph.")
+        parser.add_argument("--reverse-index", action="store_true",
+                            help="store in the internal representation the harnesses that \
+            depend on every file and function, which <{} affected> reads."
+                            .format(TOOL_NAME))
 
         # ADD FUNCTION
-        parser.set_defaults(func=self.parent.call_build)
+        parser.set_defaults(func=self.parent.call_build, reuse_rep=False, needs_rep=True)
 
 
-    def __create_run_parser(self):
-        # default = called from harness directory
-        # TODO this subcommand should be changed to "makefile" instead of "run"
-        # this will mean that the arpa integration for the templates repository must be adjusted
-        parser = self.subparser.add_parser('run', parents=[self.bare_minimum_parser],
-                                           help="Generate a Makefile from scratch \
-            for a given harness file. Assumed cwd = harness directory.")
-
-        # ADD FLAGS related to I/O
-        parser.add_argument("-r", "--root-dir", required=True, metavar="DIR",
-                            help="root directory for the project under test")
-        parser.add_argument("-file", "--file-under-test", metavar="FILE",
-                            help="path to harness for which we create a makefile.")
-        parser.add_argument("-sp", "--save-path", metavar="FILE",
-                            help="file path where the output Makefile will be saved")
+    @classmethod
+    def __create_makefile_parser(cls):
+        parser = argparse.ArgumentParser(add_help=False)
 
         # ADD FLAGS related to BUILD INFO TYPES
         parser.add_argument("-def", "--define-variable", default="DEFINES",
@@ -145,6 +257,10 @@ class ParserInstance:
         parser.add_argument("-inc", "--include-variable", default="INCLUDES",
                             metavar="V",
                             help="label for includes used in the Makefile")
+        parser.add_argument("-cf", "--compile-flags-variable", default="COMPILE_FLAGS",
+                            metavar="V",
+                            help="label for other compiler flags (-include, -std) \
+            used in the Makefile")
         parser.add_argument("-ext", "--change-dependency-extensions",
                             metavar="EXT",
                             help="modify the extension of dependencies \
@@ -164,6 +280,11 @@ class ParserInstance:
         parser.add_argument("-msrp", "--make-proof-source-path", default="tests/cbmc/sources",
                             metavar="DIR",
                             help="path makefile proofs directory")
+        parser.add_argument("-msr", "--make-proof-source-root", action="append",
+                            dest="make_proof_source_roots", default=[],
+                            metavar="V=DIR",
+                            help="Makefile variable name and path of an additional \
+            proof sources directory. May be repeated")
 
         # ADD FLAGS related to MAKEFILE PROOF_STUBS
         parser.add_argument("-mstv", "--make-proof-stub-variable", default="PROOF_STUB",
@@ -181,21 +302,204 @@ class ParserInstance:
         parser.add_argument("-mproo", "--make-proof-sources-variable", default="PROOF_SOURCES",
                             metavar="V",
                             help="Makefile variable name for proofs source file")
+        return parser
+
+
+    def __create_run_parser(self):
+        # default = called from harness directory
+        # TODO this subcommand should be changed to "makefile" instead of "run"
+        # this will mean that the arpa integration for the templates repository must be adjusted
+        parser = self.subparser.add_parser('run', parents=[self.bare_minimum_parser,
+                                                           self.makefile_parser],
+                                           help="Generate a Makefile from scratch \
+            for a given harness file. Assumed cwd = harness directory.")
+
+        # ADD FLAGS related to I/O
+        parser.add_argument("-r", "--root-dir", required=True, metavar="DIR",
+                            help="root directory for the project under test")
+        parser.add_argument("-file", "--file-under-test", metavar="FILE",
+                            help="path to harness for which we create a makefile.")
+        parser.add_argument("-sp", "--save-path", metavar="FILE",
+                            help="file path where the output Makefile will be saved")
+        parser.add_argument("-jp", "--json_path", metavar="FILE",
+                            help="location of an internal representation saved by \
+            <{} build>. It is reused if its inputs are unchanged, and rebuilt \
+            and saved there otherwise.".format(TOOL_NAME))
+        parser.add_argument("-db", "--database", metavar="FILE",
+                            help="location of an SQLite database saved by <{} build>. \
+            If its inputs are unchanged, only the part of the call graph reachable from \
+            the harness is loaded. Otherwise, it is rebuilt and saved there.".format(TOOL_NAME))
+        parser.add_argument("-sn", "--snapshot", metavar="FILE",
+                            help="location of a binary snapshot saved by <{} build>. \
+            It is reused if its inputs are unchanged, and rebuilt and saved there \
+            otherwise.".format(TOOL_NAME))
+
+        # ADD FUNCTION
+        parser.set_defaults(func=self.parent.call_run, reuse_rep=True, incremental=False,
+                            summaries=False, reverse_index=False, needs_rep=True)
+
+
+    def __create_run_all_parser(self):
+        # default = called from the directory containing all proofs
+        parser = self.subparser.add_parser('run-all', parents=[self.bare_minimum_parser,
+                                                               self.makefile_parser],
+                                           help="Generate a Makefile for every harness \
+            file found under a directory. Assumed cwd = proofs directory.")
+
+        # ADD FLAGS related to I/O
+        parser.add_argument("-r", "--root-dir", required=True, metavar="DIR",
+                            help="root directory for the project under test")
+        parser.add_argument("-pd", "--proofs-dir", default=os.getcwd(), metavar="DIR",
+                            help="directory under which all harness files are searched for.")
+        parser.add_argument("-jp", "--json_path", metavar="FILE",
+                            help="location of an internal representation saved by \
+            <{} build>. It is reused if its inputs are unchanged, and rebuilt \
+            and saved there otherwise.".format(TOOL_NAME))
+        parser.add_argument("-db", "--database", metavar="FILE",
+                            help="location of an SQLite database saved by <{} build>. \
+            If its inputs are unchanged, only the part of the call graph reachable from \
+            the harnesses is loaded. Otherwise, it is rebuilt and saved there.".format(TOOL_NAME))
+        parser.add_argument("-sn", "--snapshot", metavar="FILE",
+                            help="location of a binary snapshot saved by <{} build>. \
+            It is reused if its inputs are unchanged, and rebuilt and saved there \
+            otherwise.".format(TOOL_NAME))
 
         # ADD FUNCTION
-        parser.set_defaults(func=self.parent.call_run)
+        parser.set_defaults(func=self.parent.call_run_all, reuse_rep=True, incremental=False,
+                            summaries=False, reverse_index=False, needs_rep=True)
+
+
+    def __create_query_parser(self):
+        parser = self.subparser.add_parser('query', help="Answer questions about the \
+            call graph saved in an SQLite database, without loading all of it.")
+
+        parser.add_argument("-db", "--database", required=True, metavar="FILE",
+                            help="location of an SQLite database saved by <{} build>."
+                            .format(TOOL_NAME))
+        query_group = parser.add_mutually_exclusive_group(required=True)
+        query_group.add_argument("--callers", metavar="FUNCTION",
+                                 help="print the functions that call FUNCTION.")
+        query_group.add_argument("--definition", metavar="FUNCTION",
+                                 help="print the files in which FUNCTION is defined.")
+
+        # ADD FUNCTION
+        parser.set_defaults(func=self.parent.call_query, needs_rep=False)
+
+
+    def __create_affected_parser(self):
+        parser = self.subparser.add_parser('affected', help="Print the harnesses that \
+            depend on the given files or functions, one per line.")
+
+        parser.add_argument("-jp", "--json_path", required=True, metavar="FILE",
+                            help="location of an internal representation saved by \
+            <{} build>. Its reverse index is used if it has one.".format(TOOL_NAME))
+        parser.add_argument("-f", "--function", action="append", default=[],
+                            dest="functions", metavar="FUNCTION",
+                            help="also print the harnesses that depend on FUNCTION. \
+            May be repeated.")
+        parser.add_argument("files", nargs="*", metavar="FILE",
+                            help="changed files, relative to the root of the project. \
+            If neither files nor functions are given, files are read from the standard \
+            input, one per line. Only changes to the functions of the call graph are \
+            tracked: a header whose change adds or removes no function or call, e.g. \
+            one that only changes macros or types, is not reported.")
+
+        # ADD FUNCTION
+        parser.set_defaults(func=self.parent.call_affected, needs_rep=False)
+
+
+    def __create_watch_parser(self):
+        parser = self.subparser.add_parser('watch', parents=[self.bare_minimum_parser,
+                                                             self.makefile_parser],
+                                           help="Generate a Makefile for every harness \
+            file found under a directory, then regenerate the Makefiles of the harnesses \
+            affected by each change of the sources, until interrupted.")
+
+        parser.add_argument("-r", "--root-dir", required=True, metavar="DIR",
+                            help="root directory for the project under test")
+        parser.add_argument("-pd", "--proofs-dir", default=os.getcwd(), metavar="DIR",
+                            help="directory under which all harness files are searched for.")
+        parser.add_argument("-jp", "--json_path", metavar="FILE",
+                            help="location of an internal representation saved by \
+            <{} build>. It is reused (or updated) at startup, and saved again after \
+            every change.".format(TOOL_NAME))
+        parser.add_argument("--interval", type=float, default=1.0, metavar="S",
+                            help="number of seconds between two checks of the sources.")
+
+        # ADD FUNCTION
+        parser.set_defaults(func=self.parent.call_watch, reuse_rep=True, incremental=True,
+                            summaries=False, reverse_index=False, database=None,
+                            snapshot=None, needs_rep=True)
+
+
+    def __create_serve_parser(self):
+        parser = self.subparser.add_parser('serve', parents=[self.bare_minimum_parser,
+                                                             self.makefile_parser],
+                                           help="Keep the internal representation in memory \
+            and answer <{} client> requests over a Unix socket.".format(TOOL_NAME))
+
+        parser.add_argument("-r", "--root-dir", required=True, metavar="DIR",
+                            help="root directory for the project under test")
+        parser.add_argument("-s", "--socket", required=True, metavar="FILE",
+                            help="path of the Unix socket to listen on")
+        parser.add_argument("-jp", "--json_path", metavar="FILE",
+                            help="location of an internal representation saved by \
+            <{} build>. It is reused (or updated) at startup, and saved again whenever \
+            it is refreshed.".format(TOOL_NAME))
+        parser.add_argument("-sn", "--snapshot", metavar="FILE",
+                            help="location of a binary snapshot saved by <{} build>. \
+            It is reused at startup if its inputs are unchanged.".format(TOOL_NAME))
+        parser.add_argument("--refresh-interval", type=float, default=1.0, metavar="S",
+                            help="minimum number of seconds between two checks of the \
+            inputs of the internal representation.")
+
+        # ADD FUNCTION
+        parser.set_defaults(func=self.parent.call_serve, reuse_rep=True, incremental=True,
+                            summaries=False, reverse_index=False, database=None,
+                            needs_rep=True)
+
+
+    def __create_client_parser(self):
+        parser = self.subparser.add_parser('client', help="Send a request to a running \
+            <{} serve> daemon.".format(TOOL_NAME))
+
+        parser.add_argument("-s", "--socket", required=True, metavar="FILE",
+                            help="path of the Unix socket the daemon listens on")
+        parser.add_argument("-sp", "--save-path", metavar="FILE",
+                            help="file path where the Makefile of a makefile request \
+            is saved")
+        parser.add_argument("request", choices=["makefile", "deps", "affected", "stop"],
+                            help="makefile HARNESS: generate the Makefile of a harness. \
+            deps FUNCTION: print the dependencies of a function. affected FILE...: print \
+            the harnesses that depend on the files, relative to the root of the project \
+            (read from stdin if none is given). \
+            stop: stop the daemon.")
+        parser.add_argument("values", nargs="*", metavar="VALUE",
+                            help="harness, function or files of the request")
+
+        # ADD FUNCTION
+        parser.set_defaults(func=self.parent.call_client, needs_rep=False)
 
 
     def parse_arguments(self):
         '''parse arguments'''
         # potentialTODO get inputs from JSON
         parser = argparse.ArgumentParser(description=__doc__)
+        # commands that do not build the internal representation are not profiled
+        parser.set_defaults(profile=None, profile_phases=[], trace_memory=False)
         self.subparser = parser.add_subparsers(help="Available commands for \
             {}".format(TOOL_NAME))
 
         self.bare_minimum_parser = self.__create_bare_minimum_parser()
+        self.makefile_parser = self.__create_makefile_parser()
         self.__create_build_parser()
         self.__create_run_parser()
+        self.__create_run_all_parser()
+        self.__create_query_parser()
+        self.__create_affected_parser()
+        self.__create_watch_parser()
+        self.__create_serve_parser()
+        self.__create_client_parser()
 
         # return Parsed Args
         return parser.parse_args()
@@ -207,3 +511,116 @@ class Util:
     def get_log_path(self, root):
         "return path to logging file given"
         return os.path.join(root, TOOL_NAME + ".log")
+
+
+class FileSystemCache:
+    ''' Class that caches file system metadata, stat results and real paths for all
+    path-resolution sites.
+    A listed directory answers queries about its entries without further syscalls.
+    Long-running commands must call invalidate when files may have changed '''
+
+    def __init__(self):
+        # directory -> {name: (is_dir, is_file), or None for symlinks}, or None
+        self.dir_2_entries = {}
+        # path -> (exists, is_dir, is_file)
+        self.path_2_kind = {}
+        # path -> os.stat result, or None
+        self.path_2_stat = {}
+        # path -> path with all symbolic links resolved
+        self.path_2_realpath = {}
+
+
+    def invalidate(self, path=None):
+        ''' forget the metadata of a path and of everything under it, or of all paths '''
+        # a changed symbolic link may change the real path of any path
+        self.path_2_realpath.clear()
+        if path is None:
+            self.dir_2_entries.clear()
+            self.path_2_kind.clear()
+            self.path_2_stat.clear()
+            return
+        path = os.path.abspath(path)
+        prefix = path + os.sep
+        for cache in (self.dir_2_entries, self.path_2_kind, self.path_2_stat):
+            for cached_path in [p for p in cache if p == path or p.startswith(prefix)]:
+                del cache[cached_path]
+        # the listing of the parent directory may be outdated too
+        self.dir_2_entries.pop(os.path.dirname(path), None)
+
+
+    def list_dir(self, directory):
+        ''' return the entries of a directory, listed once with os.scandir,
+        as {name: (is_dir, is_file)} with None for symlinks. None if it cannot be listed '''
+        directory = os.path.abspath(directory)
+        if directory not in self.dir_2_entries:
+            try:
+                entries = {}
+                with os.scandir(directory) as dir_entries:
+                    for entry in dir_entries:
+                        if entry.is_symlink():
+                            entries[entry.name] = None
+                        else:
+                            entries[entry.name] = (entry.is_dir(follow_symlinks=False),
+                                                   entry.is_file(follow_symlinks=False))
+            except OSError:
+                entries = None
+            self.dir_2_entries[directory] = entries
+        return self.dir_2_entries[directory]
+
+
+    def __get_kind(self, path):
+        path = os.path.abspath(path)
+        parent, name = os.path.split(path)
+        entries = self.dir_2_entries.get(parent)
+        if entries is not None:
+            if name not in entries:
+                return (False, False, False)
+            if entries[name] is not None:
+                return (True,) + entries[name]
+
+        if path not in self.path_2_kind:
+            path_stat = self.stat(path)
+            if path_stat is None:
+                self.path_2_kind[path] = (False, False, False)
+            else:
+                self.path_2_kind[path] = (True, stat.S_ISDIR(path_stat.st_mode),
+                                          stat.S_ISREG(path_stat.st_mode))
+        return self.path_2_kind[path]
+
+
+    def stat(self, path):
+        ''' cached equivalent of os.stat. None if the path cannot be stat'ed '''
+        path = os.path.abspath(path)
+        if path not in self.path_2_stat:
+            try:
+                self.path_2_stat[path] = os.stat(path)
+            except (OSError, ValueError):
+                self.path_2_stat[path] = None
+        return self.path_2_stat[path]
+
+
+    def realpath(self, path):
+        ''' cached equivalent of os.path.realpath '''
+        path = os.path.abspath(path)
+        if path not in self.path_2_realpath:
+            self.path_2_realpath[path] = os.path.realpath(path)
+        return self.path_2_realpath[path]
+
+
+    def exists(self, path):
+        ''' cached equivalent of os.path.exists '''
+        return isinstance(path, str) and self.__get_kind(path)[0]
+
+
+    def isdir(self, path):
+        ''' cached equivalent of os.path.isdir '''
+        return isinstance(path, str) and self.__get_kind(path)[1]
+
+
+    def isfile(self, path):
+        ''' cached equivalent of os.path.isfile '''
+        return isinstance(path, str) and self.__get_kind(path)[2]
+
+
+# shared by the whole process
+FS_CACHE = FileSystemCache()
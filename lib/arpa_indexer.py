@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+#   Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License").
+#   You may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+This module contains a built-in call graph indexer, used as an alternative to cflow
+'''
+
+import os
+import json
+import hashlib
+import logging
+import re
+import concurrent.futures
+import lib.arpa_build as arpa_build
+
+# bump this version whenever the indexer output changes, to invalidate cached results
+INDEXER_VERSION = "1"
+
+# identifiers that are followed by a parenthesis without being function calls
+NOT_CALLED = {
+    "if", "for", "while", "switch", "return", "sizeof", "case", "do", "else", "goto",
+    "defined", "_Alignof", "alignof", "__alignof__", "_Generic", "_Static_assert",
+    "static_assert", "typeof", "__typeof__", "__typeof", "__attribute__", "__attribute",
+    "__asm__", "asm", "__asm", "__declspec", "__builtin_offsetof", "offsetof",
+    "void", "char", "short", "int", "long", "float", "double", "signed", "unsigned",
+    "_Bool", "bool", "struct", "union", "enum", "const", "volatile", "restrict",
+    "static", "extern", "inline", "register", "auto", "typedef",
+}
+
+
+class IndexerInstance(arpa_build.CallGraphBackend):
+    ''' Class that finds function definitions and call sites by tokenizing C sources '''
+
+    # comments, string literals, character literals and preprocessor directives
+    noise_regex = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+                             r'|^[ \t]*#(?:\\\n|[^\n])*', re.DOTALL | re.MULTILINE)
+    extern_c_regex = re.compile(r'\bextern\s*""\s*\{')
+    token_regex = re.compile(r"[A-Za-z_]\w*|[{}();=]")
+
+    def __init__(self, jobs=1, cache_dir=None):
+        super().__init__(jobs)
+        self.cache_dir = cache_dir
+        self.h_and_c_files = []
+
+
+    def create_command(self, root_path, h_and_c_files=None):
+        ''' set the files to index. By default, index all files found under root_path '''
+        if h_and_c_files is None:
+            h_and_c_files = arpa_build.SourceDiscovery(root_path).walk()
+        self.h_and_c_files = list(h_and_c_files)
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+
+    def run_command(self):
+        ''' index all files, then resolve calls to the files defining the called functions '''
+        file_2_definitions = {}
+        index_jobs = [(f_path, self.cache_dir) for f_path in self.h_and_c_files]
+        if self.jobs > 1 and len(index_jobs) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                all_definitions = executor.map(IndexerInstance.index_file, index_jobs,
+                                               chunksize=32)
+                file_2_definitions = dict(zip(self.h_and_c_files, all_definitions))
+        else:
+            for index_job in index_jobs:
+                file_2_definitions[index_job[0]] = self.index_file(index_job)
+
+        for file, definitions in file_2_definitions.items():
+            if definitions:
+                # calls into the calling file come first, as cflow does for static functions
+                self.file_2_dependencies[file] = {
+                    fct: {called: (file if called in definitions else None) for called in calls}
+                    for fct, calls in definitions.items()}
+        self.resolve_unknown_calls()
+
+
+    @classmethod
+    def index_file(cls, job):
+        ''' return the functions defined in a file, mapped to the functions they call.
+        Results are cached by file contents if a cache directory is given '''
+        f_path, cache_dir = job
+        try:
+            with open(f_path, "rb") as handle:
+                contents = handle.read()
+        except OSError as error:
+            logging.warning("Could not read %s: %s", f_path, error)
+            return {}
+
+        cache_path = None
+        if cache_dir:
+            digest = hashlib.sha1(contents)
+            digest.update(INDEXER_VERSION.encode())
+            cache_path = os.path.join(cache_dir, digest.hexdigest() + ".json")
+            try:
+                with open(cache_path, "r") as handle:
+                    return json.load(handle)
+            except (OSError, ValueError):
+                pass
+
+        definitions = cls.find_definitions(contents.decode("utf-8", errors="ignore"))
+        if cache_path:
+            temp_path = "%s.%d" % (cache_path, os.getpid())
+            with open(temp_path, "w") as handle:
+                json.dump(definitions, handle)
+            os.replace(temp_path, cache_path)
+        return definitions
+
+
+    @classmethod
+    def __strip(cls, text):
+        ''' replace comments, literals and directives, keeping string delimiters '''
+        def blank(match):
+            noise = match.group(0)
+            return '""' if noise.startswith('"') else " "
+        text = cls.noise_regex.sub(blank, text)
+        # the braces of extern "C" blocks do not delimit a function body
+        return cls.extern_c_regex.sub(" ", text)
+
+
+    @classmethod
+    def __find_closing(cls, tokens, index, opening, closing):
+        ''' return the index of the token closing the group opened at index '''
+        depth = 0
+        for cur in range(index, len(tokens)):
+            if tokens[cur] == opening:
+                depth += 1
+            elif tokens[cur] == closing:
+                depth -= 1
+                if depth == 0:
+                    return cur
+        return len(tokens) - 1
+
+
+    @classmethod
+    def __is_definition(cls, tokens, index):
+        ''' check whether the name at index, followed by a parameter list,
+        starts a function definition. Return the index of its opening brace '''
+        cur = cls.__find_closing(tokens, index + 1, "(", ")") + 1
+        # skip attributes and macros between the parameter list and the body
+        while cur < len(tokens) and tokens[cur] not in ("{", ";", "=", ")", "}"):
+            if tokens[cur] == "(":
+                cur = cls.__find_closing(tokens, cur, "(", ")")
+            cur += 1
+        if cur < len(tokens) and tokens[cur] == "{":
+            return cur
+        return None
+
+
+    @classmethod
+    def find_definitions(cls, text):
+        ''' return the functions defined in the given C text, mapped to the
+        functions they call, in order of first call '''
+        tokens = cls.token_regex.findall(cls.__strip(text))
+        definitions = {}
+        depth = 0
+        cur = 0
+        while cur < len(tokens):
+            token = tokens[cur]
+            if token == "{":
+                depth += 1
+            elif token == "}":
+                depth = max(depth - 1, 0)
+            elif depth == 0 and cur + 1 < len(tokens) and tokens[cur + 1] == "(" \
+                    and token not in NOT_CALLED and (cur == 0 or tokens[cur - 1] != "="):
+                body_start = cls.__is_definition(tokens, cur)
+                if body_start is not None:
+                    body_end = cls.__find_closing(tokens, body_start, "{", "}")
+                    calls = definitions.setdefault(token, [])
+                    for body_cur in range(body_start + 1, body_end):
+                        called = tokens[body_cur]
+                        if tokens[body_cur + 1] == "(" and called not in NOT_CALLED \
+                                and called[0] not in "{}();=" and called not in calls:
+                            calls.append(called)
+                    cur = body_end
+            cur += 1
+        return definitions
@@ -22,23 +22,103 @@ import os
 import logging
 import sys
 import lib.arpa_helper as helper
+import lib.arpa_profile as arpa_profile
 
 class MakefileData():
     ''' Class that contains information found within a Makefile '''
-    includes = []
-    defines = []
-    proof_sources = []
-    project_sources = []
-    other_dependencies = []
-    missing_dependencies = {}
+
+    def __init__(self):
+        self.includes = []
+        self.defines = []
+        self.compile_flags = []
+        self.proof_sources = []
+        self.project_sources = []
+        self.other_dependencies = []
+        self.missing_dependencies = {}
+
+
+class PathPrefixTrie:
+    ''' Class that maps directories to a (category, Makefile variable) pair, with one
+    trie level per path component. A path is classified by its longest such prefix '''
+
+    def __init__(self):
+        self.root = {}
+
+
+    @classmethod
+    def __split(cls, path):
+        ''' split a path into its components. The root directory of absolute paths
+        is a component of its own, so that it can be a prefix as well '''
+        path = os.path.normpath(path)
+        components = [component for component in path.split(os.sep) if component]
+        return [os.sep] + components if os.path.isabs(path) else components
+
+
+    def add(self, prefix_path, category, variable):
+        ''' map a directory to a category and variable, unless it already is mapped '''
+        node = self.root
+        for component in self.__split(prefix_path):
+            node = node.setdefault(component, {})
+        # None never is a path component, so it marks the end of a prefix
+        node.setdefault(None, (category, variable))
+
+
+    def find(self, path):
+        ''' return the category, variable and relative path of the longest prefix of
+        path, or None if no prefix matches '''
+        components = self.__split(path)
+        node = self.root
+        match = None
+        for depth, component in enumerate(components):
+            if None in node:
+                match = (node[None], depth)
+            node = node.get(component)
+            if node is None:
+                break
+        else:
+            if None in node:
+                match = (node[None], len(components))
+        if match is None:
+            return None
+        (category, variable), depth = match
+        return (category, variable, os.path.join(*components[depth:]) if components[depth:]
+                else "")
+
+
+    @classmethod
+    def from_args(cls, args):
+        ''' build the trie of the Makefile variables given on the command line '''
+        # TODO instead of relying on paths to find whether a file is a PROOF_SOURCE
+        # or a PROJECT_SOURCE, make that distinction based on proof markers found in the
+        # file system. For this purpose, we may add a command line flag that indicates
+        # what a proof marker is for a given project, such that the entire process
+        # can be automated.
+
+        # TODO another idea may be to incorporate a "arpa_config.json" file in
+        # each project where we specify the paths to proof source directories,
+        # and other relevant information
+
+        # this trie maps file locations to the type of dependency (PROOF_SOURCE,
+        # PROJECT_SOURCE). For example, we currently assume that all PROOF_SOURCES
+        # are under "make_proof_source_path", under "make_proof_stub_path" or under
+        # one of the "make_proof_source_roots", and that all PROJECT_SOURCES are under
+        # "make_root_path". Proof directories are added first, so they win over
+        # identical project directories
+        path_trie = cls()
+        path_trie.add(args.make_proof_source_path, "proof", args.make_proof_source_variable)
+        path_trie.add(args.make_proof_stub_path, "proof", args.make_proof_stub_variable)
+        for variable, path in getattr(args, "make_proof_source_roots", None) or []:
+            path_trie.add(path, "proof", variable)
+        path_trie.add(args.make_root_path, "project", args.make_root_variable)
+        return path_trie
 
 
 class MakefileReadyContents:
     ''' class that contains all the info needed to create a makefile for a given harness '''
 
-    def __init__(self, info):
+    def __init__(self, info, path_trie=None):
         self.raw_info = info
-        self.variable_2_path = {}
+        self.path_trie = path_trie
         self.data = MakefileData()
 
 
@@ -57,18 +137,15 @@ class MakefileReadyContents:
 
 
     def __check_com_prefixes(self, path):
-        ''' check if prefix is a prefix of path. return updated path '''
-        for cat in self.variable_2_path:
-            for prefix_path in self.variable_2_path[cat]:
-                if os.path.commonprefix([path, prefix_path]) == prefix_path:
-                    if path == prefix_path:
-                        return (cat, self.__make_val(self.variable_2_path[cat][prefix_path]))
-
-                    rel_path = os.path.relpath(path, prefix_path)
-                    return (cat, os.path.join(
-                        self.__make_val(self.variable_2_path[cat][prefix_path]), rel_path))
+        ''' find the longest directory prefix of path. return updated path '''
+        match = self.path_trie.find(path)
+        if match is None:
+            return ("none", path)
 
-        return ("none", path)
+        cat, variable, rel_path = match
+        if not rel_path:
+            return (cat, self.__make_val(variable))
+        return (cat, os.path.join(self.__make_val(variable), rel_path))
 
 
     def __make_val(self, var):
@@ -95,10 +172,16 @@ class MakefileReadyContents:
         return dependencies_w_ext
 
 
+    def __get_flag_values(self, flag):
+        ''' return the values of a given flag among the other compiler flags '''
+        return [value for other_flag, value in self.raw_info.flags if other_flag == flag]
+
+
     def process_custom_info(self, args):
         ''' add Makefile shortcuts to paths in MakefileInfo '''
 
-        self.__set_variable_2_path(args)
+        if self.path_trie is None:
+            self.path_trie = PathPrefixTrie.from_args(args)
 
         # INCLUDES
         includes_2_shortcut_path = \
@@ -106,8 +189,25 @@ class MakefileReadyContents:
         _ = [self.data.includes.extend(includes_2_shortcut_path[k])
              for k in includes_2_shortcut_path]
 
+        # other include dirs follow the -I ones, as the compiler searches them later
+        for flag in (helper.CC_QUOTE_INCLUDE, helper.CC_SYSTEM_INCLUDE):
+            flag_2_shortcut_path = self.__shortcut_path(self.__get_flag_values(flag),
+                                                        flag + " ")
+            _ = [self.data.includes.extend(flag_2_shortcut_path[k])
+                 for k in flag_2_shortcut_path]
+
         # DEFINES
         self.data.defines = self.__add_prefix_and_sort(self.raw_info.defines, helper.CC_DEFINE)
+        self.data.defines.extend(self.__add_prefix_and_sort(
+            self.__get_flag_values(helper.CC_UNDEFINE), helper.CC_UNDEFINE))
+
+        # COMPILE FLAGS
+        self.data.compile_flags = self.__add_prefix_and_sort(
+            self.__get_flag_values(helper.CC_STD), helper.CC_STD)
+        forced_2_shortcut_path = self.__shortcut_path(
+            self.__get_flag_values(helper.CC_FORCE_INCLUDE), helper.CC_FORCE_INCLUDE + " ")
+        _ = [self.data.compile_flags.extend(forced_2_shortcut_path[k])
+             for k in forced_2_shortcut_path]
 
         #DEPENDENCIES
         dependencies_w_ext = self.__change_extensions(self.raw_info.dependencies,
@@ -121,49 +221,22 @@ class MakefileReadyContents:
         self.data.missing_dependencies = self.raw_info.missing_dependencies # unordered
 
 
-    def __set_variable_2_path(self, args):
-        # TODO instead of relying on paths to find whether a file is a PROOF_SOURCE
-        # or a PROJECT_SOURCE, make that distinction based on proof markers found in the
-        # file system. For this purpose, we may add a command line flag that indicates
-        # what a proof marker is for a given project, such that the entire process
-        # can be automated.
-
-        # TODO instead, it may also be possible to extend the existing cli such that it
-        # would allow users to specify a list of proof source root directories rather
-        # than a single proof source directory.
-
-        # TODO another idea may be to incorporate a "arpa_config.json" file in
-        # each project where we specify the paths to proof source directories,
-        # and other relevant information
-
-        # this dictionary maps the type of dependency (PROOF_SOURCE. PROJECT_SOURCE)
-        # to the file location. For example, we currently assume that all PROOF_SOURCES
-        # are under "make_proof_source_path" or under "make_proof_stub_path",
-        # and that all PROJECT_SOURCES are under "make_root_path"
-        self.variable_2_path = {"proof" : {
-            # args.make_proofs_path: args.make_proofs_name,
-            args.make_proof_source_path: args.make_proof_source_variable,
-            args.make_proof_stub_path: args.make_proof_stub_variable},
-                                "project" : {
-                                    args.make_root_path: args.make_root_variable}}
-
-
 class Makefile:
     ''' Class that stores Makefile-related info and that can generate a makefile '''
 
-    def __init__(self, args, internal_rep):
-        self.contents_raw = helper.FileSpecificInfo(internal_rep)
-        self.contents_processed = MakefileReadyContents(self.contents_raw)
+    def __init__(self, args, graph, file_under_test, path_trie=None):
+        self.contents_raw = helper.FileSpecificInfo(graph)
+        self.contents_processed = MakefileReadyContents(self.contents_raw, path_trie)
 
         self.args = args
         self.save_path = ""
-        self.directory = ProofDirectory(self.args.file_under_test)
+        self.directory = ProofDirectory(file_under_test)
         self.textual_representation = []
 
 
     def set_save_path(self):
         ''' set field values according to input arguments '''
-        if self.args.save_path:
+        if getattr(self.args, "save_path", None):
             self.save_path = self.args.save_path
         else:
             self.save_path = os.path.join(self.directory.path, helper.OUT_MF_NAME)
@@ -207,6 +280,9 @@ class Makefile:
                                                    self.args.define_variable))
         lines_to_add.extend(self.__append_variable(self.contents_processed.data.includes,
                                                    self.args.include_variable))
+        if self.contents_processed.data.compile_flags:
+            lines_to_add.extend(self.__append_variable(
+                self.contents_processed.data.compile_flags, self.args.compile_flags_variable))
         lines_to_add.extend(self.__append_variable(self.contents_processed.data.proof_sources,
                                                    self.args.make_proof_sources_variable))
         lines_to_add.extend(self.__append_variable(self.contents_processed.data.project_sources,
@@ -233,18 +309,28 @@ class Makefile:
         lines_to_add.append("# You may need to find the files these functions reside in")
         lines_to_add.append("# and add them to the $(PROJECT_SOURCES) array.")
 
-        for source, functions in self.contents_processed.data.missing_dependencies.items():
+        missing_dependencies = self.contents_processed.data.missing_dependencies
+        for source in sorted(missing_dependencies):
             file = source[0]
             func = source[1]
-            lines_to_add.extend(["# * <%s>   in %s:%s" % (f, file, func) for f in functions])
+            lines_to_add.extend(["# * <%s>   in %s:%s" % (f, file, func)
+                                 for f in sorted(missing_dependencies[source])])
 
         self.textual_representation.extend(lines_to_add)
 
 
     def build(self):
         ''' create an internal textual representation of a Makefile to generate '''
+        with arpa_profile.PROFILER.phase(arpa_profile.PHASE_MAKEFILE):
+            self.__build()
+        arpa_profile.PROFILER.count("makefiles")
+        arpa_profile.PROFILER.count("missing_dependencies", sum(
+            len(called) for called in self.contents_raw.missing_dependencies.values()))
+
+
+    def __build(self):
         harness_path = self.directory.harness_path
-        if harness_path not in self.contents_raw.internal_rep[helper.JSON_FILE]:
+        if not self.contents_raw.graph.has_file(harness_path):
             logging.error("<%s> not found in given internal representation. "
                           "Try rebuilding the internal rep.", harness_path)
             sys.exit(1)
@@ -255,11 +341,13 @@ class Makefile:
 
         # From the internal representation,
         # get list of all functions defined in the harness
-        harness_functions = self.contents_raw.internal_rep[helper.JSON_FILE]\
-            [harness_path][helper.JSON_FCT].keys()
+        harness_functions = self.contents_raw.graph.get_functions(harness_path)
 
         # find and process custom build info
-        self.contents_raw.find_custom_info_recursively(harness_path, harness_functions)
+        if self.contents_raw.graph.summaries is not None:
+            self.contents_raw.find_summarized_info(harness_path, harness_functions)
+        else:
+            self.contents_raw.find_custom_info(harness_path, harness_functions)
         self.contents_processed.process_custom_info(self.args)
 
         self.__add_custom_info_to_text()
@@ -272,7 +360,8 @@ class Makefile:
 
     def save(self):
         ''' generate a Makefile based on instance contents '''
-        with open(self.save_path, "w") as output:
+        with arpa_profile.PROFILER.phase(arpa_profile.PHASE_MAKEFILE), \
+                open(self.save_path, "w") as output:
             print("\n".join(self.textual_representation), file=output)
         print("-- Created {} Makefile at \
             {}".format(helper.TOOL_NAME, os.path.abspath(self.save_path)))
@@ -287,13 +376,35 @@ class ProofDirectory:
         self.__set_harness_path(input_path)
 
 
+    @classmethod
+    def find_all_harnesses(cls, proofs_dir):
+        ''' return the sorted paths of all harness files found under proofs_dir '''
+        if not helper.FS_CACHE.isdir(proofs_dir):
+            logging.error("Specified path does not point to an existing directory: %s",
+                          proofs_dir)
+            sys.exit(1)
+
+        all_harnesses = []
+        # like os.walk, with directories listed through the cache
+        stack = [os.path.abspath(proofs_dir)]
+        while stack:
+            root = stack.pop()
+            for name, kind in (helper.FS_CACHE.list_dir(root) or {}).items():
+                path = os.path.join(root, name)
+                if kind is not None and kind[0]:
+                    stack.append(path)
+                elif name.endswith("_harness.c") and not helper.FS_CACHE.isdir(path):
+                    all_harnesses.append(path)
+        return sorted(all_harnesses)
+
+
     def __set_harness_path(self, input_path):
         ''' find harness file in current directory. Return its path '''
         harness_path = ""
         # if harness path is given
         if input_path:
             harness_path = os.path.abspath(input_path)
-            if not os.path.exists(harness_path):
+            if not helper.FS_CACHE.exists(harness_path):
                 logging.error("Specified path does not point to an existing file: %s", harness_path)
                 sys.exit(1)
             self.harness_path = harness_path
@@ -302,7 +413,7 @@ class ProofDirectory:
 
         # look for harness in cwd
         found_harness = False
-        for file in os.listdir("."):
+        for file in helper.FS_CACHE.list_dir(os.getcwd()) or []:
             if file.endswith("_harness.c"):
                 if found_harness:
                     logging.error("too many harness files in current directory!!")
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+#   Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License").
+#   You may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+This module contains the instrumentation that measures the phases of an arpa run
+'''
+
+import os
+import sys
+import json
+import time
+import cProfile
+import resource
+import contextlib
+import tracemalloc
+
+# phase names, in the order in which a build runs them
+PHASE_COMPILE_COMMANDS = "compile_commands"
+PHASE_DISCOVERY = "discovery"
+PHASE_PARSE_OUTPUT = "parse_output"
+PHASE_ADD_DEPENDENCIES = "add_dependencies"
+PHASE_VALIDATE = "validate"
+PHASE_SUMMARIES = "summaries"
+PHASE_REVERSE_INDEX = "reverse_index"
+PHASE_SERIALIZATION = "serialization"
+PHASE_DESERIALIZATION = "deserialization"
+PHASE_REACHABILITY = "reachability"
+PHASE_MAKEFILE = "makefile"
+ALL_PHASES = "all"
+
+
+class PhaseStats:
+    ''' Class that accumulates the measurements of every run of a phase '''
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.children_cpu_time = 0.0
+        self.max_rss_kb = 0
+        self.traced_peak = 0
+
+
+    def to_json(self):
+        ''' return the json report of the phase '''
+        phase_json = {"calls": self.calls,
+                      "wall_time": round(self.wall_time, 6),
+                      "cpu_time": round(self.cpu_time, 6),
+                      "children_cpu_time": round(self.children_cpu_time, 6),
+                      "max_rss_kb": self.max_rss_kb}
+        if tracemalloc.is_tracing():
+            phase_json["traced_peak_bytes"] = self.traced_peak
+        return phase_json
+
+
+class Profiler:
+    ''' Class that records the wall time, CPU time and peak memory of named phases,
+    and named counters. Phases may be nested: the time of a nested phase is also
+    part of the time of the enclosing one. Phases run in worker processes are only
+    measured in the worker if it reports them with pop_phase, and the parent process
+    adds them to its own with merge_phase. Does nothing until enabled, so that phases
+    can be marked unconditionally '''
+
+    def __init__(self):
+        self.enabled = False
+        self.report_path = None
+        self.phases = {}
+        self.counters = {}
+        # phases wrapped in cProfile, and their profiles
+        self.profiled_phases = set()
+        self.profiles = {}
+        self.active_profile = None
+        # traced memory peaks of the running phases, innermost last
+        self.peak_stack = []
+        self.start = None
+
+
+    def enable(self, report_path, profiled_phases=(), trace_memory=False):
+        ''' start measuring. The report is written to report_path, and the cProfile
+        statistics of each profiled phase next to it '''
+        self.enabled = True
+        self.report_path = report_path
+        self.profiled_phases = set(profiled_phases)
+        if trace_memory:
+            tracemalloc.start()
+        self.start = (time.perf_counter(), time.process_time(), self.__children_cpu_time())
+
+
+    @classmethod
+    def __children_cpu_time(cls):
+        times = os.times()
+        return times.children_user + times.children_system
+
+
+    @classmethod
+    def __max_rss_kb(cls):
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes elsewhere
+        return max_rss // 1024 if sys.platform == "darwin" else max_rss
+
+
+    def __is_profiled(self, name):
+        return ALL_PHASES in self.profiled_phases or name in self.profiled_phases
+
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        ''' measure the code run in a with block as part of a phase '''
+        if not self.enabled:
+            yield
+            return
+
+        # only one cProfile profiler may be active. A profiled phase nested in another
+        # one is part of the profile of the outer phase
+        profile = None
+        if self.active_profile is None and self.__is_profiled(name):
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+            self.active_profile = profile
+            profile.enable()
+        if tracemalloc.is_tracing():
+            self.__push_traced_peak()
+
+        wall, cpu, children_cpu = \
+            time.perf_counter(), time.process_time(), self.__children_cpu_time()
+        try:
+            yield
+        finally:
+            stats = self.phases.setdefault(name, PhaseStats())
+            stats.calls += 1
+            stats.wall_time += time.perf_counter() - wall
+            stats.cpu_time += time.process_time() - cpu
+            stats.children_cpu_time += self.__children_cpu_time() - children_cpu
+            stats.max_rss_kb = max(stats.max_rss_kb, self.__max_rss_kb())
+            if tracemalloc.is_tracing():
+                stats.traced_peak = max(stats.traced_peak, self.__pop_traced_peak())
+            if profile is not None:
+                profile.disable()
+                self.active_profile = None
+
+
+    def __push_traced_peak(self):
+        ''' tracemalloc has a single peak. It is reset when a phase starts, after the
+        peak so far is saved for the enclosing phase '''
+        if self.peak_stack:
+            self.peak_stack[-1] = max(self.peak_stack[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self.peak_stack.append(0)
+
+
+    def __pop_traced_peak(self):
+        peak = max(self.peak_stack.pop(), tracemalloc.get_traced_memory()[1])
+        if self.peak_stack:
+            self.peak_stack[-1] = max(self.peak_stack[-1], peak)
+        tracemalloc.reset_peak()
+        return peak
+
+
+    def pop_phase(self, name):
+        ''' remove and return the measurements of a phase, or None if it did not run '''
+        return self.phases.pop(name, None)
+
+
+    def merge_phase(self, name, other_stats):
+        ''' add the measurements of a phase run in a worker process. Times of runs
+        in parallel workers add up, and peak memory is the peak of any process '''
+        if not self.enabled or other_stats is None:
+            return
+        stats = self.phases.setdefault(name, PhaseStats())
+        stats.calls += other_stats.calls
+        stats.wall_time += other_stats.wall_time
+        stats.cpu_time += other_stats.cpu_time
+        stats.children_cpu_time += other_stats.children_cpu_time
+        stats.max_rss_kb = max(stats.max_rss_kb, other_stats.max_rss_kb)
+        stats.traced_peak = max(stats.traced_peak, other_stats.traced_peak)
+
+
+    def count(self, name, value=1):
+        ''' add value to a counter '''
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def count_graph(self, graph):
+        ''' record the size of a call graph '''
+        if not self.enabled:
+            return
+        n_functions = n_edges = 0
+        for entry in graph.entries.values():
+            n_functions += len(entry.functions)
+            n_edges += sum(len(calls) for calls in entry.functions.values()) // 2
+        self.counters["files"] = len(graph.entries)
+        self.counters["functions"] = n_functions
+        self.counters["edges"] = n_edges
+        self.counters["flag_sets"] = len(graph.flag_sets)
+
+
+    def get_profile_path(self, name):
+        ''' return the path where the cProfile statistics of a phase are saved '''
+        return "%s.%s.prof" % (os.path.splitext(self.report_path)[0], name)
+
+
+    def to_json(self):
+        ''' return the json report of all phases and counters '''
+        wall, cpu, children_cpu = self.start
+        report = {
+            "command": sys.argv[1:],
+            "total": {"wall_time": round(time.perf_counter() - wall, 6),
+                      "cpu_time": round(time.process_time() - cpu, 6),
+                      "children_cpu_time": round(self.__children_cpu_time() - children_cpu, 6),
+                      "max_rss_kb": self.__max_rss_kb()},
+            "phases": {name: stats.to_json() for name, stats in self.phases.items()},
+            "counters": dict(sorted(self.counters.items())),
+        }
+        if tracemalloc.is_tracing():
+            report["total"]["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        for name in self.profiles:
+            report["phases"][name]["profile"] = os.path.abspath(self.get_profile_path(name))
+        return report
+
+
+    def write(self):
+        ''' save the report, and the cProfile statistics of the profiled phases '''
+        if not self.enabled:
+            return
+        report = self.to_json()
+        for name, profile in self.profiles.items():
+            profile.dump_stats(self.get_profile_path(name))
+        with open(self.report_path, "w") as handle:
+            json.dump(report, handle, indent=4)
+            handle.write("\n")
+
+
+# shared by the whole process
+PROFILER = Profiler()
+
+
+def start_worker(enabled):
+    ''' reset the profiler of a worker process, which measures the phases it reports
+    back to the parent process if the profiler of the parent is enabled '''
+    global PROFILER # pylint: disable=global-statement
+    PROFILER = Profiler()
+    PROFILER.enabled = enabled
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+#   Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License").
+#   You may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+This module contains the arpa daemon, which answers requests over a Unix socket,
+and its client
+'''
+
+import os
+import sys
+import copy
+import json
+import stat
+import time
+import socket
+import logging
+import socketserver
+import lib.arpa_helper as helper
+import lib.arpa_makefile as arpa_makefile
+
+REQUEST_MAKEFILE = "makefile"
+REQUEST_DEPS = "deps"
+REQUEST_AFFECTED = "affected"
+REQUEST_STOP = "stop"
+
+
+class RequestError(Exception):
+    ''' Error reported to the client instead of stopping the daemon '''
+
+
+def describe_error(error):
+    ''' return the message reported to the client for an error '''
+    if isinstance(error, SystemExit):
+        # arpa logs its errors before exiting
+        return "failed with an error logged to %s" % helper.Util().get_log_path(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return str(error) or type(error).__name__
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    ''' Class that reads one json request per connection and writes its response '''
+
+    def handle(self):
+        request_line = self.rfile.readline()
+        if not request_line:
+            # the connection was closed without a request, e.g. by a probing daemon
+            return
+        try:
+            request = json.loads(request_line.decode())
+            response = self.server.answer(request)
+        except (ValueError, KeyError, TypeError, OSError, RequestError, SystemExit) as error:
+            # a failed request is reported to the client, and the daemon keeps serving
+            logging.warning("Request failed: %s", describe_error(error))
+            response = {"error": describe_error(error)}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class ArpaServer(socketserver.UnixStreamServer):
+    ''' Class that keeps the internal representation of an arpa instance in memory.
+    Requests are answered one at a time. Before answering, the internal representation
+    is refreshed if its inputs changed, at most once per refresh interval '''
+
+    def __init__(self, socket_path, arpa_instance, refresh_interval):
+        self.__remove_stale_socket(socket_path)
+        super().__init__(socket_path, RequestHandler)
+        self.socket_path = socket_path
+        self.arpa_instance = arpa_instance
+        self.refresh_interval = refresh_interval
+        self.last_refresh = time.monotonic()
+        self.path_trie = arpa_makefile.PathPrefixTrie.from_args(arpa_instance.args)
+        self.stopped = False
+
+
+    @classmethod
+    def __remove_stale_socket(cls, socket_path):
+        ''' remove a socket left behind by a daemon that did not stop cleanly.
+        Exit if another daemon still listens on it '''
+        try:
+            mode = os.stat(socket_path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            logging.error("Specified socket path is not a socket: %s", socket_path)
+            sys.exit(1)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(socket_path)
+            except ConnectionRefusedError:
+                os.remove(socket_path)
+                return
+        logging.error("Another daemon is listening at %s", socket_path)
+        sys.exit(1)
+
+
+    def serve_until_stopped(self):
+        ''' answer requests until a stop request is received '''
+        try:
+            while not self.stopped:
+                self.handle_request()
+        finally:
+            self.server_close()
+            os.remove(self.socket_path)
+
+
+    def __refresh(self):
+        if time.monotonic() - self.last_refresh < self.refresh_interval:
+            return
+        try:
+            changed_files = self.arpa_instance.refresh_internal_rep()
+        except (ValueError, KeyError, TypeError, OSError, SystemExit) as error:
+            # the previous internal representation is kept, and the refresh is retried
+            # with the next request
+            raise RequestError("could not refresh the internal representation: %s"
+                               % describe_error(error)) from error
+        if changed_files is not None:
+            logging.info("Inputs changed. Refreshed the internal representation.")
+        self.last_refresh = time.monotonic()
+
+
+    def answer(self, request):
+        ''' return the json response to a json request '''
+        kind = request["request"]
+        if kind == REQUEST_STOP:
+            self.stopped = True
+            return {}
+
+        self.__refresh()
+        if kind == REQUEST_MAKEFILE:
+            return self.__answer_makefile(request["harness"], request.get("save_path"))
+        if kind == REQUEST_DEPS:
+            return self.__answer_deps(request["function"])
+        if kind == REQUEST_AFFECTED:
+            return self.__answer_affected(request["files"])
+        raise RequestError("unknown request: %s" % kind)
+
+
+    @property
+    def graph(self):
+        ''' call graph of the current internal representation '''
+        return self.arpa_instance.internal_rep.graph
+
+
+    def __answer_makefile(self, harness_path, save_path):
+        harness_path = os.path.abspath(harness_path)
+        if not self.graph.has_file(harness_path):
+            raise RequestError("<%s> not found in the internal representation" % harness_path)
+        args = copy.copy(self.arpa_instance.args)
+        args.save_path = save_path
+        makefile = arpa_makefile.Makefile(args, self.graph, harness_path, self.path_trie)
+        makefile.set_save_path()
+        makefile.build()
+        makefile.save()
+        return {"path": os.path.abspath(makefile.save_path)}
+
+
+    def __answer_deps(self, fct):
+        fct_id = self.graph.functions.get_id(fct)
+        definitions = {}
+        for file_id, entry in self.graph.entries.items():
+            if fct_id is None or fct_id not in entry.functions:
+                continue
+            path = self.graph.files[file_id]
+            info = helper.FileSpecificInfo(self.graph)
+            info.find_custom_info(path, [fct])
+            definitions[path] = {
+                helper.JSON_DEPS: sorted(info.dependencies),
+                helper.JSON_MISSING: sorted([file, caller, called]
+                                            for (file, caller), called_fcts
+                                            in info.missing_dependencies.items()
+                                            for called in called_fcts),
+            }
+        return {"definitions": definitions}
+
+
+    def __answer_affected(self, files):
+        # the reverse index is cached by the graph until it changes
+        reverse_index = self.graph.get_reverse_index()
+        internal_rep = self.arpa_instance.internal_rep
+        return {"harnesses": reverse_index.find_affected(
+            [internal_rep.resolve_path(file) for file in files])}
+
+
+class ArpaClient:
+    ''' Class that sends requests to an arpa daemon '''
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+
+
+    def send(self, request):
+        ''' send a json request. Return the json response.
+        Raise RequestError if the daemon could not answer it '''
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            try:
+                connection.connect(self.socket_path)
+            except OSError as error:
+                raise RequestError("no daemon listening at %s: %s"
+                                   % (self.socket_path, error)) from error
+            connection.sendall(json.dumps(request).encode() + b"\n")
+            with connection.makefile("rb") as response_file:
+                response_line = response_file.readline()
+        try:
+            response = json.loads(response_line.decode())
+        except ValueError as error:
+            raise RequestError("the daemon at %s did not answer the request"
+                               % self.socket_path) from error
+        if "error" in response:
+            raise RequestError(response["error"])
+        return response
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+#   Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License").
+#   You may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+This module contains the binary snapshot format of the arpa internal representation
+'''
+
+import os
+import sys
+import json
+import mmap
+import array
+import struct
+import logging
+import collections.abc
+import lib.arpa_graph as arpa_graph
+
+SNAPSHOT_MAGIC = b"ARPASNAP"
+# bump this version whenever the format changes, to invalidate existing snapshots
+SNAPSHOT_VERSION = 5
+
+# sections following the header, each stored as an (offset, length) pair.
+# Json sections are empty when the internal representation has no such data
+SECTIONS = ("meta", "summaries", "reverse_index", "string_offsets", "strings", "entry_of",
+            "entries", "flag_sets", "flags", "functions", "calls")
+HEADER = struct.Struct("<8sII" + "QQ" * len(SECTIONS))
+BYTE_ORDERS = {"little": 0, "big": 1}
+
+# json sections, decoded on demand by the class method that creates them from json
+JSON_SECTIONS = {"summaries": arpa_graph.FunctionSummaries.from_json,
+                 "reverse_index": arpa_graph.ReverseIndex.from_json}
+
+# int32 fields of a file entry: path, name, flag set, first function, number of functions
+ENTRY_FIELDS = 5
+# int32 fields of a flag set: first flag, number of includes, number of defines,
+# number of other (flag, value) pairs
+FLAG_SET_FIELDS = 4
+# int32 fields of a function: name, first call, end of calls
+FUNCTION_FIELDS = 3
+
+
+class Snapshot:
+    ''' Class that reads a memory-mapped snapshot. All strings are stored once in a
+    sorted table, so they are found by binary search. File and function IDs of the
+    graphs created from a snapshot are indices in this table '''
+
+    def __init__(self, path):
+        with open(path, "rb") as handle:
+            self.buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        # views of the buffer, which must all be released before it is closed
+        self.views = [memoryview(self.buffer)]
+        try:
+            header = HEADER.unpack_from(self.buffer)
+            if header[0] != SNAPSHOT_MAGIC or header[1] != SNAPSHOT_VERSION or \
+                    header[2] != BYTE_ORDERS[sys.byteorder]:
+                raise ValueError("incompatible snapshot: %s" % path)
+        except (ValueError, struct.error):
+            self.close()
+            raise
+
+        sections = {}
+        for index, section in enumerate(SECTIONS):
+            offset, length = header[3 + 2 * index], header[4 + 2 * index]
+            sections[section] = self.__add_view(self.views[0][offset:offset + length])
+        self.meta = json.loads(bytes(sections["meta"]).decode())
+        # json sections are decoded when they are first needed
+        self.json_sections = {section: sections[section] for section in JSON_SECTIONS}
+        self.string_offsets = self.__add_view(sections["string_offsets"].cast("q"))
+        self.strings = sections["strings"]
+        self.entry_of = self.__add_view(sections["entry_of"].cast("i"))
+        self.entries = self.__add_view(sections["entries"].cast("i"))
+        self.flag_sets = self.__add_view(sections["flag_sets"].cast("i"))
+        self.flags = self.__add_view(sections["flags"].cast("i"))
+        self.functions = self.__add_view(sections["functions"].cast("i"))
+        self.calls = self.__add_view(sections["calls"].cast("i"))
+        self.n_strings = len(self.string_offsets) - 1
+        self.decoded_strings = {}
+
+
+    def __add_view(self, view):
+        self.views.append(view)
+        return view
+
+
+    def close(self):
+        ''' unmap the snapshot. Graphs created from it can no longer be used '''
+        for view in reversed(self.views):
+            view.release()
+        self.views = []
+        self.buffer.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def has_json_section(self, section):
+        ''' check whether a json section (summaries or reverse index) is stored '''
+        return len(self.json_sections[section]) > 0
+
+
+    def decode_json_section(self, section):
+        ''' decode a json section, or return None if it is empty '''
+        if not self.has_json_section(section):
+            return None
+        return json.loads(bytes(self.json_sections[section]).decode())
+
+
+    def get_string(self, string_id):
+        ''' decode a string of the table, once '''
+        string = self.decoded_strings.get(string_id)
+        if string is None:
+            start = self.string_offsets[string_id]
+            string = bytes(self.strings[start:self.string_offsets[string_id + 1]]).decode()
+            self.decoded_strings[string_id] = string
+        return string
+
+
+    def find_string(self, string):
+        ''' return the ID of a string, or None if it is not in the table '''
+        low, high = 0, self.n_strings
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_string(middle) < string:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_strings and self.get_string(low) == string:
+            return low
+        return None
+
+
+    def has_entry(self, file_id):
+        ''' check whether the snapshot has an entry for a file '''
+        return file_id < self.n_strings and self.entry_of[file_id] != -1
+
+
+    def entry_file_ids(self):
+        ''' return the IDs of the files that have an entry '''
+        return [self.entries[row * ENTRY_FIELDS]
+                for row in range(len(self.entries) // ENTRY_FIELDS)]
+
+
+    def decode_entry(self, file_id):
+        ''' decode the entry of a file. Raise KeyError if it has none '''
+        if not self.has_entry(file_id):
+            raise KeyError(file_id)
+        start = self.entry_of[file_id] * ENTRY_FIELDS
+        _, name, flag_set, fct_start, n_functions = self.entries[start:start + ENTRY_FIELDS]
+        entry = arpa_graph.FileEntry(self.get_string(name), flag_set)
+        for row in range(fct_start, fct_start + n_functions):
+            fct, call_start, call_end = \
+                self.functions[row * FUNCTION_FIELDS:(row + 1) * FUNCTION_FIELDS]
+            calls = array.array("i")
+            calls.frombytes(self.calls[call_start:call_end].tobytes())
+            entry.functions[fct] = calls
+        return entry
+
+
+    def decode_flag_set(self, flag_set_id):
+        ''' decode a flag set of the table '''
+        start = flag_set_id * FLAG_SET_FIELDS
+        flag_start, n_includes, n_defines, n_flags = \
+            self.flag_sets[start:start + FLAG_SET_FIELDS]
+        flag_end = flag_start + n_includes + n_defines + 2 * n_flags
+        flags = [self.get_string(flag) for flag in self.flags[flag_start:flag_end]]
+        other_flags = flags[n_includes + n_defines:]
+        return arpa_graph.FlagSet(tuple(flags[:n_includes]),
+                                  tuple(flags[n_includes:n_includes + n_defines]),
+                                  tuple(zip(other_flags[::2], other_flags[1::2])))
+
+
+    def create_graph(self):
+        ''' return a call graph whose strings, entries, summaries and reverse index are
+        decoded on demand. The flag set table is small, so it is decoded at once '''
+        graph = SnapshotCallGraph(self)
+        graph.files = SnapshotStringTable(self)
+        graph.functions = SnapshotStringTable(self)
+        graph.flag_sets = arpa_graph.StringTable()
+        for flag_set_id in range(len(self.flag_sets) // FLAG_SET_FIELDS):
+            graph.flag_sets.intern(self.decode_flag_set(flag_set_id))
+        graph.entries = SnapshotEntries(self)
+        return graph
+
+
+    @classmethod
+    def write(cls, path, meta, graph):
+        ''' save a call graph, its summaries and reverse index, and json metadata
+        to a snapshot '''
+        strings = set()
+        for file_id in range(len(graph.files)):
+            strings.add(graph.files[file_id])
+        for fct_id in range(len(graph.functions)):
+            strings.add(graph.functions[fct_id])
+        for entry in graph.entries.values():
+            strings.add(entry.name)
+        for flag_set in graph.flag_sets.strings:
+            strings.update(flag_set.includes)
+            strings.update(flag_set.defines)
+            for flag in flag_set.flags:
+                strings.update(flag)
+        strings = sorted(strings)
+        string_ids = {string: string_id for string_id, string in enumerate(strings)}
+        file_2_string = array.array("i", (string_ids[graph.files[file_id]]
+                                          for file_id in range(len(graph.files))))
+        fct_2_string = array.array("i", (string_ids[graph.functions[fct_id]]
+                                         for fct_id in range(len(graph.functions))))
+
+        encoded_strings = bytearray()
+        string_offsets = array.array("q", [0])
+        for string in strings:
+            encoded_strings += string.encode()
+            string_offsets.append(len(encoded_strings))
+
+        entry_of = array.array("i", [-1]) * len(strings)
+        flag_sets = array.array("i")
+        flags = array.array("i")
+        for flag_set in graph.flag_sets.strings:
+            flag_sets.extend((len(flags), len(flag_set.includes), len(flag_set.defines),
+                              len(flag_set.flags)))
+            flags.extend(string_ids[flag] for flag in flag_set.includes + flag_set.defines)
+            flags.extend(string_ids[part] for flag in flag_set.flags for part in flag)
+
+        entries = array.array("i")
+        functions = array.array("i")
+        calls = array.array("i")
+        for file_id, entry in sorted(graph.entries.items(),
+                                     key=lambda item: file_2_string[item[0]]):
+            entry_of[file_2_string[file_id]] = len(entries) // ENTRY_FIELDS
+            entries.extend((file_2_string[file_id], string_ids[entry.name], entry.flag_set,
+                            len(functions) // FUNCTION_FIELDS, len(entry.functions)))
+            for fct_id, fct_calls in entry.functions.items():
+                functions.extend((fct_2_string[fct_id], len(calls),
+                                  len(calls) + len(fct_calls)))
+                for i in range(0, len(fct_calls), 2):
+                    calls.append(fct_2_string[fct_calls[i]])
+                    calls.append(arpa_graph.NO_FILE if fct_calls[i + 1] == arpa_graph.NO_FILE
+                                 else file_2_string[fct_calls[i + 1]])
+
+        contents = {"meta": json.dumps(meta).encode(),
+                    "summaries": b"" if graph.summaries is None
+                                 else json.dumps(graph.summaries.to_json()).encode(),
+                    "reverse_index": b"" if graph.reverse_index is None
+                                     else json.dumps(graph.reverse_index.to_json()).encode(),
+                    "string_offsets": string_offsets.tobytes(),
+                    "strings": bytes(encoded_strings),
+                    "entry_of": entry_of.tobytes(),
+                    "entries": entries.tobytes(),
+                    "flag_sets": flag_sets.tobytes(),
+                    "flags": flags.tobytes(),
+                    "functions": functions.tobytes(),
+                    "calls": calls.tobytes()}
+
+        # sections are aligned, so that they can be cast to arrays once mapped
+        header_fields = [SNAPSHOT_MAGIC, SNAPSHOT_VERSION, BYTE_ORDERS[sys.byteorder]]
+        offset = HEADER.size
+        for section in SECTIONS:
+            offset += -offset % 8
+            header_fields.extend((offset, len(contents[section])))
+            offset += len(contents[section])
+
+        temp_path = "%s.%d" % (path, os.getpid())
+        with open(temp_path, "wb") as handle:
+            handle.write(HEADER.pack(*header_fields))
+            for section in SECTIONS:
+                handle.write(b"\0" * (-handle.tell() % 8))
+                handle.write(contents[section])
+        os.replace(temp_path, path)
+
+
+    @classmethod
+    def load(cls, path):
+        ''' return the snapshot saved at path, or None if it cannot be used '''
+        try:
+            return cls(path)
+        except (OSError, ValueError, struct.error) as error:
+            logging.warning("Could not load the snapshot at %s: %s", path, error)
+            return None
+
+
+class SnapshotCallGraph(arpa_graph.CallGraph):
+    ''' Call graph whose summaries and reverse index are decoded from a snapshot
+    the first time they are accessed '''
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        # json sections that are stored in the snapshot, but not decoded yet
+        self.pending_sections = set()
+        self.section_2_value = {}
+        super().__init__()
+        self.pending_sections = {section for section in JSON_SECTIONS
+                                 if snapshot.has_json_section(section)}
+
+
+    def __get_section(self, section):
+        if section in self.pending_sections:
+            self.pending_sections.discard(section)
+            self.section_2_value[section] = \
+                JSON_SECTIONS[section](self.snapshot.decode_json_section(section))
+        return self.section_2_value[section]
+
+
+    def __set_section(self, section, value):
+        self.pending_sections.discard(section)
+        self.section_2_value[section] = value
+
+
+    @property
+    def summaries(self):
+        ''' function summaries, decoded when first accessed '''
+        return self.__get_section("summaries")
+
+
+    @summaries.setter
+    def summaries(self, summaries):
+        self.__set_section("summaries", summaries)
+
+
+    @property
+    def reverse_index(self):
+        ''' reverse index, decoded when first accessed '''
+        return self.__get_section("reverse_index")
+
+
+    @reverse_index.setter
+    def reverse_index(self, reverse_index):
+        self.__set_section("reverse_index", reverse_index)
+
+
+    def has_summaries(self):
+        ''' check whether summaries are stored in the snapshot or were set '''
+        return "summaries" in self.pending_sections or super().has_summaries()
+
+
+    def has_reverse_index(self):
+        ''' check whether a reverse index is stored in the snapshot or was set '''
+        return "reverse_index" in self.pending_sections or super().has_reverse_index()
+
+
+class SnapshotStringTable(arpa_graph.StringTable):
+    ''' String table whose first strings are read from a snapshot.
+    Strings interned later are appended after them '''
+    __slots__ = ("snapshot",)
+
+    def __init__(self, snapshot):
+        super().__init__()
+        self.snapshot = snapshot
+
+
+    def intern(self, string):
+        string_id = self.get_id(string)
+        if string_id is None:
+            string_id = len(self)
+            self.ids[string] = string_id
+            self.strings.append(string)
+        return string_id
+
+
+    def get_id(self, string):
+        string_id = self.snapshot.find_string(string)
+        return self.ids.get(string) if string_id is None else string_id
+
+
+    def __getitem__(self, string_id):
+        if string_id < self.snapshot.n_strings:
+            return self.snapshot.get_string(string_id)
+        return self.strings[string_id - self.snapshot.n_strings]
+
+
+    def __len__(self):
+        return self.snapshot.n_strings + len(self.strings)
+
+
+class SnapshotEntries(collections.abc.MutableMapping):
+    ''' {file ID: file entry} mapping whose entries are decoded from a snapshot
+    the first time they are accessed '''
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.decoded = {}
+        self.removed = set()
+
+
+    def __getitem__(self, file_id):
+        entry = self.decoded.get(file_id)
+        if entry is None:
+            if file_id in self.removed:
+                raise KeyError(file_id)
+            entry = self.snapshot.decode_entry(file_id)
+            self.decoded[file_id] = entry
+        return entry
+
+
+    def __setitem__(self, file_id, entry):
+        self.decoded[file_id] = entry
+        self.removed.discard(file_id)
+
+
+    def __delitem__(self, file_id):
+        if file_id not in self:
+            raise KeyError(file_id)
+        self.decoded.pop(file_id, None)
+        self.removed.add(file_id)
+
+
+    def __contains__(self, file_id):
+        if file_id in self.decoded:
+            return True
+        return file_id not in self.removed and self.snapshot.has_entry(file_id)
+
+
+    def __iter__(self):
+        for file_id in self.snapshot.entry_file_ids():
+            if file_id not in self.removed:
+                yield file_id
+        for file_id in list(self.decoded):
+            if not self.snapshot.has_entry(file_id):
+                yield file_id
+
+
+    def __len__(self):
+        return sum(1 for _ in self)
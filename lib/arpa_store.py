@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+#   Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License").
+#   You may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+This module contains the SQLite store of the arpa internal representation
+'''
+
+import os
+import json
+import sqlite3
+import lib.arpa_helper as helper
+import lib.arpa_graph as arpa_graph
+
+# bump this version whenever the schema changes, to invalidate existing stores
+STORE_VERSION = "3"
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, name TEXT,
+                    flag_set_id INTEGER);
+CREATE TABLE flags (flag_set_id INTEGER, kind TEXT, position INTEGER, value TEXT);
+CREATE TABLE functions (id INTEGER PRIMARY KEY, file_id INTEGER, name TEXT);
+CREATE TABLE calls (caller_id INTEGER, position INTEGER, called_name TEXT,
+                    called_file_id INTEGER);
+CREATE INDEX flags_flag_set ON flags (flag_set_id);
+CREATE INDEX functions_name ON functions (name);
+CREATE INDEX functions_file ON functions (file_id, name);
+CREATE INDEX calls_caller ON calls (caller_id);
+CREATE INDEX calls_called ON calls (called_name);
+'''
+
+# functions transitively called by the functions of the files in the roots table
+REACHED_QUERY = '''
+CREATE TEMP TABLE reached AS
+WITH RECURSIVE reachable(id) AS (
+    SELECT functions.id FROM functions
+    JOIN files ON files.id = functions.file_id
+    JOIN roots ON roots.path = files.path
+    UNION
+    SELECT callee.id FROM reachable
+    JOIN calls ON calls.caller_id = reachable.id
+    JOIN functions AS callee ON callee.file_id = calls.called_file_id
+                            AND callee.name = calls.called_name
+)
+SELECT id FROM reachable
+'''
+
+
+class SqliteStore:
+    ''' Class that stores files, flags, functions and calls in an SQLite database,
+    so that consumers can query the parts of the call graph they need '''
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+
+    def __connect(self):
+        return sqlite3.connect(self.db_path)
+
+
+    def write(self, internal_rep):
+        ''' save an internal representation, replacing any previous contents '''
+        graph = internal_rep.graph
+        temp_path = "%s.%d" % (self.db_path, os.getpid())
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        connection = sqlite3.connect(temp_path)
+        with connection:
+            connection.executescript(SCHEMA)
+            connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ("version", STORE_VERSION),
+                (helper.JSON_INFO, internal_rep.root_path),
+                (helper.JSON_INPUTS, json.dumps(internal_rep.inputs)),
+            ])
+            connection.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", (
+                (file_id, graph.files[file_id], entry.name, entry.flag_set)
+                for file_id, entry in graph.entries.items()))
+            connection.executemany("INSERT INTO files VALUES (?, ?, NULL, NULL)", (
+                (file_id, graph.files[file_id])
+                for file_id in range(len(graph.files)) if file_id not in graph.entries))
+            # each distinct flag set is stored once. Other flags have their flag as kind
+            connection.executemany("INSERT INTO flags VALUES (?, ?, ?, ?)", (
+                (flag_set_id, kind, position, value)
+                for flag_set_id, flag_set in enumerate(graph.flag_sets.strings)
+                for kind, values in ((helper.JSON_INC, flag_set.includes),
+                                     (helper.JSON_DEF, flag_set.defines))
+                for position, value in enumerate(values)))
+            connection.executemany("INSERT INTO flags VALUES (?, ?, ?, ?)", (
+                (flag_set_id, flag, position, value)
+                for flag_set_id, flag_set in enumerate(graph.flag_sets.strings)
+                for position, (flag, value) in enumerate(flag_set.flags)))
+
+            function_rows = []
+            call_rows = []
+            for file_id, entry in graph.entries.items():
+                for fct_id, calls in entry.functions.items():
+                    caller_id = len(function_rows)
+                    function_rows.append((caller_id, file_id, graph.functions[fct_id]))
+                    call_rows.extend(
+                        (caller_id, i // 2, graph.functions[calls[i]],
+                         None if calls[i + 1] == arpa_graph.NO_FILE else calls[i + 1])
+                        for i in range(0, len(calls), 2))
+            connection.executemany("INSERT INTO functions VALUES (?, ?, ?)", function_rows)
+            connection.executemany("INSERT INTO calls VALUES (?, ?, ?, ?)", call_rows)
+        connection.close()
+        os.replace(temp_path, self.db_path)
+
+
+    def __get_meta(self, connection, key):
+        row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+
+    def is_up_to_date(self, inputs):
+        ''' check whether the store was built from the given inputs '''
+        try:
+            connection = self.__connect()
+            try:
+                if self.__get_meta(connection, "version") != STORE_VERSION:
+                    return False
+                stored_inputs = self.__get_meta(connection, helper.JSON_INPUTS)
+            finally:
+                connection.close()
+        except sqlite3.DatabaseError:
+            return False
+        return stored_inputs is not None and json.loads(stored_inputs) == inputs
+
+
+    def load_reachable(self, graph, harness_paths):
+        ''' add to a graph the entries of the given files, with the functions they
+        define and all the functions these transitively call, and nothing else '''
+        connection = self.__connect()
+        with connection:
+            connection.execute("CREATE TEMP TABLE roots (path TEXT)")
+            connection.executemany("INSERT INTO roots VALUES (?)",
+                                   ((path,) for path in harness_paths))
+            connection.execute(REACHED_QUERY)
+
+            connection.execute('''
+                CREATE TEMP TABLE loaded_files AS
+                SELECT functions.file_id AS id FROM reached
+                JOIN functions ON functions.id = reached.id
+                UNION
+                SELECT files.id FROM files JOIN roots ON roots.path = files.path''')
+
+            entry_2_flag_set = []
+            for path, name, flag_set_id in connection.execute('''
+                    SELECT files.path, files.name, files.flag_set_id FROM loaded_files
+                    JOIN files ON files.id = loaded_files.id
+                    WHERE files.name IS NOT NULL'''):
+                entry = graph.add_file(path)
+                entry.name = name
+                entry_2_flag_set.append((entry, flag_set_id))
+            flag_set_2_flags = {}
+            for flag_set_id, kind, value in connection.execute('''
+                    SELECT flags.flag_set_id, flags.kind, flags.value FROM flags
+                    WHERE flags.flag_set_id IN (
+                        SELECT files.flag_set_id FROM loaded_files
+                        JOIN files ON files.id = loaded_files.id)
+                    ORDER BY flags.flag_set_id, flags.position'''):
+                includes, defines, flags = flag_set_2_flags.setdefault(flag_set_id,
+                                                                       ([], [], []))
+                if kind == helper.JSON_INC:
+                    includes.append(value)
+                elif kind == helper.JSON_DEF:
+                    defines.append(value)
+                else:
+                    flags.append((kind, value))
+            for entry, flag_set_id in entry_2_flag_set:
+                includes, defines, flags = flag_set_2_flags.get(flag_set_id, ([], [], []))
+                entry.flag_set = graph.flag_sets.intern(
+                    arpa_graph.FlagSet(tuple(includes), tuple(defines), tuple(flags)))
+
+            fct_2_called_functions = {}
+            for fct_id, path, fct in connection.execute('''
+                    SELECT functions.id, files.path, functions.name FROM reached
+                    JOIN functions ON functions.id = reached.id
+                    JOIN files ON files.id = functions.file_id'''):
+                fct_2_called_functions[fct_id] = (path, fct, {})
+            for caller_id, called_fct, called_path in connection.execute('''
+                    SELECT calls.caller_id, calls.called_name, files.path FROM reached
+                    JOIN calls ON calls.caller_id = reached.id
+                    LEFT JOIN files ON files.id = calls.called_file_id
+                    ORDER BY calls.caller_id, calls.position'''):
+                fct_2_called_functions[caller_id][2][called_fct] = called_path
+        connection.close()
+
+        for path, fct, called_functions in fct_2_called_functions.values():
+            graph.get_entry(path).functions[graph.functions.intern(fct)] = \
+                graph.encode_calls(called_functions)
+        graph.invalidate()
+
+
+    def find_definitions(self, fct):
+        ''' return the sorted paths of the files defining a function '''
+        connection = self.__connect()
+        rows = connection.execute('''
+            SELECT files.path FROM functions JOIN files ON files.id = functions.file_id
+            WHERE functions.name = ? ORDER BY files.path''', (fct,)).fetchall()
+        connection.close()
+        return [row[0] for row in rows]
+
+
+    def find_callers(self, fct):
+        ''' return the sorted (file, function) pairs of the functions calling a function '''
+        connection = self.__connect()
+        rows = connection.execute('''
+            SELECT DISTINCT files.path, functions.name FROM calls
+            JOIN functions ON functions.id = calls.caller_id
+            JOIN files ON files.id = functions.file_id
+            WHERE calls.called_name = ? ORDER BY files.path, functions.name''',
+                                  (fct,)).fetchall()
+        connection.close()
+        return rows
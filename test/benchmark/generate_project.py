@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+#   Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License").
+#   You may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Generate synthetic C projects, with their compile commands and the output cflow
+would produce for them, to benchmark arpa
+'''
+
+import os
+import sys
+import json
+import random
+import argparse
+import collections
+
+Scale = collections.namedtuple("Scale", [
+    "files",              # number of source files
+    "functions_per_file", # number of functions defined in each source file
+    "fan_out",            # number of functions called by each function
+    "recursion",          # probability that a function also calls an earlier one
+    "include_depth",      # length of the chain of headers included by each file
+    "flags_per_command",  # number of additional -D flags in each compile command
+    "harnesses",          # number of proof harnesses
+])
+
+SCALES = {
+    "small": Scale(files=50, functions_per_file=10, fan_out=3, recursion=0.05,
+                   include_depth=4, flags_per_command=10, harnesses=10),
+    "medium": Scale(files=500, functions_per_file=20, fan_out=4, recursion=0.05,
+                    include_depth=8, flags_per_command=30, harnesses=50),
+    "large": Scale(files=2000, functions_per_file=40, fan_out=5, recursion=0.05,
+                   include_depth=16, flags_per_command=100, harnesses=200),
+}
+
+FILES_PER_DIR = 50
+# probability that a function calls a function defined nowhere in the project
+MISSING_CALL_PROBABILITY = 0.1
+CFLOW_OUT_NAME = "cflow.out"
+SEED = 0
+
+
+class SyntheticProject:
+    ''' A generated project. Function i of the project is defined in source file
+    i // functions_per_file, and calls functions defined after it, so that the call
+    graph only has the cycles created by the recursion knob '''
+
+    def __init__(self, root, scale, seed=SEED):
+        self.root = os.path.abspath(root)
+        self.scale = scale
+        self.random = random.Random(seed)
+        self.n_functions = scale.files * scale.functions_per_file
+
+        # node -> (function name, path, line), for defined functions
+        self.definitions = {}
+        # node -> ordered called nodes. External functions are names
+        self.calls = {}
+        self.recursive = set()
+        self.source_paths = []
+        self.harness_paths = []
+
+
+    def source_dir(self, file_index):
+        ''' return the directory of a source file '''
+        return os.path.join(self.root, "src", "dir%d" % (file_index // FILES_PER_DIR))
+
+
+    def __create_call_graph(self):
+        scale = self.scale
+        for node in range(self.n_functions):
+            called = []
+            for _ in range(scale.fan_out):
+                if node + 1 < self.n_functions:
+                    called.append(self.random.randrange(node + 1, self.n_functions))
+            if node and self.random.random() < scale.recursion:
+                target = self.random.randrange(0, node)
+                called.append(target)
+                self.recursive.add(target)
+            if self.random.random() < MISSING_CALL_PROBABILITY:
+                called.append("missing_%d" % (node % 97))
+            self.calls[node] = list(dict.fromkeys(called))
+
+        for harness in range(scale.harnesses):
+            node = ("harness", harness)
+            self.calls[node] = list(dict.fromkeys(
+                self.random.randrange(0, self.n_functions)
+                for _ in range(scale.fan_out)))
+
+
+    @classmethod
+    def function_name(cls, node):
+        ''' return the name of a function node '''
+        if isinstance(node, str):
+            return node
+        if isinstance(node, tuple):
+            return "harness"
+        return "fct_%d" % node
+
+
+    def __write(self, path, lines):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as handle:
+            handle.write("\n".join(lines) + "\n")
+
+
+    def __write_function(self, lines, node, path):
+        name = self.function_name(node)
+        lines.append("void %s(void)" % name)
+        self.definitions[node] = (name, path, len(lines))
+        lines.append("{")
+        lines.extend("    %s();" % self.function_name(called) for called in self.calls[node])
+        lines.append("}")
+        lines.append("")
+
+
+    def __write_headers(self):
+        include_dir = os.path.join(self.root, "include")
+        for level in range(self.scale.include_depth):
+            lines = ["#define LEVEL_%d %d" % (level, level)]
+            if level + 1 < self.scale.include_depth:
+                lines.insert(0, "#include \"level%d.h\"" % (level + 1))
+            self.__write(os.path.join(include_dir, "level%d.h" % level), lines)
+
+
+    def __write_sources(self):
+        fpf = self.scale.functions_per_file
+        for file_index in range(self.scale.files):
+            directory = self.source_dir(file_index)
+            nodes = range(file_index * fpf, (file_index + 1) * fpf)
+            self.__write(os.path.join(directory, "file%d.h" % file_index),
+                         ["void %s(void);" % self.function_name(node) for node in nodes])
+
+            path = os.path.join(directory, "file%d.c" % file_index)
+            lines = ["#include \"file%d.h\"" % file_index]
+            if self.scale.include_depth:
+                lines.append("#include <level0.h>")
+            lines.append("")
+            for node in nodes:
+                self.__write_function(lines, node, path)
+            self.__write(path, lines)
+            self.source_paths.append(path)
+
+
+    def __write_harnesses(self):
+        proofs_dir = os.path.join(self.root, "tests", "cbmc", "proofs")
+        for harness in range(self.scale.harnesses):
+            node = ("harness", harness)
+            path = os.path.join(proofs_dir, "h%d" % harness, "h%d_harness.c" % harness)
+            lines = ["void %s(void);" % self.function_name(called)
+                     for called in self.calls[node]]
+            lines.append("")
+            self.__write_function(lines, node, path)
+            self.__write(path, lines)
+            self.harness_paths.append(path)
+        for directory in ("sources", "stubs"):
+            os.makedirs(os.path.join(self.root, "tests", "cbmc", directory), exist_ok=True)
+
+
+    def __write_compile_commands(self):
+        entries = []
+        for file_index, path in enumerate(self.source_paths):
+            directory = os.path.relpath(self.source_dir(file_index), self.root)
+            arguments = ["cc", "-Iinclude", "-I" + directory, "-std=c99",
+                         "-DDIR_%d=1" % (file_index // FILES_PER_DIR)]
+            arguments.extend("-DOPTION_%d=%d" % (i, i)
+                             for i in range(self.scale.flags_per_command))
+            arguments.extend(["-o", path + ".o", "-c", path])
+            # compile commands mix both forms of entries
+            entry = {"directory": self.root, "file": path}
+            if file_index % 2:
+                entry["arguments"] = arguments
+            else:
+                entry["command"] = " ".join(arguments)
+            entries.append(entry)
+        path = self.compile_commands_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as handle:
+            json.dump(entries, handle, indent=2)
+
+
+    def compile_commands_path(self):
+        ''' return the path of the generated compile commands '''
+        return os.path.join(self.root, "build", "compile_commands.json")
+
+
+    def cflow_output(self):
+        ''' return the lines that <cflow -A --no-main --brief> outputs for the
+        project. Every function is a root, and a function described once is
+        then referred to with [see N] '''
+        lines = []
+        described = {}
+        roots = sorted(self.definitions, key=lambda node: self.definitions[node][1:])
+        for root in roots:
+            stack = [(root, 0)]
+            while stack:
+                node, depth = stack.pop()
+                indent = "    " * depth
+                if node not in self.definitions:
+                    lines.append("%s%s()\n" % (indent, node))
+                    continue
+                name, path, line = self.definitions[node]
+                head = "%s%s() <void %s (void) at %s:%d>%s:" % (
+                    indent, name, name, path, line, " (R)" if node in self.recursive else "")
+                if node in described:
+                    lines.append("%s [see %d]\n" % (head, described[node]))
+                    continue
+                lines.append(head + "\n")
+                described[node] = len(lines)
+                stack.extend((called, depth + 1) for called in reversed(self.calls[node]))
+        return lines
+
+
+    def generate(self):
+        ''' write the project, its compile commands and its cflow output '''
+        self.__create_call_graph()
+        self.__write_headers()
+        self.__write_sources()
+        self.__write_harnesses()
+        self.__write_compile_commands()
+        with open(os.path.join(self.root, "build", CFLOW_OUT_NAME), "w") as handle:
+            handle.writelines(self.cflow_output())
+
+
+def main():
+    ''' Generate a synthetic project '''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("root", help="directory in which the project is generated")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small",
+                        help="preset for the knobs that are not given")
+    for knob in Scale._fields:
+        parser.add_argument("--" + knob.replace("_", "-"), dest=knob,
+                            type=float if knob == "recursion" else int)
+    args = parser.parse_args()
+
+    scale = SCALES[args.scale]._replace(**{
+        knob: getattr(args, knob) for knob in Scale._fields
+        if getattr(args, knob) is not None})
+    if os.path.exists(args.root) and os.listdir(args.root):
+        print("%s is not empty" % args.root, file=sys.stderr)
+        sys.exit(1)
+    SyntheticProject(args.root, scale).generate()
+    print("Generated %d functions in %d files under %s"
+          % (scale.files * scale.functions_per_file, scale.files, args.root))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+#   Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License").
+#   You may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Time every phase of arpa on synthetic projects, without running cflow,
+and compare the timings to saved baselines
+'''
+
+import os
+import sys
+import math
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+import generate_project
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+sys.path.insert(0, REPO_ROOT)
+
+# pylint: disable=wrong-import-position
+import lib.arpa_helper as helper
+import lib.arpa_build as arpa_build
+import lib.arpa_graph as arpa_graph
+import lib.arpa_makefile as arpa_makefile
+
+BASELINES_JSON = os.path.join(os.path.dirname(__file__), "baselines.json")
+DEFAULT_TOLERANCE = 0.5
+# differences below this many seconds are noise
+MIN_REGRESSION = 0.02
+
+
+def makefile_args(root):
+    ''' return the arguments of <arpa run> that Makefile reads, with their defaults '''
+    return argparse.Namespace(
+        define_variable="DEFINES", include_variable="INCLUDES",
+        compile_flags_variable="COMPILE_FLAGS", change_dependency_extensions=None,
+        make_root_variable="SRCDIR", make_root_path=root,
+        make_proof_source_variable="PROOF_SOURCE",
+        make_proof_source_path=os.path.join(root, "tests", "cbmc", "sources"),
+        make_proof_source_roots=[],
+        make_proof_stub_variable="PROOF_STUB",
+        make_proof_stub_path=os.path.join(root, "tests", "cbmc", "stubs"),
+        make_project_sources_variable="PROJECT_SOURCES",
+        make_proof_sources_variable="PROOF_SOURCES", save_path=None)
+
+
+class PhaseTimer:
+    ''' Run each phase several times and keep its fastest time '''
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.timings = {}
+
+
+    def run(self, phase, function, setup=None):
+        ''' time function, called after setup (which is not timed) on every repeat.
+        Return the result of the last call '''
+        best = None
+        result = None
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.timings[phase] = round(best, 6)
+        print("%-18s %9.4fs" % (phase, best))
+        return result
+
+
+def run_phases(project, timer, work_dir):
+    ''' time every phase of arpa on a generated project '''
+    root = project.root
+    cc_path = project.compile_commands_path()
+    proofs_dir = os.path.join(root, "tests", "cbmc")
+
+
+    def compile_commands():
+        commands = arpa_build.CompileCommands(cc_path)
+        commands.create_file_2_flags_map()
+        return commands
+    commands = timer.run("compile_commands", compile_commands,
+                         setup=helper.FS_CACHE.invalidate)
+
+    discovery = arpa_build.SourceDiscovery(root, helper.DISCOVER_CC, [proofs_dir])
+
+
+    def find_sources():
+        file_2_includes = {file: flag_set.includes
+                           for file, flag_set in commands.file_2_flags.items()}
+        return arpa_build.SourceDiscovery(root, helper.DISCOVER_CC, [proofs_dir]) \
+            .find_sources(file_2_includes)
+    sources = timer.run("discovery", find_sources, setup=helper.FS_CACHE.invalidate)
+
+    inputs = timer.run("fingerprint", arpa_build.InputFingerprint(
+        cc_path, discovery, helper.BACKEND_CFLOW).compute)
+
+    with open(os.path.join(root, "build", generate_project.CFLOW_OUT_NAME)) as handle:
+        cflow_out = handle.readlines()
+
+
+    def parse_output():
+        cflow = arpa_build.CflowInstance()
+        cflow.parse_output(cflow_out)
+        return cflow.file_2_dependencies
+    file_2_dependencies = timer.run("parse_output", parse_output)
+    n_parsed = sum(len(functions) for functions in file_2_dependencies.values())
+    if n_parsed != len(project.definitions):
+        logging.error("Parsed %d function definitions instead of %d",
+                      n_parsed, len(project.definitions))
+        sys.exit(1)
+
+
+    def build_internal_rep():
+        internal_rep = arpa_build.InternalRepresentation(root)
+        internal_rep.add_inputs(inputs)
+        for file, flag_set in commands.file_2_flags.items():
+            internal_rep.add_file_entry(file)
+            internal_rep.add_flag_set(file, flag_set)
+        internal_rep.add_dependencies(file_2_dependencies)
+        return internal_rep
+    internal_rep = timer.run("internal_rep", build_internal_rep)
+    graph = internal_rep.graph
+
+    timer.run("validate_fast", lambda: internal_rep.validate(helper.VALIDATE_FAST),
+              setup=helper.FS_CACHE.invalidate)
+    timer.run("validate_full", lambda: internal_rep.validate(helper.VALIDATE_FULL),
+              setup=helper.FS_CACHE.invalidate)
+
+    json_path = os.path.join(work_dir, helper.OUT_JSON_NAME)
+    timer.run("serialization", lambda: internal_rep.write_to_file(json_path))
+    timer.run("deserialization", lambda: arpa_build.InternalRepresentation(None)
+              .read_from_file(json_path))
+    snapshot_path = os.path.join(work_dir, "internal_rep.snapshot")
+    timer.run("snapshot", lambda: internal_rep.write_snapshot(snapshot_path))
+
+    harnesses = [(path, graph.get_functions(path)) for path in project.harness_paths]
+
+
+    def traverse():
+        for path, functions in harnesses:
+            helper.FileSpecificInfo(graph).find_custom_info(path, functions)
+    # the reachability engine is built again on every repeat
+    timer.run("reachability", traverse, setup=graph.invalidate)
+
+    timer.run("summaries", lambda: arpa_graph.FunctionSummaries.compute(graph))
+    timer.run("reverse_index", lambda: arpa_graph.ReverseIndex.compute(graph))
+
+    args = makefile_args(root)
+
+
+    def build_makefiles():
+        path_trie = arpa_makefile.PathPrefixTrie.from_args(args)
+        for path, _ in harnesses:
+            arpa_makefile.Makefile(args, graph, path, path_trie).build()
+    timer.run("makefile", build_makefiles, setup=graph.invalidate)
+
+    return {"sources": len(sources), "cflow_lines": len(cflow_out),
+            "functions": len(project.definitions)}
+
+
+def find_regressions(results, baselines, tolerance):
+    ''' return the phases slower than their baseline by more than the tolerance '''
+    regressions = []
+    for scale, result in results.items():
+        baseline = baselines.get(scale)
+        if baseline is None:
+            continue
+        if baseline["knobs"] != result["knobs"]:
+            logging.warning("Knobs of the %s scale differ from its baseline. "
+                            "Not comparing.", scale)
+            continue
+        for phase, elapsed in result["phases"].items():
+            expected = baseline["phases"].get(phase)
+            if expected is None:
+                continue
+            if elapsed > expected * (1 + tolerance) and elapsed - expected > MIN_REGRESSION:
+                regressions.append({"scale": scale, "phase": phase,
+                                    "baseline": expected, "time": elapsed})
+    return regressions
+
+
+def scaling_exponents(results):
+    ''' estimate, for each phase, the exponent k of time = O(functions^k)
+    between the smallest and largest scales that were run '''
+    if len(results) < 2:
+        return {}
+    by_size = sorted(results.values(), key=lambda result: result["size"]["functions"])
+    small, large = by_size[0], by_size[-1]
+    size_ratio = large["size"]["functions"] / small["size"]["functions"]
+    exponents = {}
+    for phase, elapsed in large["phases"].items():
+        small_elapsed = small["phases"].get(phase)
+        if small_elapsed and elapsed and size_ratio > 1:
+            exponents[phase] = round(math.log(elapsed / small_elapsed)
+                                     / math.log(size_ratio), 2)
+    return exponents
+
+
+def main():
+    ''' Run the benchmarks '''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", action="append", dest="scales",
+                        choices=sorted(generate_project.SCALES),
+                        help="scale of the synthetic project. May be repeated. "
+                        "Default: small and medium.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs of each phase. The fastest one is kept.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="relative slowdown over the baseline reported as a regression")
+    parser.add_argument("--baselines", default=BASELINES_JSON,
+                        help="file in which baselines are stored")
+    parser.add_argument("--update-baselines", action="store_true",
+                        help="save the timings of this run as the new baselines")
+    parser.add_argument("--results", help="save the timings of this run to a json file")
+    parser.add_argument("--work-dir", help="directory in which projects are generated. "
+                        "By default, a temporary directory that is removed afterwards.")
+    args = parser.parse_args()
+
+    # arpa logs its own warnings and errors only
+    logging.basicConfig(level=logging.WARNING, format="arpa-bench: %(message)s")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="arpa-bench-")
+    results = {}
+    try:
+        for scale_name in args.scales or ["small", "medium"]:
+            scale = generate_project.SCALES[scale_name]
+            root = os.path.join(work_dir, scale_name)
+            if os.path.isdir(root):
+                shutil.rmtree(root)
+            print("Generating the %s project" % scale_name)
+            project = generate_project.SyntheticProject(root, scale)
+            project.generate()
+
+            timer = PhaseTimer(args.repeat)
+            size = run_phases(project, timer, root)
+            results[scale_name] = {"knobs": scale._asdict(), "size": size,
+                                   "phases": timer.timings}
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+
+    baselines = {}
+    if os.path.isfile(args.baselines):
+        with open(args.baselines) as handle:
+            baselines = json.load(handle)
+    regressions = find_regressions(results, baselines, args.tolerance)
+    exponents = scaling_exponents(results)
+    for phase, exponent in exponents.items():
+        print("%-18s scales as functions^%.2f" % (phase, exponent))
+    for regression in regressions:
+        print("REGRESSION %s/%s: %.4fs (baseline %.4fs)" % (
+            regression["scale"], regression["phase"], regression["time"],
+            regression["baseline"]))
+
+    if args.results:
+        with open(args.results, "w") as handle:
+            json.dump({"results": results, "scaling": exponents,
+                       "regressions": regressions}, handle, indent=4)
+    if args.update_baselines:
+        baselines.update(results)
+        with open(args.baselines, "w") as handle:
+            json.dump(baselines, handle, indent=4, sort_keys=True)
+            handle.write("\n")
+        print("Saved baselines to %s" % args.baselines)
+        return
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
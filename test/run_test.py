@@ -21,14 +21,16 @@ import os
 import logging
 import sys
 import math
+import time
 import datetime
 import pathlib
 import subprocess
 import shutil
 import json
 import uuid
-
-cur_dir = os.path.dirname(__file__)
+import hashlib
+import argparse
+import concurrent.futures
 
 TESTS_DIR = "tests"
 BUILDS_DIR = "build"
@@ -36,6 +38,10 @@ ARPA_DIR = "arpa"
 LOGS_DIR = "logs"
 
 BUILD_COMMANDS_JSON = "build_commands.json"
+RESULTS_JSON = "results.json"
+# file of a build directory that records the inputs of its cmake configure
+BUILD_KEY_FILE = ".arpa-test-key"
+DEFAULT_PROOFS_DIR = "tests/cbmc/proofs"
 
 def create_if_inexistant(direc):
     """ remove, then recreate a directory """
@@ -43,67 +49,150 @@ def create_if_inexistant(direc):
         shutil.rmtree(direc)
     direc.mkdir()
 
-def run_test(test, build_cmd, timestamp, results):
-    """ Run a single test """
-    test_root_dir = pathlib.Path(TESTS_DIR) / test
-    submod_root_path = (test_root_dir / test)
-    logs_path = (test_root_dir / LOGS_DIR)
-    logs_path.mkdir(exist_ok=True)
-
-    # BUILD
-    build_path = (test_root_dir / BUILDS_DIR)
-    create_if_inexistant(build_path)
-
-    build_cmd.extend(["-S", str(submod_root_path)])
-    build_cmd.extend(["-B", str(build_path)])
-    p_build = subprocess.Popen(
-        build_cmd,
+def read_test_config(config):
+    """ return the cmake command, proofs directory and extra <arpa run> flags of a test.
+    A test is configured either by its cmake command, or by a dict that also gives
+    the other two """
+    if isinstance(config, list):
+        config = {"cmake": config}
+    return (list(config["cmake"]), config.get("proofs_dir", DEFAULT_PROOFS_DIR),
+            list(config.get("run_flags", [])))
+
+def compute_build_key(build_cmd, submod_root_path):
+    """ hash the cmake command and the path, size and modification time of every
+    file of the project. The build directory is reused while this key is unchanged """
+    digest = hashlib.sha256(json.dumps(build_cmd).encode())
+    for root, dirs, files in os.walk(submod_root_path):
+        dirs[:] = sorted(d for d in dirs if d != ".git")
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            digest.update(("%s\0%d\0%d\n" % (os.path.relpath(path, submod_root_path),
+                                             stat.st_size, stat.st_mtime_ns)).encode())
+    return digest.hexdigest()
+
+def run_step(cmd, outputs):
+    """ run a command, appending its output to outputs.
+    Return its return code and duration in seconds """
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [str(part) for part in cmd],
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         text=True)
+    stdout, _ = proc.communicate()
+    outputs.append(stdout)
+    return proc.returncode, round(time.perf_counter() - start, 3)
+
+def configure(build_cmd, submod_root_path, build_path, outputs):
+    """ run the cmake configure of a test, unless its build directory is up to date.
+    Return the json record of the step """
+    build_key = compute_build_key(build_cmd, submod_root_path)
+    key_path = build_path / BUILD_KEY_FILE
+    if (build_path / "compile_commands.json").is_file() and key_path.is_file() \
+            and key_path.read_text() == build_key:
+        outputs.append("cmake: reusing %s" % build_path)
+        return {"returncode": 0, "duration": 0.0, "cached": True}
 
-    stdout_build, _ = p_build.communicate()
-    if p_build.returncode:
-        results["build_err"].append(test)
-        return
-
-    # ARPA BUILD JSON
-    arpa_path = (test_root_dir / ARPA_DIR)
-    create_if_inexistant(arpa_path)
-
-    comp_cmds_path = (build_path / "compile_commands.json")
-    arpa_out_path = (arpa_path / "int_rep.json")
-    arpa_cmd = ["arpa", "build",
-                   "-cc", comp_cmds_path,
-                   "-r", submod_root_path,
-                   "-jp", arpa_out_path
-                   ]
-
-    p_arpa = subprocess.Popen(
-        arpa_cmd, stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT, text=True)
-
-    stdout_arpa, _ = p_arpa.communicate()
-
-    log_file = (logs_path / ("%s.txt" % timestamp)).resolve()
-    with open(log_file, "w") as handle:
-        print(stdout_build, file=handle)
-        print(stdout_arpa, file=handle)
-    tmp_link = logs_path / ("latest-%s" % uuid.uuid4())
-    os.symlink(log_file, tmp_link)
-    os.rename(tmp_link, logs_path / "latest")
-
-    if p_arpa.returncode:
-        results["fail"].append(test)
-    else:
-        results["pass"].append(test)
-
-    # TODO test arpa makefile command
+    create_if_inexistant(build_path)
+    build_cmd = build_cmd + ["-S", submod_root_path, "-B", build_path]
+    returncode, duration = run_step(build_cmd, outputs)
+    if not returncode:
+        key_path.write_text(build_key)
+    return {"returncode": returncode, "duration": duration, "cached": False}
+
+def find_harnesses(proofs_path):
+    """ return the sorted paths of all harness files under proofs_path """
+    harnesses = []
+    for root, _, files in os.walk(proofs_path):
+        harnesses.extend(pathlib.Path(root) / file for file in files
+                         if file.endswith("_harness.c"))
+    return sorted(harnesses)
+
+def run_test(test, config, timestamp):
+    """ Run a single test. Return its result and the json record of its steps """
+    build_cmd, proofs_dir, run_flags = read_test_config(config)
+    test_root_dir = pathlib.Path(TESTS_DIR) / test
+    submod_root_path = (test_root_dir / test)
+    logs_path = (test_root_dir / LOGS_DIR)
+    logs_path.mkdir(exist_ok=True)
+    outputs = []
+    steps = {}
+
+    try:
+        # BUILD
+        build_path = (test_root_dir / BUILDS_DIR)
+        steps["cmake"] = configure(build_cmd, submod_root_path, build_path, outputs)
+        if steps["cmake"]["returncode"]:
+            return "build_err", steps
+
+        # ARPA BUILD JSON
+        arpa_path = (test_root_dir / ARPA_DIR)
+        create_if_inexistant(arpa_path)
+
+        comp_cmds_path = (build_path / "compile_commands.json")
+        arpa_out_path = (arpa_path / "int_rep.json")
+        snapshot_path = (arpa_path / "int_rep.snapshot")
+        arpa_cmd = ["arpa", "build",
+                    "-cc", comp_cmds_path,
+                    "-r", submod_root_path,
+                    "-jp", arpa_out_path,
+                    "-sn", snapshot_path
+                    ]
+        returncode, duration = run_step(arpa_cmd, outputs)
+        steps["arpa_build"] = {"returncode": returncode, "duration": duration}
+        if returncode:
+            return "fail", steps
+
+        # ARPA RUN, for every harness, reading the snapshot saved by arpa build
+        makefiles_path = (arpa_path / "makefiles")
+        makefiles_path.mkdir()
+        harnesses = find_harnesses(submod_root_path / proofs_dir)
+        run_records = {}
+        start = time.perf_counter()
+        for harness in harnesses:
+            rel_path = harness.relative_to(submod_root_path / proofs_dir)
+            makefile_path = (makefiles_path / rel_path.parent / "Makefile.arpa")
+            makefile_path.parent.mkdir(parents=True, exist_ok=True)
+            arpa_cmd = ["arpa", "run",
+                        "-cc", comp_cmds_path,
+                        "-r", submod_root_path,
+                        "-sn", snapshot_path,
+                        "-file", harness,
+                        "-sp", makefile_path
+                        ] + run_flags
+            returncode, duration = run_step(arpa_cmd, outputs)
+            run_records[str(rel_path)] = {"returncode": returncode, "duration": duration}
+        failed = sorted(h for h, record in run_records.items() if record["returncode"])
+        steps["arpa_run"] = {"duration": round(time.perf_counter() - start, 3),
+                             "harnesses": run_records, "failed": failed}
+        return ("fail" if failed else "pass"), steps
+    finally:
+        log_file = (logs_path / ("%s.txt" % timestamp)).resolve()
+        with open(log_file, "w") as handle:
+            for output in outputs:
+                print(output, file=handle)
+        tmp_link = logs_path / ("latest-%s" % uuid.uuid4())
+        os.symlink(log_file, tmp_link)
+        os.rename(tmp_link, logs_path / "latest")
 
 
 def main():
     """ Run all tests """
 
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("tests", nargs="*",
+                        help="tests to run (by default, all tests under %s)" % TESTS_DIR)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of tests to run in parallel")
+    parser.add_argument("--results", default=RESULTS_JSON,
+                        help="file in which the result and step durations of each test \
+            are saved")
+    args = parser.parse_args()
+
     logging.basicConfig(
         level=logging.INFO, format="arpa-test: %(message)s")
 
@@ -114,6 +203,7 @@ def main():
         "fail": [],
         "build_err": []
     }
+    records = {}
 
     stamp = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
 
@@ -121,20 +211,30 @@ def main():
     with open(BUILD_COMMANDS_JSON, "r") as json_file:
         build_cmds_json = json.load(json_file)
 
-    n_tests = len(os.listdir(TESTS_DIR))
+    tests = args.tests or sorted(os.listdir(TESTS_DIR))
+    n_tests = len(tests)
     width = int(math.log10(n_tests)) + 1
-    cnt = 1
-    for test in os.listdir(TESTS_DIR):
-        print("\rrunning test {cnt:{width}}/{n_tests}".format(
-            cnt=cnt, width=width, n_tests=n_tests), end="")
-        sys.stdout.flush()
-        cnt += 1
-        build_cmd = build_cmds_json[test]
-        run_test(test, build_cmd, stamp, results)
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(run_test, test, build_cmds_json[test], stamp): test
+                   for test in tests}
+        for cnt, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            test = futures[future]
+            result, steps = future.result()
+            results[result].append(test)
+            records[test] = {"result": result, "steps": steps}
+            print("\rfinished test {cnt:{width}}/{n_tests}".format(
+                cnt=cnt, width=width, n_tests=n_tests), end="")
+            sys.stdout.flush()
+
+    with open(args.results, "w") as handle:
+        json.dump({"timestamp": stamp,
+                   "duration": round(time.perf_counter() - start, 3),
+                   "tests": records}, handle, indent=4, sort_keys=True)
 
     print()
     for result, tests in results.items():
-        for test in tests:
+        for test in sorted(tests):
             print("%s %s" % (result.upper(), test))
     print("{n_pass:{width}}/{n_tests} tests passed".format(
         n_pass=len(results["pass"]), width=width, n_tests=n_tests))
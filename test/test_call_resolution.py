@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+#   Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License").
+#   You may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Check that calls to a function defined in several files are resolved to the same
+file whatever the number of cflow jobs. Run with <python3 -m unittest> from this
+directory. cflow is replaced by a script that, like cflow, reports the last
+definition it saw of each called function
+'''
+
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import unittest
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, REPO_ROOT)
+
+# pylint: disable=wrong-import-position
+import lib.arpa_build as arpa_build
+
+FAKE_CFLOW = '''#!%s
+import re
+import sys
+files = [arg for arg in sys.argv[1:] if not arg.startswith("-")]
+definitions = []
+for path in files:
+    with open(path) as handle:
+        for line in handle:
+            match = re.match(r"(?:static )?int (\\w+)\\(void\\) { (.*) }", line)
+            if match:
+                definitions.append((match.group(1), path, re.findall(r"(\\w+)\\(", match.group(2))))
+location = {fct: path for fct, path, _ in definitions}
+for fct, path, calls in definitions:
+    print("%%s() <int %%s (void) at %%s:1>:" %% (fct, fct, path))
+    for called in calls:
+        if called in location:
+            print("    %%s() <int %%s (void) at %%s:1>:" %% (called, called, location[called]))
+        else:
+            print("    %%s()" %% called)
+''' % sys.executable
+
+SOURCES = {
+    "a.c": "static int helper(void) { return 1; }\n",
+    "b.c": "static int helper(void) { return 2; }\n",
+    "c.c": "int caller(void) { return helper(); }\n",
+}
+
+
+class DuplicatedStaticFunctionTest(unittest.TestCase):
+    ''' A static function defined in a.c and b.c, and called from c.c '''
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name, contents in SOURCES.items():
+            with open(os.path.join(self.root, name), "w") as handle:
+                handle.write(contents)
+        self.cflow = os.path.join(self.root, "cflow")
+        with open(self.cflow, "w") as handle:
+            handle.write(FAKE_CFLOW)
+        os.chmod(self.cflow, os.stat(self.cflow).st_mode | stat.S_IXUSR)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+
+    def __resolve_helper(self, jobs):
+        ''' return the file that the call to helper from c.c is resolved to '''
+        cflow = arpa_build.CflowInstance(jobs)
+        # c.c comes last, so that a single cflow call sees the definition in b.c last
+        cflow.create_command(self.root, [os.path.join(self.root, name)
+                                         for name in ("a.c", "b.c", "c.c")])
+        for instance in [cflow] + cflow.shards:
+            instance.command[0] = self.cflow
+        cflow.run_command()
+        return cflow.file_2_dependencies[os.path.join(self.root, "c.c")]["caller"]["helper"]
+
+
+    def test_same_resolution_for_any_number_of_jobs(self):
+        expected = os.path.join(self.root, "a.c")
+        self.assertEqual(self.__resolve_helper(1), expected)
+        self.assertEqual(self.__resolve_helper(3), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+#   Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License").
+#   You may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Validate arpa on a CBMC proof suite: compare, for every proof, the goto program
+built from its Makefile to the goto program built from the Makefile arpa generates
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import shutil
+import difflib
+import hashlib
+import logging
+import argparse
+import subprocess
+import concurrent.futures
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, REPO_ROOT)
+
+# pylint: disable=wrong-import-position
+import lib.arpa_helper as helper
+
+ARPA_PATH = os.path.join(REPO_ROOT, helper.TOOL_NAME)
+LOGS_DIR = "arpa-validation-logs"
+ARTIFACTS_DIR = "artifacts"
+RESULTS_JSON = "arpa-validation-results.json"
+CACHE_DIR = "arpa-validation-cache"
+CACHE_JSON = "cache.json"
+
+DEFAULT_PROOF_SOURCE_DIR = "tests/cbmc/sources"
+DEFAULT_PROOF_STUB_DIR = "tests/cbmc/stubs"
+
+# dependencies of a Makefile, except the harness file itself
+DEPENDENCY_REGEX = re.compile(r"PROOF_SOURCES \+= \$\(PROOF_.*|PROJECT_SOURCES \+= .*")
+# stubs are not expected to be found by arpa
+STUB_REGEX = re.compile(r"PROOF_SOURCES \+= \$\(PROOF_STUB\)")
+# dependencies replaced by the ones of Makefile.arpa
+REPLACED_REGEX = re.compile(r"PROOF_SOURCES \+= \$\(PROOF_SOURCE\).*|PROJECT_SOURCES \+= .*")
+COMMON_INCLUDE = "include ../Makefile.common"
+VARIABLE_REGEX = re.compile(r"\$\((\w+)\)")
+
+STATUS_SUCCESS = "SUCCESS"
+STATUS_OVERRIDE = "SUCCESS-OVERRIDE"
+STATUS_FAILURE = "FAILURE"
+STATUS_ERROR = "ERROR"
+
+
+class GotoToolchain:
+    ''' Commands that build the goto program of a proof and list its functions.
+    By default, these are make and cbmc, but any command with the same interface
+    may replace them (e.g. in tests, where CBMC is not installed) '''
+
+    def __init__(self, make_cmd, show_functions_cmd):
+        self.make_cmd = shlex.split(make_cmd)
+        self.show_functions_cmd = shlex.split(show_functions_cmd)
+
+
+    def describe(self):
+        ''' return the commands, which are part of the cache key of every proof '''
+        return [self.make_cmd, self.show_functions_cmd]
+
+
+    def clean(self, proof_dir):
+        ''' remove the build artifacts of a proof '''
+        subprocess.run(self.make_cmd + ["veryclean"], cwd=proof_dir,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+
+
+    def list_functions(self, proof_dir, makefile, harness):
+        ''' build the goto program of a proof with a Makefile, and return its
+        functions without comments. Raise RuntimeError if a command fails '''
+        self.clean(proof_dir)
+        proc = subprocess.run(self.make_cmd + ["-f", makefile, "goto"], cwd=proof_dir,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              text=True, check=False)
+        if proc.returncode:
+            raise RuntimeError("goto build failed with %s:\n%s" % (makefile, proc.stdout))
+        goto_path = os.path.join("gotos", harness + ".goto")
+        proc = subprocess.run(self.show_functions_cmd + [goto_path], cwd=proof_dir,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              text=True, check=False)
+        if proc.returncode:
+            raise RuntimeError("could not list the functions of %s:\n%s"
+                               % (goto_path, proc.stderr))
+        return [line for line in proc.stdout.splitlines() if "//" not in line]
+
+
+def get_deps(makefile_text):
+    ''' return the sorted dependencies of a Makefile, and those that are not stubs '''
+    deps = sorted(match.group(0) for match in DEPENDENCY_REGEX.finditer(makefile_text))
+    return deps, [dep for dep in deps if not STUB_REGEX.match(dep)]
+
+
+def create_makefile_for_arpa(makefile_text):
+    ''' remove all dependencies (except stubs) from the Makefile of a proof,
+    and include Makefile.arpa instead '''
+    text = REPLACED_REGEX.sub("", makefile_text)
+    return text.replace(COMMON_INCLUDE, "include %s\n%s" % (helper.OUT_MF_NAME,
+                                                             COMMON_INCLUDE))
+
+
+def compute_stats(std_text, arpa_text, identical):
+    ''' compare the dependencies found by arpa to those of the existing Makefile '''
+    deps_std, non_stubs_std = get_deps(std_text)
+    deps_arpa, non_stubs_arpa = get_deps(arpa_text)
+    common = set(non_stubs_std) & set(non_stubs_arpa)
+    n_stubs_std = len(deps_std) - len(non_stubs_std)
+
+    missed = []
+    if identical:
+        # all the dependencies found by both approaches are necessary, and the others
+        # of the existing Makefile are not
+        n_necessary = len(common)
+    else:
+        # arpa is assumed to miss some dependencies
+        n_necessary = len(deps_std) - n_stubs_std
+        missed = sorted(dep.split(" += ", 1)[1] for dep in set(non_stubs_std) - common)
+
+    return {"deps_std": len(deps_std),
+            "stubs_std": n_stubs_std,
+            "deps_arpa": len(deps_arpa),
+            "stubs_arpa": len(deps_arpa) - len(non_stubs_arpa),
+            "deps_common": len(common),
+            "deps_necessary": n_necessary,
+            "deps_unnecessary": len(deps_std) - n_stubs_std - n_necessary,
+            "deps_additional": len(deps_arpa) - len(common),
+            "percent_found": len(common) * 100 // n_necessary if n_necessary else 100,
+            "missed_deps": missed,
+            "diff": list(difflib.unified_diff(deps_arpa, deps_std, "arpa", "std",
+                                              lineterm="", n=0))}
+
+
+class ProofValidator:
+    ''' Validate the proofs of a suite, reusing the results of the proofs whose
+    inputs did not change since they were last validated '''
+
+    def __init__(self, args, toolchain):
+        self.args = args
+        self.toolchain = toolchain
+        self.root = os.path.abspath(args.root_dir)
+        self.variables = {
+            "SRCDIR": self.root,
+            "PROOF_SOURCE": os.path.join(self.root, args.proof_source_dir),
+            "PROOF_STUB": os.path.join(self.root, args.proof_stub_dir)}
+        self.cache_path = os.path.join(args.cache_dir, CACHE_JSON)
+        self.cache = {}
+        if os.path.isfile(self.cache_path):
+            with open(self.cache_path) as handle:
+                self.cache = json.load(handle)
+        self.fingerprints = {}
+        self.headers_digest = None
+
+
+    def create_makefiles(self):
+        ''' generate the Makefile.arpa of every proof with a single <arpa run-all>,
+        which builds the internal representation once (or reuses the one saved by
+        the previous validation if its inputs are unchanged) '''
+        rep_path = os.path.join(self.args.cache_dir, helper.OUT_JSON_NAME)
+        cmd = [self.args.arpa, "run-all",
+               "-cc", os.path.abspath(self.args.compile_commands),
+               "-r", self.root,
+               "-pd", os.path.abspath(self.args.proofs_dir),
+               "-jp", rep_path,
+               "-msrp", self.args.proof_source_dir,
+               "-mstp", self.args.proof_stub_dir,
+               "-j", str(self.args.jobs)]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              text=True, check=False)
+        if proc.returncode:
+            logging.error("arpa run-all failed:\n%s", proc.stdout)
+            sys.exit(1)
+
+        with open(rep_path) as handle:
+            inputs = json.load(handle)[helper.JSON_INPUTS]
+        self.fingerprints = inputs[helper.JSON_FPRINTS]
+        # any header may be included by any proof
+        digest = hashlib.sha256()
+        for path in sorted(self.fingerprints):
+            if path.endswith(".h"):
+                digest.update(("%s\0%s\n" % (path, self.fingerprints[path])).encode())
+        self.headers_digest = digest.hexdigest()
+
+
+    def __resolve(self, dependency, proof_dir):
+        variables = dict(self.variables, PROOFDIR=proof_dir)
+        return VARIABLE_REGEX.sub(lambda match: variables.get(match.group(1), match.group(0)),
+                                  dependency.split(" += ", 1)[1])
+
+
+    def __fingerprint(self, path):
+        if path in self.fingerprints:
+            return self.fingerprints[path]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return "%d:%d" % (stat.st_size, stat.st_mtime_ns)
+
+
+    def compute_key(self, proof_dir, harness, texts):
+        ''' hash the toolchain, the Makefiles of a proof and the fingerprints of its
+        harness, of its dependencies and of all headers '''
+        digest = hashlib.sha256(json.dumps(self.toolchain.describe()).encode())
+        common_path = os.path.join(os.path.dirname(proof_dir), "Makefile.common")
+        paths = [common_path, os.path.join(proof_dir, harness)]
+        for text in texts:
+            digest.update(text.encode())
+            paths.extend(self.__resolve(dep, proof_dir) for dep in get_deps(text)[0])
+        for path in paths:
+            digest.update(("%s\0%s\n" % (path, self.__fingerprint(path))).encode())
+        digest.update(self.headers_digest.encode())
+        return digest.hexdigest()
+
+
+    def validate(self, proof):
+        ''' compare the goto programs of a proof. Return its json record '''
+        start = time.perf_counter()
+        proof_dir = os.path.abspath(os.path.join(self.args.proofs_dir, proof))
+        harness = proof + "_harness.c"
+        for file in ("Makefile", harness, helper.OUT_MF_NAME):
+            if not os.path.isfile(os.path.join(proof_dir, file)):
+                return {"status": STATUS_ERROR,
+                        "error": "%s does not exist in (%s)" % (file, proof)}
+
+        with open(os.path.join(proof_dir, "Makefile")) as handle:
+            std_text = handle.read()
+        with open(os.path.join(proof_dir, helper.OUT_MF_NAME)) as handle:
+            arpa_text = handle.read()
+        artifacts_dir = os.path.join(self.args.logs_dir, ARTIFACTS_DIR, proof)
+        os.makedirs(artifacts_dir)
+        makefile_for_arpa = os.path.join(artifacts_dir, "Makefile-for-arpa")
+        with open(makefile_for_arpa, "w") as handle:
+            handle.write(create_makefile_for_arpa(std_text))
+
+        key = self.compute_key(proof_dir, harness, [std_text, arpa_text])
+        comparison = self.cache.get(key)
+        cached = comparison is not None
+        if not cached:
+            try:
+                fcts_std = self.toolchain.list_functions(proof_dir, "Makefile", harness)
+                fcts_arpa = self.toolchain.list_functions(proof_dir, makefile_for_arpa,
+                                                          harness)
+            except RuntimeError as error:
+                return {"status": STATUS_ERROR, "error": str(error)}
+            finally:
+                self.toolchain.clean(proof_dir)
+            comparison = {"identical": fcts_std == fcts_arpa}
+            if not comparison["identical"]:
+                comparison["goto_diff"] = list(difflib.unified_diff(
+                    fcts_std, fcts_arpa, "std", "arpa", lineterm=""))
+
+        record = compute_stats(std_text, arpa_text, comparison["identical"])
+        record.update(comparison, key=key, cached=cached,
+                      duration=round(time.perf_counter() - start, 3))
+        if comparison["identical"]:
+            record["status"] = STATUS_SUCCESS
+            shutil.rmtree(artifacts_dir)
+        else:
+            record["status"] = STATUS_FAILURE
+            shutil.copy(os.path.join(proof_dir, "Makefile"),
+                        os.path.join(artifacts_dir, "Makefile-for-std"))
+            shutil.copy(os.path.join(proof_dir, helper.OUT_MF_NAME), artifacts_dir)
+            with open(os.path.join(artifacts_dir, "goto-functions-diff"), "w") as handle:
+                handle.write("\n".join(comparison["goto_diff"]) + "\n")
+        return record
+
+
+    def save_cache(self, records):
+        ''' save the goto comparisons of the proofs that were validated '''
+        for record in records.values():
+            if record["status"] != STATUS_ERROR:
+                self.cache[record["key"]] = {
+                    key: record[key] for key in ("identical", "goto_diff") if key in record}
+        with open(self.cache_path, "w") as handle:
+            json.dump(self.cache, handle)
+
+
+def ask_override(proof, record):
+    ''' print the goto functions diff of a failed proof, and ask whether to override it '''
+    print("\n----- Here is the goto functions diff of %s -----\n" % proof)
+    print("\n".join(record["goto_diff"]))
+    while True:
+        override = input("Do you wish to OVERRIDE? ")
+        if override[:1] in ("Y", "y", "N", "n"):
+            return override[:1] in ("Y", "y")
+        print("Please answer yes or no.")
+
+
+def compute_totals(records):
+    ''' return the statistics of all proofs '''
+    proofs = [record for record in records.values() if record["status"] != STATUS_ERROR]
+    totals = {"proofs": len(records),
+              "validated": len(proofs),
+              "successes": sum(1 for r in proofs if r["status"] != STATUS_FAILURE),
+              "errors": len(records) - len(proofs),
+              "cached": sum(1 for r in proofs if r["cached"])}
+    totals["success_rate"] = totals["successes"] * 100 // len(proofs) if proofs else 0
+    for stat in ("deps_std", "stubs_std", "deps_necessary", "deps_unnecessary",
+                 "deps_arpa", "deps_common", "deps_additional", "stubs_arpa"):
+        totals[stat] = sum(record[stat] for record in proofs)
+    totals["proofs_with_unnecessary_deps"] = sum(1 for r in proofs if r["deps_unnecessary"])
+    totals["percent_found"] = (totals["deps_common"] * 100 // totals["deps_necessary"]
+                               if totals["deps_necessary"] else 100)
+    totals["average_percent_found"] = (sum(r["percent_found"] for r in proofs) // len(proofs)
+                                       if proofs else 0)
+    totals["missed_at_least_once"] = sorted({dep for r in proofs for dep in r["missed_deps"]})
+    totals["overridden"] = sorted(proof for proof, r in records.items()
+                                  if r["status"] == STATUS_OVERRIDE)
+    return totals
+
+
+def main():
+    ''' Validate all proofs of a suite '''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("proofs_dir", metavar="PROOFS_SOURCE_DIR",
+                        help="directory containing all the CBMC proofs, one per directory")
+    parser.add_argument("-cc", "--compile-commands", required=True, metavar="FILE",
+                        help="path to the compile_commands json file of the project")
+    parser.add_argument("-r", "--root-dir", required=True, metavar="DIR",
+                        help="root directory of the project")
+    parser.add_argument("-msrp", "--proof-source-dir", default=DEFAULT_PROOF_SOURCE_DIR,
+                        metavar="DIR", help="proof sources directory, relative to the root")
+    parser.add_argument("-mstp", "--proof-stub-dir", default=DEFAULT_PROOF_STUB_DIR,
+                        metavar="DIR", help="proof stubs directory, relative to the root")
+    override_group = parser.add_mutually_exclusive_group()
+    override_group.add_argument("-m", "--manual-override", action="store_true",
+                                help="ask whether to override each failure")
+    override_group.add_argument("-o", "--override-proofs", metavar="FILE",
+                                help="file listing the proofs whose failures are overridden")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), metavar="N",
+                        help="number of proofs validated in parallel")
+    parser.add_argument("--make", default="make", metavar="CMD",
+                        help="command that builds the goto program of a proof")
+    parser.add_argument("--show-goto-functions", default="cbmc --show-goto-functions",
+                        metavar="CMD",
+                        help="command that prints the functions of a goto program")
+    parser.add_argument("--arpa", default=ARPA_PATH, metavar="FILE",
+                        help="path to the arpa executable")
+    parser.add_argument("--logs-dir", default=LOGS_DIR, metavar="DIR",
+                        help="directory where the json log and failure artifacts are saved. \
+            It is emptied first.")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, metavar="DIR",
+                        help="directory where the internal representation and the results \
+            of previous validations are kept")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="arpa-validation: %(message)s")
+    if not os.path.isdir(args.proofs_dir):
+        logging.error("Please include a valid Proof Source Directory")
+        sys.exit(1)
+    proofs_to_override = set()
+    if args.override_proofs:
+        if not os.path.isfile(args.override_proofs):
+            logging.error("Specified path does not point to an existing file: %s",
+                          args.override_proofs)
+            sys.exit(1)
+        with open(args.override_proofs) as handle:
+            proofs_to_override = {line.strip() for line in handle}
+
+    args.logs_dir = os.path.abspath(args.logs_dir)
+    args.cache_dir = os.path.abspath(args.cache_dir)
+    if os.path.isdir(args.logs_dir):
+        shutil.rmtree(args.logs_dir)
+    os.makedirs(os.path.join(args.logs_dir, ARTIFACTS_DIR))
+    os.makedirs(args.cache_dir, exist_ok=True)
+
+    toolchain = GotoToolchain(args.make, args.show_goto_functions)
+    validator = ProofValidator(args, toolchain)
+    logging.info("Generating the Makefiles of all proofs")
+    validator.create_makefiles()
+
+    proofs = sorted(d for d in os.listdir(args.proofs_dir)
+                    if os.path.isdir(os.path.join(args.proofs_dir, d)))
+    records = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(validator.validate, proof): proof for proof in proofs}
+        for cnt, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            proof = futures[future]
+            records[proof] = future.result()
+            logging.info("(%d/%d) - %s%s - %s", cnt, len(proofs), records[proof]["status"],
+                         " (cached)" if records[proof].get("cached") else "", proof)
+    validator.save_cache(records)
+
+    for proof in sorted(records):
+        record = records[proof]
+        if record["status"] != STATUS_FAILURE:
+            continue
+        if proof in proofs_to_override or \
+                (args.manual_override and ask_override(proof, record)):
+            record["status"] = STATUS_OVERRIDE
+
+    totals = compute_totals(records)
+    results_path = os.path.join(args.logs_dir, RESULTS_JSON)
+    with open(results_path, "w") as handle:
+        json.dump({"proofs": dict(sorted(records.items())), "totals": totals},
+                  handle, indent=4)
+    logging.info("%d/%d proofs succeeded (%d%%). Results saved at %s",
+                 totals["successes"], totals["validated"], totals["success_rate"],
+                 os.path.abspath(results_path))
+    sys.exit(1 if totals["successes"] < totals["proofs"] else 0)
+
+
+if __name__ == "__main__":
+    main()